@@ -0,0 +1,318 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+from create_med2vec_input import parse_line, prune_record, read_pruned_codes
+from itertools import combinations
+import numpy as np
+import os
+from result_store import insert_sets
+import time
+
+### This script finds the most frequent code pairs and triples of the visits
+### in bounded memory, for vocabularies too large for the co_occ_dct of
+### cooccurrence_svd_baseline.py. The visits are read from
+### ./data/HIS_tuple_word.txt in two passes, the first counting the visits of
+### each patient so that, as in create_med2vec_input.py, only patients with
+### more than one visit are counted. Pairs and triples are unordered.
+### Each of the pair and triple counts is a count-min sketch of depth
+### ceil(ln(1 / delta)) rows of width 2^ceil(log2(e / epsilon)) counters, with
+### conservative update: a key only raises its counters to its new estimate.
+### For N pair (or triple) occurrences, an estimate is never below the true
+### count, and with probability at least 1 - delta it is at most epsilon * N
+### above it. The n_top * candidate_factor keys with the largest estimates are
+### tracked, and any key whose true count is larger than the smallest tracked
+### estimate is tracked. A second set of pairs is tracked by estimate /
+### (count_a * count_b) with the code counts seen so far, among pairs with an
+### estimate of at least min_count, so that rare pairs of rare codes can be
+### listed by PMI. Outputs, in ./results/approximate_cooccurrence,
+###     pair_cooccurrence.txt: the top pairs by estimated count.
+###     pair_pmi.txt: the pairs tracked by PMI, by log2(co / (count_a *
+###         count_b)), the PMI of cooccurrence_svd_baseline.py. As the estimate
+###         is at most epsilon * N too high, the PMI is at most log2(co /
+###         max(1, co - epsilon * N)) too high.
+###     triple_cooccurrence.txt: the top triples by estimated count.
+### Codes in fewer than min_count visits are left out of the lists. Each line
+### has the codes, the score, its error bound, and the code counts.
+
+data_fname = './data/HIS_tuple_word.txt'
+out_folder = './results/approximate_cooccurrence'
+# Visits counted at a time.
+batch_size = 4096
+# Keys generated at a time. Bounds the key arrays of visits with many codes.
+max_batch_keys = 2 ** 22
+# Bits of a code id in a pair or triple key.
+id_bits = 21
+
+class CountMinSketch(object):
+    '''
+    A count-min sketch of integer keys with conservative update.
+    '''
+    def __init__(self, epsilon, delta, seed):
+        self.log_width = int(np.ceil(np.log2(np.e / epsilon)))
+        self.depth = int(np.ceil(np.log(1 / delta)))
+        self.table = np.zeros((self.depth, 2 ** self.log_width),
+            dtype=np.uint32)
+        rng = np.random.RandomState(seed)
+        # Odd multipliers for multiply-add-shift hashing.
+        self.multipliers = rng.randint(0, 2 ** 62, size=self.depth).astype(
+            np.uint64) * np.uint64(2) + np.uint64(1)
+        self.increments = rng.randint(0, 2 ** 62, size=self.depth).astype(
+            np.uint64)
+        self.total = 0
+
+    def get_columns(self, keys, row):
+        return ((keys * self.multipliers[row] + self.increments[row]) >>
+            np.uint64(64 - self.log_width)).astype(np.int64)
+
+    def query(self, keys):
+        keys = keys.astype(np.uint64)
+        return np.min([self.table[row, self.get_columns(keys, row)] for row in
+            range(self.depth)], axis=0)
+
+    def update(self, keys, counts):
+        '''
+        Adds counts to distinct keys.
+        '''
+        keys = keys.astype(np.uint64)
+        columns = [self.get_columns(keys, row) for row in range(self.depth)]
+        estimates = np.min([self.table[row, columns[row]] for row in range(
+            self.depth)], axis=0) + counts.astype(np.uint32)
+        for row in range(self.depth):
+            # Sorting by column, then estimate, makes the largest estimate the
+            # last write to each counter.
+            order = np.lexsort((estimates, columns[row]))
+            row_columns = columns[row][order]
+            self.table[row, row_columns] = np.maximum(self.table[row,
+                row_columns], estimates[order])
+        self.total += int(counts.sum())
+
+    def get_error_bound(self, epsilon):
+        return epsilon * self.total
+
+class HeavyHitters(object):
+    '''
+    Tracks the capacity keys with the largest estimates in a sketch.
+    '''
+    def __init__(self, sketch, capacity):
+        self.sketch = sketch
+        self.capacity = capacity
+        self.keys = np.zeros(0, dtype=np.int64)
+
+    def add(self, keys, counts, code_counts):
+        self.sketch.update(keys, counts)
+        self.track(keys, code_counts)
+
+    def track(self, keys, code_counts):
+        '''
+        Re-ranks the tracked keys with keys already added to the sketch.
+        '''
+        # Estimates only grow, so the tracked keys are re-ranked with the
+        # keys of the batch.
+        self.keys = np.union1d(self.keys, keys)
+        if len(self.keys) > self.capacity:
+            scores = self.get_scores(self.keys, self.sketch.query(self.keys),
+                code_counts)
+            self.keys = self.keys[np.argpartition(-scores, self.capacity - 1)[
+                :self.capacity]]
+
+    def get_scores(self, keys, estimates, code_counts):
+        return estimates.astype(np.int64)
+
+    def get_top(self, code_counts):
+        '''
+        Returns the tracked keys and their estimates, best first.
+        '''
+        estimates = self.sketch.query(self.keys)
+        order = np.argsort(-self.get_scores(self.keys, estimates, code_counts),
+            kind='mergesort')
+        return self.keys[order], estimates[order]
+
+class PMIHeavyHitters(HeavyHitters):
+    '''
+    Tracks the capacity pairs with the largest estimate / (count_a * count_b)
+    among the pairs with an estimate of at least min_estimate. Shares the
+    sketch of a HeavyHitters of pairs, so only track is called.
+    '''
+    def __init__(self, sketch, capacity, min_estimate):
+        HeavyHitters.__init__(self, sketch, capacity)
+        self.min_estimate = min_estimate
+
+    def get_scores(self, keys, estimates, code_counts):
+        code_a, code_b = keys >> id_bits, keys & (2 ** id_bits - 1)
+        scores = estimates / (code_counts[code_a] * code_counts[code_b]
+            ).astype(np.float64)
+        # Pairs below the floor rank last, but stay tracked if there is room.
+        scores[estimates < self.min_estimate] = -1
+        return scores
+
+def get_visit_counts(pruned_set):
+    '''
+    Returns the number of visits of each patient.
+    '''
+    visit_count_dct = {}
+    f = open(data_fname, 'r')
+    for line in f:
+        record = prune_record(parse_line(line), pruned_set)
+        if record is None:
+            continue
+        key = record[0]
+        visit_count_dct[key] = visit_count_dct.get(key, 0) + 1
+    f.close()
+    return visit_count_dct
+
+def get_batches(visit_count_dct, pruned_set, code_dct, code_list):
+    '''
+    Yields lists of visits of multi-visit patients, each a sorted list of code
+    ids. New codes are appended to code_list.
+    '''
+    batch = []
+    f = open(data_fname, 'r')
+    for line in f:
+        record = prune_record(parse_line(line), pruned_set)
+        if record is None or visit_count_dct[record[0]] == 1:
+            continue
+        key, visit_date, disease_list, symptom_list, herb_list = record
+        for code in symptom_list + herb_list:
+            if code not in code_dct:
+                code_dct[code] = len(code_list)
+                code_list += [code]
+        batch += [sorted(set(code_dct[code] for code in symptom_list +
+            herb_list))]
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    f.close()
+    if len(batch) > 0:
+        yield batch
+
+def get_keys(batch, size):
+    '''
+    Yields the distinct keys of the code sets of the given size in the batch,
+    and their counts, for chunks of at most about max_batch_keys code sets.
+    The visits of each length are stacked into an array, so the keys of a
+    group are one fancy index of the array by the combinations of positions.
+    '''
+    shifts = id_bits * (size - 1 - np.arange(size))
+    lengths = np.array([len(visit) for visit in batch])
+    key_list, n_keys = [], 0
+    for length in np.unique(lengths[lengths >= size]):
+        visits = np.array([batch[i] for i in np.where(lengths == length)[0]],
+            dtype=np.int64)
+        positions = np.array(list(combinations(range(length), size)))
+        step = max(1, max_batch_keys // len(positions))
+        for start in range(0, len(visits), step):
+            key_list += [(visits[start:start + step][:, positions] << shifts
+                ).sum(axis=2).ravel()]
+            n_keys += len(key_list[-1])
+            if n_keys >= max_batch_keys:
+                yield np.unique(np.concatenate(key_list), return_counts=True)
+                key_list, n_keys = [], 0
+    if n_keys > 0:
+        yield np.unique(np.concatenate(key_list), return_counts=True)
+
+def decode_key(key, size):
+    return [int(key >> (id_bits * (size - 1 - i))) & (2 ** id_bits - 1) for i
+        in range(size)]
+
+def write_top_list(fname, header, row_list, n_top):
+    '''
+    Writes the top rows, and stores them in the result database as the model
+    approximate_<file name>.
+    '''
+    out = open(fname, 'w')
+    out.write(header)
+    for codes, score, error, counts in row_list[:n_top]:
+        out.write('%s\t%f\t%f\t%s\n' % ('\t'.join(codes), score, error,
+            '\t'.join('%d' % count for count in counts)))
+    out.close()
+    insert_sets('approximate_%s' % os.path.basename(fname)[:-len('.txt')], [(
+        codes, score) for codes, score, error, counts in row_list[:n_top]])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epsilon', type=float, default=1e-5, help='The '
+        'error bound as a fraction of the occurrences (default value: 1e-5)')
+    parser.add_argument('--delta', type=float, default=0.01, help='The '
+        'probability of exceeding the error bound (default value: 0.01)')
+    parser.add_argument('--n_top', type=int, default=1000, help='(default '
+        'value: 1000)')
+    parser.add_argument('--candidate_factor', type=int, default=10, help='The '
+        'tracked keys per listed key (default value: 10)')
+    parser.add_argument('--min_count', type=int, default=10, help='(default '
+        'value: 10)')
+    parser.add_argument('--seed', type=int, default=0, help='(default value: '
+        '0)')
+    args = parser.parse_args()
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    hitter_dct = dict((size, HeavyHitters(CountMinSketch(args.epsilon,
+        args.delta, args.seed + size), args.n_top * args.candidate_factor)) for
+        size in [2, 3])
+    pmi_hitters = PMIHeavyHitters(hitter_dct[2].sketch, args.n_top *
+        args.candidate_factor, args.min_count)
+    print 'sketch memory: %d MB' % (sum(hitters.sketch.table.nbytes for
+        hitters in hitter_dct.values()) / 2 ** 20)
+    code_dct, code_list = {}, []
+    code_counts = np.zeros(0, dtype=np.int64)
+    pruned_set = read_pruned_codes()
+    for batch in get_batches(get_visit_counts(pruned_set), pruned_set,
+        code_dct, code_list):
+        assert len(code_list) < 2 ** id_bits, 'too many codes for the keys'
+        code_counts = np.concatenate([code_counts, np.zeros(len(code_list) -
+            len(code_counts), dtype=np.int64)])
+        code_counts += np.bincount(np.concatenate([[]] + batch).astype(
+            np.int64), minlength=len(code_list))
+        for size, hitters in hitter_dct.items():
+            for keys, counts in get_keys(batch, size):
+                hitters.add(keys, counts, code_counts)
+                if size == 2:
+                    pmi_hitters.track(keys, code_counts)
+
+    table_dct = {}
+    for size, hitters in hitter_dct.items():
+        error = hitters.sketch.get_error_bound(args.epsilon)
+        row_list = []
+        for key, estimate in zip(*hitters.get_top(code_counts)):
+            code_ids = decode_key(key, size)
+            counts = code_counts[code_ids]
+            if counts.min() < args.min_count:
+                continue
+            row_list += [([code_list[code_id] for code_id in code_ids],
+                estimate, error, counts)]
+        table_dct[size] = row_list
+        print '%d-code sets: %d occurrences, error bound %f with probability '\
+            '%f' % (size, hitters.sketch.total, error, 1 - args.delta)
+
+    header = '#Estimates are at most %f above the true count with '\
+        'probability %f (epsilon %g, %d occurrences).\n'
+    for size, fname in [(2, 'pair_cooccurrence.txt'), (3,
+        'triple_cooccurrence.txt')]:
+        sketch = hitter_dct[size].sketch
+        write_top_list('%s/%s' % (out_folder, fname), header % (
+            sketch.get_error_bound(args.epsilon), 1 - args.delta,
+            args.epsilon, sketch.total), table_dct[size], args.n_top)
+
+    pmi_list = []
+    error = pmi_hitters.sketch.get_error_bound(args.epsilon)
+    for key, estimate in zip(*pmi_hitters.get_top(code_counts)):
+        code_ids = decode_key(key, 2)
+        counts = code_counts[code_ids]
+        if counts.min() < args.min_count or estimate < args.min_count:
+            continue
+        pmi = np.log2(float(estimate) / (counts[0] * counts[1]))
+        pmi_error = np.log2(float(estimate) / max(1, estimate - error))
+        pmi_list += [([code_list[code_id] for code_id in code_ids], pmi,
+            pmi_error, counts)]
+    write_top_list('%s/pair_pmi.txt' % out_folder, '#PMI of the pairs '
+        'tracked by PMI, with estimates of at least %d. Each is at most its '
+        'error above the true PMI with probability %f.\n' % (args.min_count,
+        1 - args.delta), pmi_list, args.n_top)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
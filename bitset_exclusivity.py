@@ -0,0 +1,300 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+from create_med2vec_labels import is_dosage_code
+import multiprocessing
+import numpy as np
+import os
+from result_store import insert_sets
+import sys
+import time
+from visit_binary_matrix import load_sparse_visit_matrix
+
+### This script scores herb-symptom sets for co-occurrence and exclusivity
+### without WExT. Each code's set of visits is a packed bitset, so the size of
+### any intersection is a vectorized AND followed by a popcount. Scores every
+### herb-symptom pair, and for set_size 3, every set of three codes with at
+### least one herb and one symptom, as WExT does. Each such triple is scored
+### once, as a herb-symptom pair extended with a later herb or a later
+### symptom, and only the triple intersection is counted per triple, as the
+### pairwise counts are computed once. Optionally, triples are only seeded
+### with the n_seed_pairs best pairs, which is faster but can miss triples
+### whose pairs are not among the best. Candidate blocks are scored in
+### parallel. Must run visit_binary_matrix.py first.
+### For a set of codes, the scores are
+###     cooccurrence: visits that contain every code in the set.
+###     coverage: visits that contain at least one code in the set.
+###     exclusive: visits that contain exactly one code in the set.
+###     exclusivity: exclusive / coverage.
+
+popcount_table = np.array([bin(i).count('1') for i in range(256)],
+    dtype=np.uint8)
+# Codes that are unpacked into dense visit rows at a time.
+pack_block_size = 256
+# Bytes of AND results held at once by a worker.
+max_block_bytes = 64 * 1024 * 1024
+# The bitsets are stored at module level so that forked workers inherit them.
+bitset_data = None
+
+def read_code_list():
+    '''
+    Reads the list of symptoms and herbs.
+    '''
+    code_list = []
+    f = open('./results/code_list.txt', 'r')
+    for line in f:
+        code_list += [line.strip()]
+    f.close()
+    return code_list
+
+def read_code_file(code_type):
+    '''
+    Given a code type, read the file to get the list of unique codes within
+    that type.
+    '''
+    data = {}
+    f = open('./data/%s_count_dct.txt' % code_type, 'r')
+    for line in f:
+        line = line.split()
+        data[line[0]] = int(line[1])
+    f.close()
+    return data
+
+def build_code_bitsets(visit_matrix):
+    '''
+    Given the visit x code CSR matrix, returns a code x byte matrix where row
+    i is the np.packbits bitset of the visits that contain code i.
+    '''
+    code_matrix = visit_matrix.T.tocsr()
+    num_codes, num_visits = code_matrix.shape
+    bitsets = np.zeros((num_codes, (num_visits + 7) // 8), dtype=np.uint8)
+    for start in range(0, num_codes, pack_block_size):
+        block = code_matrix[start:start + pack_block_size].toarray() > 0
+        bitsets[start:start + len(block)] = np.packbits(block, axis=1)
+    return bitsets
+
+def popcount(bits):
+    '''
+    Counts the set bits along the last axis.
+    '''
+    return popcount_table[bits].sum(axis=-1, dtype=np.int64)
+
+def get_candidate_codes(code_list, min_count):
+    '''
+    Returns the indices of the herbs and the symptoms that appear in at least
+    min_count visits. Dosage codes are left out.
+    '''
+    herb_count_dct = read_code_file('herb')
+    symptom_count_dct = read_code_file('symptom')
+    herb_list, symptom_list = [], []
+    for i, code in enumerate(code_list):
+        if is_dosage_code(code):
+            continue
+        if code in herb_count_dct:
+            if herb_count_dct[code] >= min_count:
+                herb_list += [i]
+        elif symptom_count_dct[code] >= min_count:
+            symptom_list += [i]
+    return np.array(herb_list, dtype=np.int64), np.array(symptom_list,
+        dtype=np.int64)
+
+def get_top(score_table, score_column, n_top):
+    '''
+    Keeps the n_top rows of a score table with the highest score.
+    '''
+    if len(score_table) <= n_top:
+        return score_table
+    top = np.argpartition(-score_table[:, score_column], n_top - 1)[:n_top]
+    return score_table[top]
+
+def score_pair_block(herb_block):
+    '''
+    Scores every pair of an herb in herb_block with a candidate symptom.
+    Returns a table with columns herb, symptom, -1, cooccurrence, coverage,
+    exclusive, keeping only the top rows of this block.
+    '''
+    bitsets, counts, symptom_list, score_column, n_top = bitset_data
+    cooccurrence = popcount(bitsets[herb_block][:, None, :] &
+        bitsets[symptom_list][None, :, :])
+    herb_counts = counts[herb_block][:, None]
+    symptom_counts = counts[symptom_list][None, :]
+    coverage = herb_counts + symptom_counts - cooccurrence
+    exclusive = herb_counts + symptom_counts - 2 * cooccurrence
+    herb_column, symptom_column = np.meshgrid(herb_block, symptom_list,
+        indexing='ij')
+    score_table = np.column_stack([herb_column.ravel(), symptom_column.ravel(),
+        -np.ones(cooccurrence.size, dtype=np.int64), cooccurrence.ravel(),
+        coverage.ravel(), exclusive.ravel()])
+    return get_top(score_table, score_column, n_top)
+
+def count_pair_block(code_block):
+    '''
+    Returns the co-occurrence of each code in code_block with every candidate
+    code.
+    '''
+    bitsets, candidate_list = bitset_data
+    return popcount(bitsets[code_block][:, None, :] & bitsets[candidate_list][
+        None, :, :])
+
+def score_triple_block(pair_block):
+    '''
+    Extends every herb-symptom pair in pair_block with candidate third codes.
+    Uses inclusion-exclusion over the pairwise and triple intersections. If
+    canonical, the third codes are the herbs after the pair's herb and the
+    symptoms after its symptom, so each triple is reached from one pair.
+    '''
+    (bitsets, counts, third_list, is_herb, positions, pair_counts, canonical,
+        score_column, n_top) = bitset_data
+    table_list = []
+    for first, second in pair_block:
+        if canonical:
+            keep = np.where(is_herb, third_list > first, third_list > second)
+        else:
+            keep = (third_list != first) & (third_list != second)
+        third_candidates = third_list[keep]
+        if len(third_candidates) == 0:
+            continue
+        pair_bits = bitsets[first] & bitsets[second]
+        n_12 = pair_counts[positions[first], positions[second]]
+        n_13 = pair_counts[positions[first]][keep]
+        n_23 = pair_counts[positions[second]][keep]
+        n_123 = popcount(pair_bits & bitsets[third_candidates])
+        singles = counts[first] + counts[second] + counts[third_candidates]
+        pairs = n_12 + n_13 + n_23
+        coverage = singles - pairs + n_123
+        exclusive = singles - 2 * pairs + 3 * n_123
+        table_list += [get_top(np.column_stack([np.repeat(first, len(
+            third_candidates)), np.repeat(second, len(third_candidates)),
+            third_candidates, n_123, coverage, exclusive]), score_column,
+            n_top)]
+    if len(table_list) == 0:
+        return np.zeros((0, 6), dtype=np.int64)
+    return get_top(np.vstack(table_list), score_column, n_top)
+
+def run_blocks(function, block_list, n_processes):
+    '''
+    Scores each block in a process pool and stacks the results.
+    '''
+    if n_processes == 1:
+        return np.vstack(map(function, block_list))
+    pool = multiprocessing.Pool(n_processes)
+    table_list = pool.map(function, block_list)
+    pool.close()
+    pool.join()
+    return np.vstack(table_list)
+
+def deduplicate_triples(score_table):
+    '''
+    The same triple can be reached from different seed pairs. Keeps one row
+    per set of codes.
+    '''
+    if len(score_table) == 0:
+        return score_table
+    sorted_codes = np.sort(score_table[:, :3], axis=1)
+    unique_codes, unique_rows = np.unique(sorted_codes, axis=0,
+        return_index=True)
+    return score_table[unique_rows]
+
+def score_sets(bitsets, herb_list, symptom_list, set_size, score, n_top,
+    n_seed_pairs, n_processes):
+    '''
+    Returns the score table of the top n_top sets of set_size codes, sorted
+    by the chosen score. Triples are seeded with the n_seed_pairs best pairs,
+    or with every herb-symptom pair if n_seed_pairs is None.
+    '''
+    global bitset_data
+    counts = popcount(bitsets)
+    score_column = {'cooccurrence':3, 'exclusive':5}[score]
+
+    # Split the herbs so that each block's AND results fit in memory.
+    block_size = max(1, max_block_bytes // max(1, len(symptom_list) *
+        bitsets.shape[1]))
+    herb_blocks = [herb_list[i:i + block_size] for i in range(0, len(
+        herb_list), block_size)]
+    if set_size == 2 or n_seed_pairs is not None:
+        n_pairs = n_top
+        if set_size == 3:
+            n_pairs = n_seed_pairs
+        bitset_data = (bitsets, counts, symptom_list, score_column, n_pairs)
+        score_table = get_top(run_blocks(score_pair_block, herb_blocks,
+            n_processes), score_column, n_pairs)
+
+    if set_size == 3:
+        third_list = np.concatenate([herb_list, symptom_list])
+        is_herb = np.arange(len(third_list)) < len(herb_list)
+        positions = np.zeros(len(bitsets), dtype=np.int64) - 1
+        positions[third_list] = np.arange(len(third_list))
+        block_size = max(1, max_block_bytes // max(1, len(third_list) *
+            bitsets.shape[1]))
+        bitset_data = (bitsets, third_list)
+        pair_counts = run_blocks(count_pair_block, [third_list[i:i +
+            block_size] for i in range(0, len(third_list), block_size)],
+            n_processes)
+        if n_seed_pairs is None:
+            herb_column, symptom_column = np.meshgrid(herb_list, symptom_list,
+                indexing='ij')
+            seed_pairs = np.column_stack([herb_column.ravel(),
+                symptom_column.ravel()])
+        else:
+            seed_pairs = score_table[:, :2]
+        bitset_data = (bitsets, counts, third_list, is_herb, positions,
+            pair_counts, n_seed_pairs is None, score_column, n_top)
+        n_blocks = n_processes * 4
+        pair_blocks = [seed_pairs[i::n_blocks] for i in range(n_blocks) if len(
+            seed_pairs[i::n_blocks]) > 0]
+        score_table = deduplicate_triples(run_blocks(score_triple_block,
+            pair_blocks, n_processes))
+        score_table = get_top(score_table, score_column, n_top)
+
+    order = np.lexsort((-score_table[:, 4], -score_table[:, score_column]))
+    return score_table[order]
+
+def write_score_table(score_table, code_list, set_size, score):
+    '''
+    Writes the sets in Chinese, in the same layout as the WExT outputs.
+    '''
+    out = open('./results/wext/%d_set_bitset_%s-chinese.tsv' % (set_size,
+        score), 'w')
+    out.write('#Genes\tCooccurrence\tCoverage\tExclusive\tExclusivity\n')
+    set_list = []
+    for row in score_table:
+        codes = [code_list[code] for code in row[:set_size]]
+        cooccurrence, coverage, exclusive = row[3:]
+        exclusivity = exclusive / float(max(coverage, 1))
+        out.write('%s\t%d\t%d\t%d\t%f\n' % (','.join(codes), cooccurrence,
+            coverage, exclusive, exclusivity))
+        set_list += [(codes, exclusivity if score == 'exclusive' else
+            cooccurrence)]
+    out.close()
+    insert_sets('%d_set_bitset_%s' % (set_size, score), set_list)
+
+def main():
+    if len(sys.argv) not in [3, 4, 5]:
+        print ('Usage: python %s 2/3 cooccurrence/exclusive '
+            'num_processes<optional> n_seed_pairs<optional>' % sys.argv[0])
+        exit()
+    set_size, score = int(sys.argv[1]), sys.argv[2]
+    assert set_size in [2, 3] and score in ['cooccurrence', 'exclusive']
+    n_processes = multiprocessing.cpu_count()
+    if len(sys.argv) >= 4:
+        n_processes = int(sys.argv[3])
+    # By default, every triple is scored.
+    n_seed_pairs = None
+    if len(sys.argv) == 5:
+        n_seed_pairs = int(sys.argv[4])
+    if not os.path.exists('./results/wext'):
+        os.makedirs('./results/wext')
+
+    code_list = read_code_list()
+    bitsets = build_code_bitsets(load_sparse_visit_matrix())
+    herb_list, symptom_list = get_candidate_codes(code_list, 10)
+    score_table = score_sets(bitsets, herb_list, symptom_list, set_size, score,
+        1000, n_seed_pairs, n_processes)
+    write_score_table(score_table, code_list, set_size, score)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import compute_conditional_probabilities
+import create_med2vec_input
+import multiprocessing
+import numpy as np
+import os
+from result_store import insert_scores
+from scipy.sparse import coo_matrix
+import sys
+import time
+
+### This script adds bootstrap confidence intervals to the conditional
+### probabilities of compute_conditional_probabilities.py and the PMI scores
+### of cooccurrence_svd_baseline.py. The visits are parsed and counted once,
+### into sparse patient x pair and patient x code count matrices. A bootstrap
+### replicate resamples patients by giving each one a Poisson(1) or
+### multinomial weight, so its counts are a single weight vector times matrix
+### product. Replicates run in a process pool.
+
+out_folder = './results/bootstrap'
+# Pairs whose denominators are below this on the full data are not written,
+# the same cutoff as the point estimates.
+min_count = 10
+# The count matrices are stored at module level so forked workers inherit
+# them.
+count_data = None
+
+class CountMatrixBuilder(object):
+    '''
+    Collects one row of counts per patient, with the column of each key
+    assigned on first sight.
+    '''
+    def __init__(self):
+        self.key_dct, self.key_list = {}, []
+        self.rows, self.cols, self.data = [], [], []
+        self.num_rows = 0
+
+    def add_row(self, count_dct):
+        for key in count_dct:
+            if key not in self.key_dct:
+                self.key_dct[key] = len(self.key_list)
+                self.key_list += [key]
+            self.rows += [self.num_rows]
+            self.cols += [self.key_dct[key]]
+            self.data += [count_dct[key]]
+        self.num_rows += 1
+
+    def get_matrix(self):
+        return coo_matrix((self.data, (self.rows, self.cols)), shape=(
+            self.num_rows, len(self.key_list))).tocsr()
+
+def get_conditional_count_matrices():
+    '''
+    Runs the per-patient counting of compute_conditional_probabilities.py on
+    each patient separately. Returns the patient x (herb, symptom) matrix, the
+    patient x symptom matrix, and their column keys, for all symptoms and for
+    new symptoms.
+    '''
+    patient_dct = create_med2vec_input.prune_patient_dct(
+        compute_conditional_probabilities.get_patient_dct(),
+        create_med2vec_input.read_pruned_codes())
+    builder_list = [CountMatrixBuilder() for i in range(4)]
+    for key in patient_dct:
+        visit_dct = patient_dct[key]
+        # Skip patient records that only have one visit.
+        if len(visit_dct) == 1:
+            continue
+        count_dct_list = [{}, {}, {}, {}]
+        compute_conditional_probabilities.get_individual_patient_counts(
+            visit_dct, count_dct_list[0], count_dct_list[2], count_dct_list[1],
+            count_dct_list[3])
+        for builder, count_dct in zip(builder_list, count_dct_list):
+            builder.add_row(count_dct)
+    return [(builder.get_matrix(), builder.key_list) for builder in
+        builder_list]
+
+def get_pmi_count_matrices():
+    '''
+    Counts the co-occurring pairs and the codes of each patient's visits, over
+    the visits used by create_med2vec_input.py. Pairs are unordered. Returns
+    the patient x pair and patient x code matrices and their column keys.
+    '''
+    patient_dct = create_med2vec_input.prune_patient_dct(
+        create_med2vec_input.get_patient_dct(),
+        create_med2vec_input.read_pruned_codes())
+    pair_builder, code_builder = CountMatrixBuilder(), CountMatrixBuilder()
+    for key in patient_dct:
+        visit_dct = patient_dct[key]
+        # Skip patients that only had one visit.
+        if len(visit_dct) == 1:
+            continue
+        pair_count_dct, code_count_dct = {}, {}
+        for date in visit_dct:
+            disease_list, symptom_list, herb_list = visit_dct[date]
+            combined_list = sorted(set(symptom_list + herb_list))
+            for a, code_a in enumerate(combined_list):
+                code_count_dct[code_a] = code_count_dct.get(code_a, 0) + 1
+                for code_b in combined_list[a + 1:]:
+                    pair_count_dct[(code_a, code_b)] = pair_count_dct.get((
+                        code_a, code_b), 0) + 1
+        pair_builder.add_row(pair_count_dct)
+        code_builder.add_row(code_count_dct)
+    return (pair_builder.get_matrix(), pair_builder.key_list,
+        code_builder.get_matrix(), code_builder.key_list)
+
+def get_conditional_statistics(pair_counts, symptom_counts, symptom_columns):
+    '''
+    P(herb | symptom) for each pair column.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pair_counts / symptom_counts[symptom_columns]
+
+def get_pmi_statistics(pair_counts, code_counts, code_columns):
+    '''
+    log2(co-occurrence / (count_a * count_b)), as in build_pmi_dct.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log2(pair_counts / (code_counts[code_columns[:, 0]] *
+            code_counts[code_columns[:, 1]]))
+
+def get_weights(method, num_patients, rng):
+    '''
+    Returns the weight of each patient in one bootstrap replicate.
+    '''
+    if method == 'poisson':
+        return rng.poisson(1.0, num_patients).astype(np.float64)
+    return rng.multinomial(num_patients, np.ones(num_patients) /
+        num_patients).astype(np.float64)
+
+def run_replicates(arguments):
+    '''
+    Computes the statistic of every kept pair for a block of replicates.
+    Returns a replicate x pair float32 array.
+    '''
+    seed, n_replicates = arguments
+    (pair_matrix, denominator_matrix, denominator_columns, statistic,
+        method) = count_data
+    rng = np.random.RandomState(seed)
+    replicate_list = np.zeros((n_replicates, pair_matrix.shape[1]),
+        dtype=np.float32)
+    for i in range(n_replicates):
+        weights = get_weights(method, pair_matrix.shape[0], rng)
+        pair_counts = pair_matrix.T.dot(weights)
+        denominator_counts = denominator_matrix.T.dot(weights)
+        replicate_list[i] = statistic(pair_counts, denominator_counts,
+            denominator_columns)
+    return replicate_list
+
+def bootstrap(pair_matrix, denominator_matrix, denominator_columns, statistic,
+    method, n_replicates, n_processes, alpha=0.05):
+    '''
+    Returns the point estimate and the lower and upper percentile bounds of
+    the statistic for each pair column.
+    '''
+    global count_data
+    ones = np.ones(pair_matrix.shape[0])
+    estimate = statistic(pair_matrix.T.dot(ones), denominator_matrix.T.dot(
+        ones), denominator_columns)
+    count_data = (pair_matrix, denominator_matrix, denominator_columns,
+        statistic, method)
+    block_list = [(seed, len(range(seed, n_replicates, n_processes))) for
+        seed in range(min(n_processes, n_replicates))]
+    if n_processes == 1:
+        replicate_lists = map(run_replicates, block_list)
+    else:
+        pool = multiprocessing.Pool(n_processes)
+        replicate_lists = pool.map(run_replicates, block_list)
+        pool.close()
+        pool.join()
+    replicates = np.vstack(replicate_lists)
+    # Only a conditional probability with a missing symptom, 0 / 0, is
+    # undefined. A pair that does not co-occur in a replicate has a PMI of
+    # log2(0) = -inf, which is kept, so the bounds of rare pairs are -inf
+    # rather than left out.
+    lower, upper = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 -
+        alpha / 2)], axis=0)
+    return estimate, lower, upper
+
+def write_intervals(fname, key_list, estimate, lower, upper):
+    '''
+    Writes each pair with its estimate and interval, by estimate.
+    '''
+    out = open('%s/%s.txt' % (out_folder, fname), 'w')
+    for i in np.argsort(-estimate, kind='mergesort'):
+        out.write('%s\t%s\t%f\t%f\t%f\n' % (key_list[i][0], key_list[i][1],
+            estimate[i], lower[i], upper[i]))
+    out.close()
+    # The lower bound is the conservative score of a pair, -inf for a PMI
+    # pair missing from enough replicates.
+    insert_scores('bootstrap_%s_lower' % fname, [(key_list[i][0],
+        key_list[i][1], lower[i]) for i in range(len(key_list)) if not np.isnan(
+        lower[i])])
+
+def bootstrap_conditional_probabilities(method, n_replicates, n_processes):
+    matrix_list = get_conditional_count_matrices()
+    for (pair_matrix, pair_list), (symptom_matrix, symptom_list), fname in [(
+        matrix_list[0], matrix_list[1], 'herb_given_symptom'), (matrix_list[2],
+        matrix_list[3], 'herb_given_new_symptom')]:
+        symptom_dct = dict((symptom, i) for i, symptom in enumerate(
+            symptom_list))
+        symptom_columns = np.array([symptom_dct[symptom] for herb, symptom in
+            pair_list], dtype=np.int64)
+        symptom_totals = np.asarray(symptom_matrix.sum(axis=0)).ravel()
+        keep = np.where(symptom_totals[symptom_columns] >= min_count)[0]
+        estimate, lower, upper = bootstrap(pair_matrix[:, keep],
+            symptom_matrix, symptom_columns[keep], get_conditional_statistics,
+            method, n_replicates, n_processes)
+        write_intervals('%s_ci' % fname, [pair_list[i] for i in keep],
+            estimate, lower, upper)
+
+def bootstrap_pmi(method, n_replicates, n_processes):
+    pair_matrix, pair_list, code_matrix, code_list = get_pmi_count_matrices()
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    code_columns = np.array([(code_dct[code_a], code_dct[code_b]) for code_a,
+        code_b in pair_list], dtype=np.int64).reshape(-1, 2)
+    code_totals = np.asarray(code_matrix.sum(axis=0)).ravel()
+    keep = np.where((code_totals[code_columns[:, 0]] >= min_count) & (
+        code_totals[code_columns[:, 1]] >= min_count))[0]
+    estimate, lower, upper = bootstrap(pair_matrix[:, keep], code_matrix,
+        code_columns[keep], get_pmi_statistics, method, n_replicates,
+        n_processes)
+    write_intervals('pmi_ci', [pair_list[i] for i in keep], estimate, lower,
+        upper)
+
+def main():
+    if len(sys.argv) not in [3, 4]:
+        print ('Usage: python %s n_replicates poisson/multinomial '
+            'num_processes<optional>' % sys.argv[0])
+        exit()
+    n_replicates, method = int(sys.argv[1]), sys.argv[2]
+    assert method in ['poisson', 'multinomial']
+    n_processes = multiprocessing.cpu_count()
+    if len(sys.argv) == 4:
+        n_processes = int(sys.argv[3])
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    bootstrap_conditional_probabilities(method, n_replicates, n_processes)
+    bootstrap_pmi(method, n_replicates, n_processes)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -3,8 +3,11 @@
 
 ### Author: Edward Huang
 
+from create_med2vec_input import prune_patient_dct, read_pruned_codes
 from datetime import datetime
 import operator
+import profiling
+from result_store import insert_scores
 import time
 import sys
 import csv
@@ -113,6 +116,8 @@ def write_conditional_probabilities(herb_given_symptom_prob_dct, fname):
     for (herb, symptom), prob in sorted_count:
         out.write('%s\t%s\t%f\n' % (herb, symptom, prob))
     out.close()
+    insert_scores(fname, [(herb, symptom, prob) for (herb, symptom), prob in
+        sorted_count])
 
 def compute_conditional_probabilities(patient_dct):
     '''
@@ -121,30 +126,34 @@ def compute_conditional_probabilities(patient_dct):
     '''
     herb_given_symptom_count_dct, herb_given_new_symptom_count_dct = {}, {}
     symptom_count_dct, new_symptom_count_dct = {}, {}
-    for (name, dob) in patient_dct:
-        visit_dct = patient_dct[(name, dob)]
-        # Skip patient records that only have one visit.
-        if len(visit_dct) == 1:
-            continue
-        # Update the dictionaries.
-        get_individual_patient_counts(visit_dct, herb_given_symptom_count_dct,
-            herb_given_new_symptom_count_dct, symptom_count_dct,
-            new_symptom_count_dct)
-
-    # Normalize the counts.
-    herb_given_symptom_prob_dct = normalize_count_dct(
-        herb_given_symptom_count_dct, symptom_count_dct)
-    herb_given_new_symptom_prob_dct = normalize_count_dct(
-        herb_given_new_symptom_count_dct, new_symptom_count_dct)
-
-    write_conditional_probabilities(herb_given_symptom_prob_dct,
-        'herb_given_symptom')
-
-    write_conditional_probabilities(herb_given_new_symptom_prob_dct,
-        'herb_given_new_symptom')
+    with profiling.stage('count'):
+        for (name, dob) in patient_dct:
+            visit_dct = patient_dct[(name, dob)]
+            # Skip patient records that only have one visit.
+            if len(visit_dct) == 1:
+                continue
+            # Update the dictionaries.
+            get_individual_patient_counts(visit_dct,
+                herb_given_symptom_count_dct, herb_given_new_symptom_count_dct,
+                symptom_count_dct, new_symptom_count_dct)
+
+        # Normalize the counts.
+        herb_given_symptom_prob_dct = normalize_count_dct(
+            herb_given_symptom_count_dct, symptom_count_dct)
+        herb_given_new_symptom_prob_dct = normalize_count_dct(
+            herb_given_new_symptom_count_dct, new_symptom_count_dct)
+
+    with profiling.stage('write'):
+        write_conditional_probabilities(herb_given_symptom_prob_dct,
+            'herb_given_symptom')
+
+        write_conditional_probabilities(herb_given_new_symptom_prob_dct,
+            'herb_given_new_symptom')
 
 def main():
-    patient_dct = get_patient_dct()
+    with profiling.stage('parse'):
+        patient_dct = prune_patient_dct(get_patient_dct(),
+            read_pruned_codes())
     compute_conditional_probabilities(patient_dct)
 
 if __name__ == '__main__':
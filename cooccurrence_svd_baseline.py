@@ -3,10 +3,13 @@
 
 ### Author: Edward Huang
 
+from create_med2vec_input import prune_patient_dct, read_pruned_codes
 from datetime import datetime
 import numpy as np
 import operator
 import os
+import profiling
+from result_store import insert_scores
 from scipy.linalg import svd
 from scipy.spatial.distance import pdist, squareform
 import time
@@ -91,6 +94,8 @@ def write_scores_to_file(model_type, similarity_dct):
 
     # We only want 1000 of herb-herb, symptom-symptom, and herb-symptoms.
     hh_count, ss_count, hs_count = 0, 0, 0
+    # The written rows are also stored in the result database.
+    stored_list = []
 
     # Write out to one of three files.
     out_folder = './results/%s_baseline' % model_type
@@ -131,10 +136,12 @@ def write_scores_to_file(model_type, similarity_dct):
                 continue
             hs_out.write(out_str)
             hs_count += 1
+        stored_list += [(code_a, code_b, score)]
     
     ss_out.close()
     hs_out.close()
     hh_out.close()
+    insert_scores('%s_baseline' % model_type, stored_list)
 
 def build_pmi_dct(co_occ_dct):
     '''
@@ -153,7 +160,8 @@ def build_pmi_dct(co_occ_dct):
             (code_count_dct[code_a] * code_count_dct[code_b]))
 
     pmi_dct = sorted(pmi_dct.items(), key=operator.itemgetter(1), reverse=True)
-    write_scores_to_file('pmi', pmi_dct)
+    with profiling.stage('write'):
+        write_scores_to_file('pmi', pmi_dct)
 
 def build_cooccurrence_matrix(patient_dct, code_list):
     '''
@@ -166,6 +174,7 @@ def build_cooccurrence_matrix(patient_dct, code_list):
 
     # The dictionary is for co-occurrence baseline purposes. Matrix is for SVD.
     co_occ_dct = {}
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
 
     for key in patient_dct:
         visit_dct = patient_dct[key]
@@ -187,7 +196,7 @@ def build_cooccurrence_matrix(patient_dct, code_list):
                     co_occ_dct[(code_a, code_b)] += 1
 
             # Convert each symptom/herb to their index in the code list.
-            visit_code_list = [code_list.index(code) for code in combined_list]
+            visit_code_list = [code_dct[code] for code in combined_list]
             # Increment the co-occurrence count. We do double count here.
             for code_a in visit_code_list:
                 for code_b in visit_code_list:
@@ -197,7 +206,8 @@ def build_cooccurrence_matrix(patient_dct, code_list):
 
     co_occ_dct = sorted(co_occ_dct.items(), key=operator.itemgetter(1),
         reverse=True)
-    write_scores_to_file('cooccurrence', co_occ_dct)
+    with profiling.stage('write'):
+        write_scores_to_file('cooccurrence', co_occ_dct)
 
     return co_occ_matrix
 
@@ -217,7 +227,8 @@ def reduce_matrix(matrix, code_list, matrix_type):
     Given a co-occurrence matrix, perform SVD on it in order to to reduce the
     dimensionality of each medical code.
     '''
-    U, s, Vh = svd(matrix)
+    with profiling.stage('svd'):
+        U, s, Vh = svd(matrix)
     for k in [50, 100, 150]:
         top_indices = sorted(range(len(s)), key=lambda i: s[i])[-k:]
         # Get the top singular values.
@@ -228,20 +239,28 @@ def reduce_matrix(matrix, code_list, matrix_type):
             row = [row[i] for i in top_indices]
             # Multiply the top singular values by each row in V_h.
             reduced_Vh += [np.array(row) * np.sqrt(top_s)]
-
-        # Compute the pairwise cosine similarity.
-        similarity_matrix = squareform(pdist(reduced_Vh, 'cosine'))
-
-        similarity_dct = {}
-        for row_i, row in enumerate(similarity_matrix):
-            row_code = code_list[row_i]
-            for col_i in range(row_i + 1, len(row)):
-                col_code = code_list[col_i]
-                similarity_dct[(row_code, col_code)] = 1 - row[col_i]
-        # Sort the pairs of codes by their cosine simliarity.
-        similarity_dct = sorted(similarity_dct.items(),
-            key=operator.itemgetter(1), reverse=True)
-        write_scores_to_file('%s_svd_k%d' % (matrix_type, k), similarity_dct)
+        # Save the vectors in the same layout as the med2vec models, so they
+        # can be reused, e.g. for clustering codes into output groups.
+        with profiling.stage('write'):
+            np.savez_compressed('./results/%s_svd_k%d_baseline/embeddings.npz'
+                % (matrix_type, k), W_emb=np.array(reduced_Vh))
+
+        with profiling.stage('similarity'):
+            # Compute the pairwise cosine similarity.
+            similarity_matrix = squareform(pdist(reduced_Vh, 'cosine'))
+
+            similarity_dct = {}
+            for row_i, row in enumerate(similarity_matrix):
+                row_code = code_list[row_i]
+                for col_i in range(row_i + 1, len(row)):
+                    col_code = code_list[col_i]
+                    similarity_dct[(row_code, col_code)] = 1 - row[col_i]
+            # Sort the pairs of codes by their cosine simliarity.
+            similarity_dct = sorted(similarity_dct.items(),
+                key=operator.itemgetter(1), reverse=True)
+        with profiling.stage('write'):
+            write_scores_to_file('%s_svd_k%d' % (matrix_type, k),
+                similarity_dct)
 
 def generate_first_time_dirs():
     '''
@@ -272,14 +291,13 @@ def co_occ_to_pmi_matrix(co_occ_matrix, code_list):
 
 def main():
     generate_first_time_dirs()
-    patient_dct = get_patient_dct()
-    code_list = read_code_list()
-    co_occ_matrix = build_cooccurrence_matrix(patient_dct, code_list)
-    pmi_matrix = co_occ_to_pmi_matrix(co_occ_matrix, code_list)
-    
-    print pmi_matrix[(code_list.index('少津'), code_list.index('天冬'))]
-
-    exit()
+    with profiling.stage('parse'):
+        # Codes pruned by create_med2vec_input.py are not in code_list.
+        patient_dct = prune_patient_dct(get_patient_dct(), read_pruned_codes())
+        code_list = read_code_list()
+    with profiling.stage('matrix_build'):
+        co_occ_matrix = build_cooccurrence_matrix(patient_dct, code_list)
+        pmi_matrix = co_occ_to_pmi_matrix(co_occ_matrix, code_list)
     reduce_matrix(co_occ_matrix, code_list, 'co')
     reduce_matrix(pmi_matrix, code_list, 'pmi')
 
@@ -7,6 +7,8 @@ from collections import OrderedDict
 import datetime
 import cPickle
 import os
+import profiling
+import sys
 import time
 
 date_format = '%Y-%m-%d'
@@ -14,8 +16,36 @@ date_format = '%Y-%m-%d'
 ### This script writes out a file of the format stipulated by the med2vec page.
 ### https://github.com/mp2893/med2vec
 ### Uses the TCM data list to create the data matrix.
+### Codes in fewer than min_count visits, or beyond the max_vocab most frequent,
+### are pruned before the ids are assigned, so every later stage runs on the
+### smaller vocabulary. ./results/code_mapping.txt records each code's count and
+### new id, and the count files keep the counts of every code.
 ### Run time: 5 seconds.
 
+def parse_line(line):
+    '''
+    Parses one line of the TCM data. Returns None for incomplete records, and
+    otherwise the patient key, the visit date, and the diseases, symptoms, and
+    herbs of the visit.
+    '''
+    diseases, name, dob, visit_date, symptoms, herbs = line.split('\t')
+    if name == 'null' or dob == 'null':
+        return None
+    # Always ends with a colon, so the last element of the split will be
+    # the empty string.
+    disease_list = diseases.split(':')[:-1]
+    
+    visit_date = visit_date.split('，')[1][:len('xxxx-xx-xx')]
+    # Format the diagnosis date.
+    visit_date = datetime.datetime.strptime(visit_date, date_format)
+
+    # Take out the trailing colon.
+    symptom_list = symptoms.split(':')[:-1]
+    herb_list = herbs.split(':')[:-1]
+    if len(symptom_list) == 0 or len(herb_list) == 0:
+        return None
+    return (name, dob), visit_date, disease_list, symptom_list, herb_list
+
 def get_patient_dct():
     '''
     Returns dictionary
@@ -26,25 +56,12 @@ def get_patient_dct():
     patient_dct = OrderedDict({})
     f = open('./data/HIS_tuple_word.txt', 'r')
     for i, line in enumerate(f):
-        diseases, name, dob, visit_date, symptoms, herbs = line.split('\t')
-        if name == 'null' or dob == 'null':
-            continue
-        # Always ends with a colon, so the last element of the split will be
-        # the empty string.
-        disease_list = diseases.split(':')[:-1]
-        
-        visit_date = visit_date.split('，')[1][:len('xxxx-xx-xx')]
-        # Format the diagnosis date.
-        visit_date = datetime.datetime.strptime(visit_date, date_format)
-
-        # Take out the trailing colon.
-        symptom_list = symptoms.split(':')[:-1]
-        herb_list = herbs.split(':')[:-1]
-        if len(symptom_list) == 0 or len(herb_list) == 0:
+        record = parse_line(line)
+        if record is None:
             continue
+        key, visit_date, disease_list, symptom_list, herb_list = record
 
         # Add the listing to the dictionary.
-        key = (name, dob)
         if key not in patient_dct:
             patient_dct[key] = {}
         # If multiple visits in one day, add on one second to each day.
@@ -61,7 +78,7 @@ def get_symptom_and_herb_counts(patient_dct):
     '''
     Given the patient dictionary, count the symptom and herb occurrences in
     patients with more than one visit. Writes the counts out to file.
-    Returns the list of unique medical codes.
+    Returns the list of unique medical codes, and the count of each code.
     '''
     herb_count_dct, symptom_count_dct = {}, {}
     for key in patient_dct:
@@ -92,7 +109,90 @@ def get_symptom_and_herb_counts(patient_dct):
         symptom_out.write('%s\t%d\n' % (symptom, symptom_count_dct[symptom]))
     symptom_out.close()
 
-    return list(set(symptom_count_dct.keys()).union(herb_count_dct.keys()))
+    code_count_dct = dict(symptom_count_dct)
+    code_count_dct.update(herb_count_dct)
+    return list(set(symptom_count_dct.keys()).union(herb_count_dct.keys())
+        ), code_count_dct
+
+def prune_code_list(code_list, code_count_dct, min_count, max_vocab):
+    '''
+    Keeps the codes that appear in at least min_count visits and, if
+    max_vocab is positive, only the max_vocab most frequent of them. The kept
+    codes stay in code_list order, so ids are dense. Returns the kept codes.
+    '''
+    kept_list = [code for code in code_list if code_count_dct[code] >=
+        min_count]
+    if max_vocab > 0 and len(kept_list) > max_vocab:
+        # Ties are broken by the code, so the vocabulary is deterministic.
+        kept_set = set(sorted(kept_list, key=lambda code: (-code_count_dct[
+            code], code))[:max_vocab])
+        kept_list = [code for code in kept_list if code in kept_set]
+    return kept_list
+
+def prune_patient_dct(patient_dct, pruned_set):
+    '''
+    Removes the pruned codes from every visit. As in get_patient_dct, visits
+    left without symptoms or herbs are removed, and so are patients left
+    without visits.
+    '''
+    if len(pruned_set) == 0:
+        return patient_dct
+    pruned_dct = OrderedDict({})
+    for key in patient_dct:
+        visit_dct = {}
+        for date in patient_dct[key]:
+            disease_list, symptom_list, herb_list = patient_dct[key][date]
+            symptom_list = [code for code in symptom_list if code not in
+                pruned_set]
+            herb_list = [code for code in herb_list if code not in pruned_set]
+            if len(symptom_list) > 0 and len(herb_list) > 0:
+                visit_dct[date] = (disease_list, symptom_list, herb_list)
+        if len(visit_dct) > 0:
+            pruned_dct[key] = visit_dct
+    return pruned_dct
+
+def prune_record(record, pruned_set):
+    '''
+    Removes the pruned codes from a record of parse_line. Returns None if the
+    visit is left without symptoms or herbs, as in prune_patient_dct.
+    '''
+    if record is None or len(pruned_set) == 0:
+        return record
+    key, visit_date, disease_list, symptom_list, herb_list = record
+    symptom_list = [code for code in symptom_list if code not in pruned_set]
+    herb_list = [code for code in herb_list if code not in pruned_set]
+    if len(symptom_list) == 0 or len(herb_list) == 0:
+        return None
+    return key, visit_date, disease_list, symptom_list, herb_list
+
+def write_code_mapping(code_list, kept_list, code_count_dct):
+    '''
+    Writes each code, its visit count, and its id in the pruned code list, or
+    -1 if it was pruned.
+    '''
+    id_dct = dict((code, i) for i, code in enumerate(kept_list))
+    out = open('./results/code_mapping.txt', 'w')
+    for code in sorted(code_list, key=lambda code: (-code_count_dct[code],
+        code)):
+        out.write('%s\t%d\t%d\n' % (code, code_count_dct[code], id_dct.get(
+            code, -1)))
+    out.close()
+
+def read_pruned_codes():
+    '''
+    Returns the set of codes pruned by the last run, for stages that read the
+    TCM data themselves.
+    '''
+    pruned_set = set()
+    if not os.path.exists('./results/code_mapping.txt'):
+        return pruned_set
+    f = open('./results/code_mapping.txt', 'r')
+    for line in f:
+        code, count, code_id = line.rstrip('\n').split('\t')
+        if code_id == '-1':
+            pruned_set.add(code)
+    f.close()
+    return pruned_set
 
 def make_pickle_lists(patient_dct, code_list):
     '''
@@ -101,6 +201,7 @@ def make_pickle_lists(patient_dct, code_list):
     integers. Returns two list of lists. The second list makes each symptom
     set into a visit, and then an herb set into a following visit.
     '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
     pickle_list, double_pickle_list = [], []
     for key in patient_dct:
         visit_dct = patient_dct[key]
@@ -110,8 +211,8 @@ def make_pickle_lists(patient_dct, code_list):
         for date in sorted(visit_dct.keys()):
             disease_list, symptom_list, herb_list = visit_dct[date]
             # Convert each symptom/herb to their index in the code list.
-            symptom_list = [code_list.index(symp) for symp in symptom_list]
-            herb_list = [code_list.index(herb) for herb in herb_list]
+            symptom_list = [code_dct[symp] for symp in symptom_list]
+            herb_list = [code_dct[herb] for herb in herb_list]
             # pickle_list is where each visit is all symptoms and herbs.
             pickle_list += [symptom_list + herb_list]
             # double_pickle_list is where each visit is separated into two
@@ -134,6 +235,18 @@ def write_code_list(code_list):
         out.write('%s\n' % code)
     out.close()
 
+def write_patient_list(patient_dct):
+    '''
+    Writes the name and date of birth of each patient in the pickle lists, in
+    the same order.
+    '''
+    out = open('./results/patient_list.txt', 'w')
+    for name, dob in patient_dct:
+        if len(patient_dct[(name, dob)]) == 1:
+            continue
+        out.write('%s\t%s\n' % (name, dob))
+    out.close()
+
 def generate_directories():
     results_dir = './results/'
     if not os.path.exists(results_dir):
@@ -143,19 +256,42 @@ def generate_directories():
         os.makedirs(med2vec_directory)
 
 def main():
+    if len(sys.argv) not in [1, 2, 3]:
+        print 'Usage: python %s min_count<optional> max_vocab<optional>' % (
+            sys.argv[0])
+        exit()
+    min_count, max_vocab = 1, 0
+    if len(sys.argv) >= 2:
+        min_count = int(sys.argv[1])
+    if len(sys.argv) == 3:
+        max_vocab = int(sys.argv[2])
+
     generate_directories()
-    patient_dct = get_patient_dct()
-    code_list = get_symptom_and_herb_counts(patient_dct)
+    with profiling.stage('parse'):
+        patient_dct = get_patient_dct()
+    with profiling.stage('count'):
+        code_list, code_count_dct = get_symptom_and_herb_counts(patient_dct)
+        kept_list = prune_code_list(code_list, code_count_dct, min_count,
+            max_vocab)
+        print 'kept %d of %d codes' % (len(kept_list), len(code_list))
+        write_code_mapping(code_list, kept_list, code_count_dct)
+        patient_dct = prune_patient_dct(patient_dct, set(code_list) - set(
+            kept_list))
+        code_list = kept_list
     # pickle_list contains visits that have symptoms and herbs joined.
     # double_pickle_list means the symptoms are a visit, followed by the herbs.
-    pickle_list, double_pickle_list = make_pickle_lists(patient_dct, code_list)
-
-    with open('./results/med2vec_input_baseline_visits.pickle', 'wb') as out:
-        cPickle.dump(pickle_list, out)
-    with open('./results/med2vec_input_separated_visits.pickle', 'wb') as out:
-        cPickle.dump(double_pickle_list, out)
+    with profiling.stage('index'):
+        pickle_list, double_pickle_list = make_pickle_lists(patient_dct,
+            code_list)
 
-    write_code_list(code_list)
+    with profiling.stage('write'):
+        with open('./results/med2vec_input_baseline_visits.pickle', 'wb') as out:
+            cPickle.dump(pickle_list, out)
+        with open('./results/med2vec_input_separated_visits.pickle', 'wb'
+            ) as out:
+            cPickle.dump(double_pickle_list, out)
+        write_code_list(code_list)
+        write_patient_list(patient_dct)
 
 if __name__ == '__main__':
     start_time = time.time()
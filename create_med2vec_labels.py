@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import cPickle
+import numpy as np
+import re
+from scipy.cluster.vq import kmeans2, whiten
+import sys
+import time
+
+### This script groups the medical codes into a smaller output space for
+### med2vec, and writes label files aligned with the visit files written by
+### create_med2vec_input.py. med2vec then predicts groups instead of raw codes,
+### which shrinks W_output and the visit-level softmax. Three groupings:
+### count: codes in fewer than min_count visits collapse into one rare herb and
+###     one rare symptom group.
+### dosage: herbs that only differ by their dosage share a group.
+### svd: k-means clusters of the SVD baseline embeddings. Must run
+###     cooccurrence_svd_baseline.py first.
+### Run time: 5 seconds.
+
+dosage_pattern = re.compile(r'[0-9.]+\s*(G|g|克)')
+
+def read_code_list():
+    '''
+    Reads the list of symptoms and herbs.
+    '''
+    code_list = []
+    f = open('./results/code_list.txt', 'r')
+    for line in f:
+        code_list += [line.strip()]
+    f.close()
+    return code_list
+
+def read_code_file(code_type):
+    '''
+    Given a code type, read the file to get the list of unique codes within
+    that type.
+    '''
+    data = {}
+    f = open('./data/%s_count_dct.txt' % code_type, 'r')
+    for line in f:
+        line = line.split()
+        data[line[0]] = int(line[1])
+    f.close()
+    return data
+
+def group_by_count(code_list, min_count):
+    '''
+    Returns the group name of each code. Codes that appear in at least
+    min_count visits are their own group.
+    '''
+    herb_count_dct = read_code_file('herb')
+    symptom_count_dct = read_code_file('symptom')
+    group_name_list = []
+    for code in code_list:
+        if code in herb_count_dct:
+            if herb_count_dct[code] < min_count:
+                code = 'rare_herb'
+        elif symptom_count_dct[code] < min_count:
+            code = 'rare_symptom'
+        group_name_list += [code]
+    return group_name_list
+
+def strip_dosage(code):
+    '''
+    Removes the dosage amounts, e.g. 10G, from an herb name. Codes that are
+    nothing but a dosage are left as they are.
+    '''
+    stripped = dosage_pattern.sub('', code).strip()
+    if stripped == '':
+        return code
+    return stripped
+
+def is_dosage_code(code):
+    '''
+    Returns True if the code carries a dosage amount, e.g. 10G.
+    '''
+    return dosage_pattern.search(code) is not None
+
+def group_by_dosage(code_list):
+    '''
+    Returns the group name of each code. Symptoms are their own group.
+    '''
+    herb_count_dct = read_code_file('herb')
+    group_name_list = []
+    for code in code_list:
+        if code in herb_count_dct:
+            code = strip_dosage(code)
+        group_name_list += [code]
+    return group_name_list
+
+def group_by_svd(code_list, n_clusters, svd_model):
+    '''
+    Clusters the SVD baseline embedding of each code with k-means. Herbs and
+    symptoms are clustered separately, so that a group never mixes the two.
+    '''
+    embedding_matrix = np.load('./results/%s_baseline/embeddings.npz' %
+        svd_model)['W_emb']
+    assert len(embedding_matrix) == len(code_list)
+    herb_count_dct = read_code_file('herb')
+    group_name_list = [None for code in code_list]
+    for code_type in ['herb', 'symptom']:
+        row_list = [i for i, code in enumerate(code_list) if (
+            code in herb_count_dct) == (code_type == 'herb')]
+        n_type_clusters = min(n_clusters, len(row_list))
+        np.random.seed(0)
+        centroids, cluster_list = kmeans2(whiten(embedding_matrix[row_list] +
+            1e-12), n_type_clusters, minit='points')
+        for row, cluster in zip(row_list, cluster_list):
+            group_name_list[row] = '%s_cluster_%d' % (code_type, cluster)
+    return group_name_list
+
+def get_group_ids(group_name_list):
+    '''
+    Maps each group name to an integer in order of first appearance. Returns
+    the code index to group id list and the list of group names.
+    '''
+    group_dct, group_list = {}, []
+    code_to_group = []
+    for group_name in group_name_list:
+        if group_name not in group_dct:
+            group_dct[group_name] = len(group_list)
+            group_list += [group_name]
+        code_to_group += [group_dct[group_name]]
+    return code_to_group, group_list
+
+def make_label_list(visit_list, code_to_group):
+    '''
+    Converts each visit to its list of unique groups. The [-1] patient
+    delimiters are kept, so the labels stay aligned with the visits.
+    '''
+    label_list = []
+    for visit in visit_list:
+        if visit == [-1]:
+            label_list += [[-1]]
+            continue
+        label_list += [sorted(set(code_to_group[code] for code in visit))]
+    return label_list
+
+def write_group_list(group_list, code_list, code_to_group):
+    '''
+    Writes out the group names, one per line, and the group of each code.
+    '''
+    out = open('./results/label_list.txt', 'w')
+    for group_name in group_list:
+        out.write('%s\n' % group_name)
+    out.close()
+    out = open('./results/code_to_label.txt', 'w')
+    for code, group_id in zip(code_list, code_to_group):
+        out.write('%s\t%d\t%s\n' % (code, group_id, group_list[group_id]))
+    out.close()
+
+def main():
+    if len(sys.argv) not in [2, 3, 4]:
+        print ('Usage: python %s count/dosage/svd min_count/n_clusters'
+            '<optional> svd_model<optional, e.g. co_svd_k100>' % sys.argv[0])
+        exit()
+    grouping = sys.argv[1]
+    assert grouping in ['count', 'dosage', 'svd']
+
+    code_list = read_code_list()
+    if grouping == 'count':
+        min_count = 10
+        if len(sys.argv) > 2:
+            min_count = int(sys.argv[2])
+        group_name_list = group_by_count(code_list, min_count)
+    elif grouping == 'dosage':
+        group_name_list = group_by_dosage(code_list)
+    else:
+        n_clusters, svd_model = 200, 'co_svd_k100'
+        if len(sys.argv) > 2:
+            n_clusters = int(sys.argv[2])
+        if len(sys.argv) > 3:
+            svd_model = sys.argv[3]
+        group_name_list = group_by_svd(code_list, n_clusters, svd_model)
+
+    code_to_group, group_list = get_group_ids(group_name_list)
+    write_group_list(group_list, code_list, code_to_group)
+    for model_type in ['baseline', 'separated']:
+        f = open('./results/med2vec_input_%s_visits.pickle' % model_type, 'rb')
+        visit_list = cPickle.load(f)
+        f.close()
+        with open('./results/med2vec_input_%s_labels.pickle' % model_type,
+            'wb') as out:
+            cPickle.dump(make_label_list(visit_list, code_to_group), out)
+    print '%d codes grouped into %d labels' % (len(code_list), len(group_list))
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+from create_med2vec_input import (get_patient_dct, prune_patient_dct,
+    read_pruned_codes)
+from lagged_transitions import get_new_herb_matrix, split_visit_matrix
+import numpy as np
+import os
+from scipy.sparse import csr_matrix
+import sys
+import time
+from visit_binary_matrix import read_code_list
+
+### This script computes the co-occurrence counts, PMI scores, and conditional
+### probabilities of compute_conditional_probabilities.py separately for
+### every disease code. Each visit is one row of a sparse visit x disease
+### indicator matrix, and each table is a sparse visit x pair incidence
+### matrix, so the counts of all diseases come from one product
+###     disease x pair = (visit x disease)^T (visit x pair)
+### instead of one run per disease. The results are written to an indexed
+### store, where row i of every table holds the pairs of disease i.
+### Must run create_med2vec_input.py first.
+
+store_fname = './results/disease_stratified/statistics.npz'
+index_fname = './results/disease_stratified/disease_index.txt'
+# Diseases with fewer visits are left out of the store.
+min_disease_visits = 10
+
+def get_visit_matrices(patient_dct, code_list):
+    '''
+    Returns the visit x code and visit x disease binary matrices, the disease
+    names, the patient_indptr of the visits, and the date of each visit.
+    Visits are ordered by patient and then by date, and patients with one
+    visit are skipped, as in the med2vec input.
+    '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    disease_dct, disease_list = {}, []
+    code_rows, code_cols, disease_rows, disease_cols = [], [], [], []
+    patient_indptr, date_list = [0], []
+    for key in patient_dct:
+        visit_dct = patient_dct[key]
+        if len(visit_dct) == 1:
+            continue
+        for date in sorted(visit_dct.keys()):
+            disease_codes, symptom_list, herb_list = visit_dct[date]
+            row = len(date_list)
+            for code in set(symptom_list + herb_list):
+                code_rows += [row]
+                code_cols += [code_dct[code]]
+            for disease in set(disease_codes):
+                if disease not in disease_dct:
+                    disease_dct[disease] = len(disease_list)
+                    disease_list += [disease]
+                disease_rows += [row]
+                disease_cols += [disease_dct[disease]]
+            date_list += [date]
+        patient_indptr += [len(date_list)]
+    num_visits = len(date_list)
+    visit_matrix = csr_matrix((np.ones(len(code_rows), dtype=np.int8), (
+        code_rows, code_cols)), shape=(num_visits, len(code_list)))
+    disease_matrix = csr_matrix((np.ones(len(disease_rows)), (disease_rows,
+        disease_cols)), shape=(num_visits, len(disease_list)))
+    return (visit_matrix, disease_matrix, disease_list, np.array(
+        patient_indptr), date_list)
+
+def get_pair_incidence(left_matrix, right_matrix, upper=False):
+    '''
+    Returns the visit x pair matrix with a one wherever a visit has both
+    codes of a (left code, right code) pair, and the pair columns as an
+    array of (left code, right code) rows. If upper, only pairs with the
+    left code below the right code are kept, for a matrix paired with itself.
+    '''
+    left_matrix, right_matrix = left_matrix.tocsr(), right_matrix.tocsr()
+    left_sizes, right_sizes = np.diff(left_matrix.indptr), np.diff(
+        right_matrix.indptr)
+    pair_sizes = left_sizes * right_sizes
+    visits = np.repeat(np.arange(len(pair_sizes)), pair_sizes)
+    # The position of each pair within its visit's block of pairs.
+    local = np.arange(len(visits)) - np.repeat(np.cumsum(pair_sizes) -
+        pair_sizes, pair_sizes)
+    left = left_matrix.indices[left_matrix.indptr[visits] + local //
+        right_sizes[visits]].astype(np.int64)
+    right = right_matrix.indices[right_matrix.indptr[visits] + local %
+        right_sizes[visits]].astype(np.int64)
+    if upper:
+        keep = left < right
+        visits, left, right = visits[keep], left[keep], right[keep]
+    pair_keys, pair_columns = np.unique(left * right_matrix.shape[1] + right,
+        return_inverse=True)
+    pair_list = np.column_stack([pair_keys // right_matrix.shape[1],
+        pair_keys % right_matrix.shape[1]])
+    return csr_matrix((np.ones(len(visits)), (visits, pair_columns)), shape=(
+        left_matrix.shape[0], len(pair_keys))), pair_list
+
+def group_by_disease(disease_matrix, incidence_matrix):
+    '''
+    Sums the rows of a visit matrix over the visits of each disease.
+    '''
+    return disease_matrix.T.dot(incidence_matrix).tocsr()
+
+def get_pair_statistics(pair_counts, pair_list, left_counts,
+    right_counts=None):
+    '''
+    Turns a disease x pair count matrix into a disease x pair matrix of
+    scores, given the disease x code counts of the codes of each pair. With
+    only left_counts, the score is P(right code | left code). With both, it is
+    the PMI of build_pmi_dct, log2(co-occurrence / (count_a * count_b)).
+    '''
+    pair_counts = pair_counts.tocoo()
+    left = left_counts[pair_counts.row, pair_list[pair_counts.col, 0]].A1
+    if right_counts is None:
+        scores = pair_counts.data / left
+    else:
+        right = right_counts[pair_counts.row, pair_list[pair_counts.col, 1]].A1
+        scores = np.log2(pair_counts.data / (left * right))
+    return csr_matrix((scores, (pair_counts.row, pair_counts.col)),
+        shape=pair_counts.shape)
+
+def compute_disease_tables(visit_matrix, disease_matrix, patient_indptr,
+    code_list):
+    '''
+    Returns a dictionary mapping each table name to its disease x pair counts,
+    its disease x pair scores, and the code names of its pair columns.
+    '''
+    symptom_matrix, herb_matrix, symptom_list, herb_list = split_visit_matrix(
+        visit_matrix, code_list)
+    new_herb_matrix = get_new_herb_matrix(herb_matrix, patient_indptr)
+    # A symptom is new if the patient did not have it at the previous visit.
+    new_symptom_matrix = get_new_herb_matrix(symptom_matrix, patient_indptr)
+    visit_matrix = visit_matrix.astype(np.float64)
+    code_counts = group_by_disease(disease_matrix, visit_matrix)
+
+    table_dct = {}
+    co_matrix, co_list = get_pair_incidence(visit_matrix, visit_matrix,
+        upper=True)
+    co_counts = group_by_disease(disease_matrix, co_matrix)
+    code_names = np.array(code_list)
+    table_dct['cooccurrence'] = (co_counts, co_counts, code_names[co_list])
+    table_dct['pmi'] = (co_counts, get_pair_statistics(co_counts, co_list,
+        code_counts, code_counts), code_names[co_list])
+    for name, given_matrix in [('herb_given_symptom', symptom_matrix), (
+        'herb_given_new_symptom', new_symptom_matrix)]:
+        pair_matrix, pair_list = get_pair_incidence(given_matrix,
+            new_herb_matrix)
+        pair_counts = group_by_disease(disease_matrix, pair_matrix)
+        given_counts = group_by_disease(disease_matrix, given_matrix)
+        # Store the pairs as (herb, symptom), the order of the unstratified
+        # conditional probability files.
+        pair_names = np.column_stack([np.array(herb_list)[pair_list[:, 1]],
+            np.array(symptom_list)[pair_list[:, 0]]])
+        table_dct[name] = (pair_counts, get_pair_statistics(pair_counts,
+            pair_list, given_counts), pair_names)
+    return table_dct
+
+def write_store(table_dct, disease_list, disease_visits):
+    '''
+    Writes every table of the diseases with at least min_disease_visits visits
+    as CSR arrays in one file, and the disease row index as text.
+    '''
+    keep = np.where(disease_visits >= min_disease_visits)[0]
+    array_dct = {'disease_list':np.array(disease_list)[keep],
+        'disease_visits':disease_visits[keep]}
+    for name in table_dct:
+        counts, scores, pair_names = table_dct[name]
+        counts = counts[keep].tocsr()
+        counts.sort_indices()
+        # A score can be an exact zero, such as a PMI of log2(1), which sparse
+        # indexing drops, so the scores are read at the pairs of the counts.
+        rows = keep[np.repeat(np.arange(len(keep)), np.diff(counts.indptr))]
+        array_dct['%s_pairs' % name] = pair_names
+        array_dct['%s_indptr' % name] = counts.indptr
+        array_dct['%s_indices' % name] = counts.indices
+        array_dct['%s_scores' % name] = np.asarray(scores.tocsr()[rows,
+            counts.indices]).ravel()
+        array_dct['%s_counts' % name] = counts.data
+    np.savez(store_fname, **array_dct)
+
+    out = open(index_fname, 'w')
+    for row, (disease, visits) in enumerate(zip(array_dct['disease_list'],
+        array_dct['disease_visits'])):
+        out.write('%s\t%d\t%d\n' % (disease, row, visits))
+    out.close()
+
+def load_disease_table(disease, table, min_count=10):
+    '''
+    Reads one disease's slice of a table from the store. Returns a list of
+    (code_a, code_b, score, count) sorted by score. Pairs with counts below
+    min_count are skipped, as in the unstratified outputs.
+    '''
+    store = np.load(store_fname)
+    row = list(store['disease_list']).index(disease)
+    start, end = store['%s_indptr' % table][row:row + 2]
+    pair_names = store['%s_pairs' % table][store['%s_indices' % table][
+        start:end]]
+    scores = store['%s_scores' % table][start:end]
+    counts = store['%s_counts' % table][start:end]
+    order = np.argsort(-scores, kind='mergesort')
+    return [(pair_names[i][0], pair_names[i][1], scores[i], counts[i]) for i
+        in order if counts[i] >= min_count]
+
+def main():
+    if len(sys.argv) not in [1, 4]:
+        print ('Usage: python %s disease<optional> cooccurrence/pmi/'
+            'herb_given_symptom/herb_given_new_symptom<optional> '
+            'n_top<optional>' % sys.argv[0])
+        exit()
+    if len(sys.argv) == 4:
+        disease, table, n_top = sys.argv[1], sys.argv[2], int(sys.argv[3])
+        for code_a, code_b, score, count in load_disease_table(disease, table
+            )[:n_top]:
+            print '%s\t%s\t%f\t%d' % (code_a, code_b, score, count)
+        return
+
+    out_folder = os.path.dirname(store_fname)
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    code_list = read_code_list()
+    visit_matrix, disease_matrix, disease_list, patient_indptr, date_list = (
+        get_visit_matrices(prune_patient_dct(get_patient_dct(),
+        read_pruned_codes()), code_list))
+    table_dct = compute_disease_tables(visit_matrix, disease_matrix,
+        patient_indptr, code_list)
+    disease_visits = np.asarray(disease_matrix.sum(axis=0)).ravel()
+    write_store(table_dct, disease_list, disease_visits)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,260 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+from recommend_herbs import (HerbRecommender, HiddenScorer, get_code_indices,
+    get_conditional_matrix, get_embedding_matrix, get_pmi_matrix)
+from scipy.linalg import svd
+from scipy.sparse import csr_matrix
+import time
+from visit_binary_matrix import (load_patient_indptr, load_sparse_visit_matrix,
+    read_code_list)
+
+### This script compares the herb prediction of the models on held-out
+### patients. The patients are split into n_folds folds. For each fold, the
+### models are built from the visits of the other folds, and every held-out
+### visit with symptoms and herbs is a query: its symptoms are scored with
+### recommend_herbs.py and its herbs are the answers. Reports recall@k,
+### nDCG@k, and MAP@k per model, averaged over the held-out visits of all
+### folds. The models are
+###     conditional, pmi, cooccurrence: built from the fold's counts.
+###     co_svd_k<k>, pmi_svd_k<k>: cosine of the rows of U sqrt(S) of the SVD
+###         of the fold's co-occurrence or PMI matrix.
+###     embedding:<archive>, hidden:<archive>: a trained W_emb or med2vec
+###         model. If the path has %d, it is replaced by the fold number, so
+###         models trained without the fold's patients can be used. Otherwise
+###         the model has seen the held-out patients.
+### The co-occurrence counts of each fold are cached by the hash of the visit
+### matrix and the split, and (model, fold) pairs run in a process pool.
+### Must run visit_binary_matrix.py first.
+
+out_folder = './results/evaluation'
+# The visit matrix is stored at module level so forked workers inherit it.
+eval_data = None
+
+def get_input_hash(visit_matrix, patient_indptr, n_folds, seed):
+    sha = hashlib.sha1()
+    for array in [visit_matrix.indices, visit_matrix.indptr, patient_indptr,
+        np.array(visit_matrix.shape), np.array([n_folds, seed])]:
+        sha.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+def get_fold_visits(patient_indptr, n_folds, seed):
+    '''
+    Shuffles the patients into n_folds folds. Returns the fold of each visit.
+    '''
+    num_patients = len(patient_indptr) - 1
+    patient_folds = np.random.RandomState(seed).permutation(num_patients
+        ) % n_folds
+    return np.repeat(patient_folds, np.diff(patient_indptr))
+
+def get_fold_cache(visit_matrix, visit_folds, n_folds, cache_dir):
+    '''
+    Writes the code x code co-occurrence counts, the code counts, and the
+    number of visits of the training visits of each fold, unless they are
+    already in cache_dir.
+    '''
+    # The metadata is written last, so its presence means the cache is done.
+    if os.path.exists('%s/meta.json' % cache_dir):
+        print 'reusing fold counts in %s' % cache_dir
+        return
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    for fold in range(n_folds):
+        train_matrix = visit_matrix[visit_folds != fold].astype(np.float64)
+        np.savez('%s/fold_%d.npz' % (cache_dir, fold), co_counts=
+            train_matrix.T.dot(train_matrix).toarray(), code_counts=np.asarray(
+            train_matrix.sum(axis=0)).ravel(), num_visits=train_matrix.shape[0])
+    out = open('%s/meta.json' % cache_dir, 'w')
+    json.dump({'n_folds':n_folds, 'shape':list(visit_matrix.shape)}, out)
+    out.close()
+
+def get_svd_embeddings(matrix, k):
+    '''
+    Returns the rows of U sqrt(S) for the top k singular values.
+    '''
+    U, s, Vh = svd(matrix)
+    return U[:, :k] * np.sqrt(s[:k])
+
+def get_fold_pmi(co_counts, code_counts):
+    '''
+    The PMI matrix of co_occ_to_pmi_matrix, log2(co / (count_a * count_b)),
+    with zero for pairs that never co-occur.
+    '''
+    counts = np.maximum(code_counts, 1)
+    pmi_matrix = co_counts / np.outer(counts, counts)
+    pmi_matrix[pmi_matrix == 0] = 1
+    return np.log2(pmi_matrix)
+
+def get_fold_recommender(model, fold, cache_dir, symptom_index, herb_index):
+    '''
+    Builds a model from the training visits of a fold.
+    '''
+    if model.startswith('embedding:') or model.startswith('hidden:'):
+        scoring, model_fname = model.split(':', 1)
+        if '%d' in model_fname:
+            model_fname = model_fname % fold
+        if scoring == 'hidden':
+            scorer = HiddenScorer(np.load(model_fname), herb_index)
+        else:
+            scorer = get_embedding_matrix(np.load(model_fname)['W_emb'],
+                symptom_index, herb_index)
+        return HerbRecommender(scorer, symptom_index, herb_index)
+
+    cache = np.load('%s/fold_%d.npz' % (cache_dir, fold))
+    co_counts, code_counts = cache['co_counts'], cache['code_counts']
+    count_matrices = (co_counts[np.ix_(symptom_index, herb_index)],
+        code_counts[symptom_index], code_counts[herb_index], int(cache[
+        'num_visits']))
+    if model == 'conditional':
+        scorer = get_conditional_matrix(count_matrices)
+    elif model == 'pmi':
+        scorer = get_pmi_matrix(count_matrices)
+    elif model == 'cooccurrence':
+        scorer = count_matrices[0].astype(np.float32)
+    else:
+        matrix_type, k = model.split('_svd_k')
+        matrix = co_counts
+        if matrix_type == 'pmi':
+            matrix = get_fold_pmi(co_counts, code_counts)
+        scorer = get_embedding_matrix(get_svd_embeddings(matrix, int(k)),
+            symptom_index, herb_index)
+    return HerbRecommender(scorer, symptom_index, herb_index)
+
+def get_hits(top_codes, answer_matrix):
+    '''
+    Returns whether each recommended code is one of the query's answers.
+    '''
+    answer_matrix = answer_matrix.tocsr()
+    answer_matrix.sort_indices()
+    num_codes = answer_matrix.shape[1]
+    answer_keys = np.repeat(np.arange(answer_matrix.shape[0]), np.diff(
+        answer_matrix.indptr)) * num_codes + answer_matrix.indices
+    # A fold can be left without queries, and so without answers.
+    if len(answer_keys) == 0:
+        return np.zeros(np.shape(top_codes), dtype=bool)
+    top_keys = np.arange(len(top_codes))[:, None] * num_codes + top_codes
+    positions = np.minimum(np.searchsorted(answer_keys, top_keys), len(
+        answer_keys) - 1)
+    return answer_keys[positions] == top_keys
+
+def get_metric_sums(hits, n_answers, k_list):
+    '''
+    Returns the sums over queries of recall@k, nDCG@k, and MAP@k for each k.
+    '''
+    discounts = 1 / np.log2(np.arange(hits.shape[1]) + 2.0)
+    ideal_dcg = np.cumsum(discounts)
+    precisions = np.cumsum(hits, axis=1) / np.arange(1.0, hits.shape[1] + 1)
+    metric_dct = {}
+    for k in k_list:
+        # There may be fewer herbs than k.
+        k_hits = hits[:, :k]
+        n_relevant = np.minimum(n_answers, k_hits.shape[1])
+        metric_dct['recall@%d' % k] = (k_hits.sum(axis=1) / n_answers.astype(
+            np.float64)).sum()
+        metric_dct['ndcg@%d' % k] = ((k_hits * discounts[:k]).sum(axis=1) /
+            ideal_dcg[n_relevant - 1]).sum()
+        metric_dct['map@%d' % k] = ((k_hits * precisions[:, :k]).sum(axis=1) /
+            n_relevant.astype(np.float64)).sum()
+    return metric_dct
+
+def evaluate_fold(arguments):
+    '''
+    Scores the held-out visits of one fold with one model. Returns the model,
+    the fold, the metric sums, and the number of queries.
+    '''
+    model, fold = arguments
+    visit_matrix, visit_folds, cache_dir, symptom_index, herb_index, k_list = (
+        eval_data)
+    test_matrix = visit_matrix[visit_folds == fold]
+    is_herb = np.zeros((1, test_matrix.shape[1]))
+    is_herb[0, herb_index] = 1
+    query_matrix = csr_matrix(test_matrix.multiply(1 - is_herb))
+    answer_matrix = csr_matrix(test_matrix.multiply(is_herb))
+    # Only visits with symptoms and herbs are queries.
+    keep = (np.diff(query_matrix.indptr) > 0) & (np.diff(answer_matrix.indptr
+        ) > 0)
+    query_matrix, answer_matrix = query_matrix[keep], answer_matrix[keep]
+
+    recommender = get_fold_recommender(model, fold, cache_dir, symptom_index,
+        herb_index)
+    top_codes, top_scores = recommender.recommend(query_matrix, max(k_list))
+    hits = get_hits(top_codes, answer_matrix)
+    return model, fold, get_metric_sums(hits, np.diff(answer_matrix.indptr),
+        k_list), query_matrix.shape[0]
+
+def write_metrics(result_list, model_list, k_list):
+    '''
+    Writes the metrics of each model averaged over all held-out visits, and
+    the metrics of each fold.
+    '''
+    metric_list = ['%s@%d' % (metric, k) for metric in ['recall', 'ndcg',
+        'map'] for k in k_list]
+    out = open('%s/metrics.txt' % out_folder, 'w')
+    fold_out = open('%s/fold_metrics.txt' % out_folder, 'w')
+    out.write('#Model\tQueries\t%s\n' % '\t'.join(metric_list))
+    fold_out.write('#Model\tFold\tQueries\t%s\n' % '\t'.join(metric_list))
+    for model in model_list:
+        model_results = sorted([result for result in result_list if result[0]
+            == model], key=lambda result: result[1])
+        n_queries = sum(result[3] for result in model_results)
+        out.write('%s\t%d\t%s\n' % (model, n_queries, '\t'.join('%f' % (sum(
+            result[2][metric] for result in model_results) / max(n_queries, 1))
+            for metric in metric_list)))
+        for model, fold, metric_dct, fold_queries in model_results:
+            fold_out.write('%s\t%d\t%d\t%s\n' % (model, fold, fold_queries,
+                '\t'.join('%f' % (metric_dct[metric] / max(fold_queries, 1))
+                for metric in metric_list)))
+    out.close()
+    fold_out.close()
+
+def main():
+    global eval_data
+    parser = argparse.ArgumentParser()
+    parser.add_argument('models', nargs='*', default=['conditional', 'pmi',
+        'cooccurrence', 'co_svd_k50', 'pmi_svd_k50'], help='conditional, pmi, '
+        'cooccurrence, co_svd_k<k>, pmi_svd_k<k>, embedding:<archive>, or '
+        'hidden:<archive>')
+    parser.add_argument('--folds', type=int, default=5, help='(default '
+        'value: 5)')
+    parser.add_argument('--seed', type=int, default=0, help='(default value: '
+        '0)')
+    parser.add_argument('-k', type=int, nargs='+', default=[5, 10, 20],
+        help='(default value: 5 10 20)')
+    parser.add_argument('-j', '--processes', type=int,
+        default=multiprocessing.cpu_count(), help='(default value: number of '
+        'CPUs)')
+    args = parser.parse_args()
+
+    visit_matrix = load_sparse_visit_matrix()
+    patient_indptr = load_patient_indptr()
+    symptom_index, herb_index = get_code_indices(read_code_list())
+    visit_folds = get_fold_visits(patient_indptr, args.folds, args.seed)
+    cache_dir = '%s/fold_cache/%s' % (out_folder, get_input_hash(visit_matrix,
+        patient_indptr, args.folds, args.seed))
+    get_fold_cache(visit_matrix, visit_folds, args.folds, cache_dir)
+
+    eval_data = (visit_matrix, visit_folds, cache_dir, symptom_index,
+        herb_index, sorted(args.k))
+    task_list = [(model, fold) for model in args.models for fold in range(
+        args.folds)]
+    if args.processes == 1:
+        result_list = map(evaluate_fold, task_list)
+    else:
+        pool = multiprocessing.Pool(args.processes)
+        result_list = pool.map(evaluate_fold, task_list, chunksize=1)
+        pool.close()
+        pool.join()
+    write_metrics(result_list, args.models, sorted(args.k))
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,110 @@
+### Author: Edward Huang
+
+import argparse
+import numpy as np
+import os
+import time
+from visit_binary_matrix import read_code_list
+
+### This script exports the W_emb matrix of a model archive, either a med2vec
+### epoch or an SVD baseline's embeddings.npz, into formats that load without
+### decompressing the archive.
+###     embeddings.npy: float32 rows in code_list order, uncompressed, so it can
+###         be opened with np.load(mmap_mode='r') and read one row at a time.
+###         With --normalize, every row has unit length, so dot products are
+###         cosine similarities.
+###     vectors.txt, vectors.bin: the word2vec text and binary formats.
+###     code_index.txt: the row, code, and herb/symptom type of every code.
+### Must run create_med2vec_input.py first.
+
+def read_code_types():
+    '''
+    Returns a dictionary mapping each code to herb or symptom.
+    '''
+    type_dct = {}
+    for code_type in ['herb', 'symptom']:
+        f = open('./data/%s_count_dct.txt' % code_type, 'r')
+        for line in f:
+            type_dct[line.split()[0]] = code_type
+        f.close()
+    return type_dct
+
+def get_embeddings(model_fname, normalize):
+    embeddings = np.load(model_fname)['W_emb'].astype(np.float32)
+    if normalize:
+        norms = np.linalg.norm(embeddings, axis=1)
+        # Leave rows of zeros as they are.
+        norms[norms == 0] = 1
+        embeddings /= norms[:, None]
+    return np.ascontiguousarray(embeddings)
+
+def write_word2vec(embeddings, code_list, out_dir):
+    '''
+    Writes the word2vec text format, and the binary format, where each vector
+    is written as raw little-endian float32 after its code and a space.
+    '''
+    header = '%d %d\n' % embeddings.shape
+    text_out = open('%s/vectors.txt' % out_dir, 'w')
+    binary_out = open('%s/vectors.bin' % out_dir, 'wb')
+    text_out.write(header)
+    binary_out.write(header)
+    for code, row in zip(code_list, embeddings):
+        text_out.write('%s %s\n' % (code, ' '.join('%f' % value for value in
+            row)))
+        binary_out.write('%s %s\n' % (code, row.astype('<f4').tobytes()))
+    text_out.close()
+    binary_out.close()
+
+def write_code_index(code_list, out_dir):
+    type_dct = read_code_types()
+    out = open('%s/code_index.txt' % out_dir, 'w')
+    for row, code in enumerate(code_list):
+        out.write('%d\t%s\t%s\n' % (row, code, type_dct.get(code, 'unknown')))
+    out.close()
+
+def load_code_index(out_dir):
+    '''
+    Returns a dictionary mapping each code to its (row, type).
+    '''
+    index_dct = {}
+    f = open('%s/code_index.txt' % out_dir, 'r')
+    for line in f:
+        row, code, code_type = line.strip().split('\t')
+        index_dct[code] = (int(row), code_type)
+    f.close()
+    return index_dct
+
+def load_embeddings(out_dir):
+    '''
+    Returns the exported embeddings as a read-only memory map.
+    '''
+    return np.load('%s/embeddings.npy' % out_dir, mmap_mode='r')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_fname', help='The .npz archive with W_emb, '
+        'e.g. ./results/med2vec_output/baseline_model.499.npz')
+    parser.add_argument('--out_dir', default='', help='The folder to write '
+        'to (default value: ./results/embeddings/<archive name>)')
+    parser.add_argument('--normalize', action='store_true', help='Scale every '
+        'vector to unit length')
+    args = parser.parse_args()
+
+    out_dir = args.out_dir
+    if out_dir == '':
+        out_dir = './results/embeddings/%s' % os.path.basename(
+            args.model_fname)[:-len('.npz')]
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    code_list = read_code_list()
+    embeddings = get_embeddings(args.model_fname, args.normalize)
+    assert len(embeddings) == len(code_list)
+    np.save('%s/embeddings.npy' % out_dir, embeddings)
+    write_word2vec(embeddings, code_list, out_dir)
+    write_code_index(code_list, out_dir)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
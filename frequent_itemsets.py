@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+from bitset_exclusivity import (build_code_bitsets, get_candidate_codes,
+    popcount, read_code_list)
+import multiprocessing
+import numpy as np
+import os
+from result_store import insert_sets
+import sys
+import time
+from visit_binary_matrix import load_sparse_visit_matrix
+
+### This script mines the frequent herb-symptom itemsets of the visits with a
+### vertical bitset Eclat search. Every item is a packed bitset of its visits,
+### and the support of all extensions of an itemset is computed with one
+### vectorized AND and popcount. The constraints are applied during the
+### search instead of after it:
+###     min_support: an itemset is only extended if it is in at least
+###         min_support visits.
+###     mixed: items are ordered symptoms first, and every itemset starts with
+###         a symptom, so an all-herb itemset is never built. An itemset of
+###         only symptoms is only extended with herbs once it is one item
+###         short of max_size.
+###     dosage codes are never items.
+### Itemsets rooted at different symptoms are mined in parallel.
+### Must run visit_binary_matrix.py first.
+
+# The item bitsets are stored at module level so forked workers inherit them.
+item_data = None
+
+def extend_itemset(itemset, has_herb, prefix_bits, extension_list, results):
+    '''
+    Appends every frequent mixed itemset that starts with itemset to results.
+    extension_list holds the items that may still be added, in order.
+    '''
+    bitsets, is_herb, min_support, max_size = item_data
+    if len(itemset) == max_size or len(extension_list) == 0:
+        return
+    if len(itemset) == max_size - 1 and not has_herb:
+        extension_list = extension_list[is_herb[extension_list]]
+    supports = popcount(prefix_bits[None, :] & bitsets[extension_list])
+    frequent = supports >= min_support
+    extension_list, supports = extension_list[frequent], supports[frequent]
+    for i, item in enumerate(extension_list):
+        new_itemset = itemset + [item]
+        new_has_herb = has_herb or is_herb[item]
+        if new_has_herb:
+            results += [(new_itemset, supports[i])]
+        extend_itemset(new_itemset, new_has_herb, prefix_bits & bitsets[item],
+            extension_list[i + 1:], results)
+
+def mine_root(root):
+    '''
+    Mines every itemset whose first item is the root symptom.
+    '''
+    bitsets, is_herb, min_support, max_size = item_data
+    results = []
+    extend_itemset([root], False, bitsets[root], np.arange(root + 1, len(
+        bitsets)), results)
+    return results
+
+def mine_itemsets(bitsets, symptom_list, herb_list, min_support, max_size,
+    n_processes):
+    '''
+    Returns a list of (code index list, support) of every frequent itemset
+    with at least one symptom and one herb and at most max_size codes.
+    '''
+    global item_data
+    # Items are numbered symptoms first, then herbs.
+    item_list = np.concatenate([symptom_list, herb_list])
+    is_herb = np.arange(len(item_list)) >= len(symptom_list)
+    item_data = (bitsets[item_list], is_herb, min_support, max_size)
+    root_list = range(len(symptom_list))
+
+    if n_processes == 1:
+        result_lists = map(mine_root, root_list)
+    else:
+        pool = multiprocessing.Pool(n_processes)
+        result_lists = pool.map(mine_root, root_list, chunksize=1)
+        pool.close()
+        pool.join()
+    return [(list(item_list[itemset]), support) for results in result_lists for
+        itemset, support in results]
+
+def write_itemsets(itemset_list, code_list, min_support, max_size):
+    '''
+    Writes the itemsets in Chinese, by size and then by support.
+    '''
+    out_folder = './results/frequent_itemsets'
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    itemset_list = sorted(itemset_list, key=lambda pair: (len(pair[0]),
+        -pair[1]))
+    out = open('%s/min%d_max%d-chinese.tsv' % (out_folder, min_support,
+        max_size), 'w')
+    out.write('#Codes\tSize\tSupport\n')
+    for itemset, support in itemset_list:
+        out.write('%s\t%d\t%d\n' % (','.join(code_list[code] for code in
+            itemset), len(itemset), support))
+    out.close()
+    insert_sets('frequent_itemsets_min%d_max%d' % (min_support, max_size), [(
+        [code_list[code] for code in itemset], support) for itemset, support in
+        itemset_list])
+
+def main():
+    if len(sys.argv) not in [3, 4]:
+        print ('Usage: python %s min_support max_size num_processes<optional>'
+            % sys.argv[0])
+        exit()
+    min_support, max_size = int(sys.argv[1]), int(sys.argv[2])
+    assert max_size >= 2
+    n_processes = multiprocessing.cpu_count()
+    if len(sys.argv) == 4:
+        n_processes = int(sys.argv[3])
+
+    code_list = read_code_list()
+    bitsets = build_code_bitsets(load_sparse_visit_matrix())
+    # Single codes below min_support can never be part of a frequent itemset.
+    herb_list, symptom_list = get_candidate_codes(code_list, min_support)
+    itemset_list = mine_itemsets(bitsets, symptom_list, herb_list, min_support,
+        max_size, n_processes)
+    write_itemsets(itemset_list, code_list, min_support, max_size)
+    print '%d frequent itemsets' % len(itemset_list)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -6,6 +6,8 @@
 import numpy as np
 import operator
 import os
+import profiling
+from result_store import insert_scores
 from scipy.spatial.distance import pdist, squareform
 import sys
 import time
@@ -55,26 +57,29 @@ def write_most_similar_pairs(data, code_list, model_type):
     similarity scores for each pair. Write them out to file.
     '''
     embedding_matrix = data['W_emb']
-    # Compute pairwise cosine similarity.
-    similarity_matrix = squareform(pdist(embedding_matrix, 'cosine'))
-
-    assert len(similarity_matrix) == len(embedding_matrix)
-
-    similarity_dct = {}
-    for row_i, row in enumerate(similarity_matrix):
-        row_code = code_list[row_i]
-        for col_i in range(row_i + 1, len(row)):
-            col_code = code_list[col_i]
-            similarity_dct[(row_code, col_code)] = 1 - row[col_i]
-    # Sort the pairs of codes by their cosine simliarity.
-    similarity_dct = sorted(similarity_dct.items(), key=operator.itemgetter(1),
-        reverse=True)
+    with profiling.stage('similarity'):
+        # Compute pairwise cosine similarity.
+        similarity_matrix = squareform(pdist(embedding_matrix, 'cosine'))
+
+        assert len(similarity_matrix) == len(embedding_matrix)
+
+        similarity_dct = {}
+        for row_i, row in enumerate(similarity_matrix):
+            row_code = code_list[row_i]
+            for col_i in range(row_i + 1, len(row)):
+                col_code = code_list[col_i]
+                similarity_dct[(row_code, col_code)] = 1 - row[col_i]
+        # Sort the pairs of codes by their cosine simliarity.
+        similarity_dct = sorted(similarity_dct.items(),
+            key=operator.itemgetter(1), reverse=True)
 
     herb_count_dct = read_code_file('herb')
     symptom_count_dct = read_code_file('symptom')
 
     # We only want 1000 of herb-herb, symptom-symptom, and herb-symptoms.
     hh_count, ss_count, hs_count = 0, 0, 0
+    # The written rows are also stored in the result database.
+    stored_list = []
 
     # Write out to one of three files.
     folder = './results/med2vec_baseline'
@@ -115,10 +120,12 @@ def write_most_similar_pairs(data, code_list, model_type):
                 continue
             hs_out.write(out_str)
             hs_count += 1
+        stored_list += [(code_a, code_b, cosine)]
     
     ss_out.close()
     hs_out.close()
     hh_out.close()
+    insert_scores('med2vec_%s' % model_type, stored_list)
 
 def generate_folders():
     directory = './results/med2vec_baseline'
@@ -141,10 +148,11 @@ def main():
 
     generate_folders()
 
-    baseline_data = read_npz_file(baseline_last_epoch, baseline_name)
-    separated_data = read_npz_file(separated_last_epcoh, separated_name)
+    with profiling.stage('parse'):
+        baseline_data = read_npz_file(baseline_last_epoch, baseline_name)
+        separated_data = read_npz_file(separated_last_epcoh, separated_name)
 
-    code_list = get_code_list()
+        code_list = get_code_list()
     write_most_similar_pairs(baseline_data, code_list, baseline_name)
     write_most_similar_pairs(separated_data, code_list, separated_name)
 
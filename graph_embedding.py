@@ -0,0 +1,299 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+from get_most_similar_med2vec_pairs import (generate_folders,
+    write_most_similar_pairs)
+import multiprocessing
+import numpy as np
+import os
+import profiling
+from scipy.sparse import csr_matrix, diags
+import time
+from visit_binary_matrix import load_sparse_visit_matrix, read_code_list
+
+### This script embeds the symptoms and herbs with random walks on their
+### co-occurrence graph, in time linear in the number of edges. The graph has
+### an edge between two codes that occur in the same visit, weighted by the
+### number of such visits, so its adjacency matrix is X^T X without the
+### diagonal, for the visit x code matrix X. num_walks walks of walk_length
+### codes start at each code. A step moves to a neighbor with probability
+### proportional to the edge weight (DeepWalk), drawn from per-code alias
+### tables, and with p or q not 1, that weight is multiplied by 1 / p for
+### returning to the previous code, 1 for a neighbor of the previous code,
+### and 1 / q otherwise (node2vec). The second-order steps are drawn by
+### rejection from the first-order ones, so no per-edge tables are needed.
+### All walks of a shard take their steps together, and the shards run in a
+### process pool. Skip-gram with negative sampling is then trained on the
+### codes within window steps of each other, in mini-batches. W_emb, with
+### one row per code of code_list.txt, is written to
+### ./results/graph_embedding/<model name>/embeddings.npz, and the most
+### similar pairs as by get_most_similar_med2vec_pairs.py.
+### Must run visit_binary_matrix.py first.
+
+out_folder = './results/graph_embedding'
+# Shards of walks per process.
+shards_per_process = 4
+# Walks whose pairs are shuffled and trained together.
+walk_block_size = 10000
+# The learning rate decays linearly to this fraction of its initial value.
+min_lr_fraction = 1e-4
+# The graph is stored at module level so forked workers inherit it.
+walk_data = None
+
+def get_graph(visit_matrix):
+    '''
+    Returns the weighted co-occurrence graph as a CSR matrix with sorted
+    indices.
+    '''
+    visit_matrix = visit_matrix.astype(np.float64)
+    graph = csr_matrix(visit_matrix.T.dot(visit_matrix))
+    graph = csr_matrix(graph - diags(graph.diagonal()))
+    graph.eliminate_zeros()
+    graph.sort_indices()
+    return graph
+
+def build_alias_tables(weights, indptr):
+    '''
+    Builds an alias table, by Vose's method, for the weights of each row
+    from indptr[i] to indptr[i + 1]. Returns the probability of keeping each
+    entry and the offset of its alias within the row.
+    '''
+    prob = np.ones(len(weights))
+    alias = np.zeros(len(weights), dtype=np.int64)
+    for start, end in zip(indptr[:-1], indptr[1:]):
+        if end == start:
+            continue
+        scaled = weights[start:end] * (end - start) / weights[start:end].sum()
+        small = [i for i in range(end - start) if scaled[i] < 1]
+        large = [i for i in range(end - start) if scaled[i] >= 1]
+        while len(small) > 0 and len(large) > 0:
+            s, l = small.pop(), large[-1]
+            prob[start + s], alias[start + s] = scaled[s], l
+            scaled[l] += scaled[s] - 1
+            if scaled[l] < 1:
+                small += [large.pop()]
+        # The rest are 1 up to rounding, and keep their own entry.
+    return prob, alias
+
+def sample_alias(prob, alias, indptr, rows, rng):
+    '''
+    Draws one entry of each of the given rows. Returns the entry indices.
+    '''
+    starts = indptr[rows]
+    entries = starts + (rng.random_sample(len(rows)) * (indptr[rows + 1] -
+        starts)).astype(np.int64)
+    keep = rng.random_sample(len(rows)) < prob[entries]
+    return np.where(keep, entries, starts + alias[entries])
+
+def is_edge(edge_keys, num_codes, code_a, code_b):
+    '''
+    Returns whether each (code_a, code_b) is an edge. edge_keys are the sorted
+    row * num_codes + column keys of the edges.
+    '''
+    keys = code_a.astype(np.int64) * num_codes + code_b
+    positions = np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) -
+        1)
+    return edge_keys[positions] == keys
+
+def generate_walks(arguments):
+    '''
+    Returns a walk x walk_length array of codes, with a walk starting at each
+    of the start codes.
+    '''
+    seed, starts = arguments
+    indptr, indices, prob, alias, edge_keys, p, q, walk_length = walk_data
+    rng = np.random.RandomState(seed)
+    num_codes = len(indptr) - 1
+    max_bias = max(1.0 / p, 1.0, 1.0 / q)
+    walks = np.zeros((len(starts), walk_length), dtype=np.int32)
+    walks[:, 0] = starts
+    for step in range(1, walk_length):
+        current = walks[:, step - 1]
+        if step == 1 or (p == 1 and q == 1):
+            walks[:, step] = indices[sample_alias(prob, alias, indptr,
+                current, rng)]
+            continue
+        previous = walks[:, step - 2]
+        # Redraw the rejected steps until every walk has moved.
+        pending = np.arange(len(starts))
+        while len(pending) > 0:
+            candidates = indices[sample_alias(prob, alias, indptr, current[
+                pending], rng)]
+            bias = np.where(candidates == previous[pending], 1.0 / p,
+                np.where(is_edge(edge_keys, num_codes, previous[pending],
+                candidates), 1.0, 1.0 / q))
+            accept = rng.random_sample(len(pending)) * max_bias < bias
+            walks[pending[accept], step] = candidates[accept]
+            pending = pending[~accept]
+    return walks
+
+def get_walks(graph, num_walks, walk_length, p, q, n_processes, seed):
+    '''
+    Returns num_walks walks from each code with an edge, in shuffled order.
+    '''
+    global walk_data
+    prob, alias = build_alias_tables(graph.data, graph.indptr)
+    edge_keys = np.repeat(np.arange(graph.shape[0], dtype=np.int64), np.diff(
+        graph.indptr)) * graph.shape[0] + graph.indices
+    walk_data = (graph.indptr, graph.indices, prob, alias, edge_keys, p, q,
+        walk_length)
+    rng = np.random.RandomState(seed)
+    starts = np.tile(np.where(np.diff(graph.indptr) > 0)[0], num_walks)
+    rng.shuffle(starts)
+    n_shards = max(1, min(len(starts), n_processes * shards_per_process))
+    shard_list = [(seed + 1 + i, shard) for i, shard in enumerate(
+        np.array_split(starts, n_shards))]
+    if n_processes == 1:
+        walk_lists = map(generate_walks, shard_list)
+    else:
+        pool = multiprocessing.Pool(n_processes)
+        walk_lists = pool.map(generate_walks, shard_list)
+        pool.close()
+        pool.join()
+    return np.vstack(walk_lists)
+
+def get_pairs(walks, window):
+    '''
+    Returns the (center, context) pairs of codes within window steps of each
+    other in the walks, in both directions.
+    '''
+    center_list, context_list = [], []
+    for offset in range(1, min(window, walks.shape[1] - 1) + 1):
+        center_list += [walks[:, :-offset].ravel(), walks[:, offset:].ravel()]
+        context_list += [walks[:, offset:].ravel(), walks[:, :-offset].ravel()]
+    return np.concatenate(center_list), np.concatenate(context_list)
+
+def subtract_rows(matrix, rows, values, lr):
+    '''
+    matrix[rows] -= lr * values, summing the values of repeated rows.
+    '''
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    sums = csr_matrix((np.ones(len(rows), dtype=values.dtype), (inverse,
+        np.arange(len(rows)))), shape=(len(unique_rows), len(rows))).dot(
+        values)
+    matrix[unique_rows] -= lr * sums
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+def train_batch(W_in, W_out, centers, contexts, negatives, lr):
+    '''
+    One SGD step of skip-gram with negative sampling. Returns the summed loss
+    of the batch.
+    '''
+    v = W_in[centers]
+    u_pos, u_neg = W_out[contexts], W_out[negatives]
+    s_pos = sigmoid((v * u_pos).sum(axis=1))
+    s_neg = sigmoid(np.einsum('bkd,bd->bk', u_neg, v))
+    loss = -np.log(s_pos + 1e-10).sum() - np.log(1 - s_neg + 1e-10).sum()
+    g_pos, g_neg = s_pos - 1, s_neg
+    grad_v = g_pos[:, None] * u_pos + np.einsum('bk,bkd->bd', g_neg, u_neg)
+    subtract_rows(W_out, contexts, g_pos[:, None] * v, lr)
+    subtract_rows(W_out, negatives.ravel(), (g_neg[:, :, None] * v[:, None,
+        :]).reshape(-1, v.shape[1]), lr)
+    subtract_rows(W_in, centers, grad_v, lr)
+    return loss
+
+def train_sgns(walks, num_codes, dim, window, n_negative, n_epochs, lr,
+    batch_size, seed):
+    '''
+    Trains skip-gram with negative sampling on the walks, with negatives drawn
+    from the code frequencies of the walks to the power 0.75. Returns the
+    center embeddings.
+    '''
+    rng = np.random.RandomState(seed)
+    W_in = ((rng.random_sample((num_codes, dim)) - 0.5) / dim).astype(
+        np.float32)
+    W_out = np.zeros((num_codes, dim), dtype=np.float32)
+    noise = np.bincount(walks.ravel(), minlength=num_codes) ** 0.75
+    noise_indptr = np.array([0, num_codes])
+    noise_prob, noise_alias = build_alias_tables(noise.astype(np.float64),
+        noise_indptr)
+    pairs_per_walk = len(get_pairs(walks[:1], window)[0])
+    total_steps = n_epochs * len(walks) * pairs_per_walk
+    step = 0
+    for epoch in range(n_epochs):
+        epoch_loss = 0.0
+        walk_order = rng.permutation(len(walks))
+        for block_start in range(0, len(walks), walk_block_size):
+            centers, contexts = get_pairs(walks[walk_order[block_start:
+                block_start + walk_block_size]], window)
+            pair_order = rng.permutation(len(centers))
+            for batch_start in range(0, len(centers), batch_size):
+                batch = pair_order[batch_start:batch_start + batch_size]
+                negatives = sample_alias(noise_prob, noise_alias, noise_indptr,
+                    np.zeros(len(batch) * n_negative, dtype=np.int64), rng
+                    ).reshape(len(batch), n_negative)
+                batch_lr = lr * max(min_lr_fraction, 1 - float(step) /
+                    total_steps)
+                epoch_loss += train_batch(W_in, W_out, centers[batch],
+                    contexts[batch], negatives, batch_lr)
+                step += len(batch)
+        print 'epoch %d, loss per pair %f' % (epoch, epoch_loss / (len(walks) *
+            pairs_per_walk))
+    return W_in
+
+def get_model_name(p, q, dim):
+    if p == 1 and q == 1:
+        return 'deepwalk_d%d' % dim
+    return 'node2vec_p%g_q%g_d%d' % (p, q, dim)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dim', type=int, default=128, help='(default value: '
+        '128)')
+    parser.add_argument('--num_walks', type=int, default=10, help='Walks from '
+        'each code (default value: 10)')
+    parser.add_argument('--walk_length', type=int, default=40, help='(default '
+        'value: 40)')
+    parser.add_argument('-p', type=float, default=1.0, help='The return '
+        'parameter of node2vec (default value: 1)')
+    parser.add_argument('-q', type=float, default=1.0, help='The in-out '
+        'parameter of node2vec (default value: 1)')
+    parser.add_argument('--window', type=int, default=5, help='(default value: '
+        '5)')
+    parser.add_argument('--n_negative', type=int, default=5, help='(default '
+        'value: 5)')
+    parser.add_argument('--n_epochs', type=int, default=1, help='(default '
+        'value: 1)')
+    parser.add_argument('--lr', type=float, default=0.025, help='(default '
+        'value: 0.025)')
+    parser.add_argument('--batch_size', type=int, default=1024, help='(default '
+        'value: 1024)')
+    parser.add_argument('-j', type=int, default=multiprocessing.cpu_count(),
+        help='The number of walk processes (default value: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='(default value: '
+        '0)')
+    args = parser.parse_args()
+    assert args.p > 0 and args.q > 0
+
+    with profiling.stage('parse'):
+        code_list = read_code_list()
+        visit_matrix = load_sparse_visit_matrix()
+    with profiling.stage('matrix_build'):
+        graph = get_graph(visit_matrix)
+    print '%d codes, %d edges' % (graph.shape[0], graph.nnz / 2)
+    with profiling.stage('walk'):
+        walks = get_walks(graph, args.num_walks, args.walk_length, args.p,
+            args.q, args.j, args.seed)
+    with profiling.stage('train'):
+        W_emb = train_sgns(walks, len(code_list), args.dim, args.window,
+            args.n_negative, args.n_epochs, args.lr, args.batch_size,
+            args.seed)
+
+    model_name = get_model_name(args.p, args.q, args.dim)
+    out_dir = '%s/%s' % (out_folder, model_name)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    with profiling.stage('write'):
+        np.savez_compressed('%s/embeddings.npz' % out_dir, W_emb=W_emb)
+    generate_folders()
+    write_most_similar_pairs({'W_emb':W_emb}, code_list, model_name)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
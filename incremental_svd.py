@@ -0,0 +1,276 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+import cPickle
+import hashlib
+from create_med2vec_input import parse_line, read_pruned_codes
+import numpy as np
+import os
+from scipy.linalg import eigh, qr
+from scipy.sparse import csr_matrix
+import time
+from visit_binary_matrix import read_code_list
+
+### This script keeps the top rank factors of the co-occurrence matrix of
+### cooccurrence_svd_baseline.py up to date as records are appended to
+### ./data/HIS_tuple_word.txt. The co-occurrence matrix is C = X^T X for the
+### visit x code matrix X, so its SVD is U S U^T, and the new visits add
+### B B^T, where B is X_new^T, or the eigendecomposition factor of
+### X_new^T X_new when there are more new visits than codes. The update
+### follows Brand (2006): with M = U^T B and the QR decomposition Q R of
+### B - U M,
+###     C + B B^T = [U Q] [[S + M M^T, M R^T], [R M^T, R R^T]] [U Q]^T,
+### so only the small middle matrix is decomposed, and the factors are
+### truncated back to rank. Each run reads the records after the byte offset
+### of the last run, so its cost is proportional to the new data. As in
+### create_med2vec_input.py, a patient's visits are only counted once the
+### patient has a second visit, so single-visit patients are kept pending.
+### The factors are re-orthogonalized every reorth_interval updates, since
+### rounding errors accumulate in U. The state is kept in
+### ./results/incremental_svd, and U sqrt(S) is written for each k as
+### co_svd_k<k>/embeddings.npz, with rows in the order of code_list.txt.
+### The first run, or a run with --rebuild, reads the whole file, and so does
+### a run after create_med2vec_input.py has pruned a different vocabulary.
+
+data_fname = './data/HIS_tuple_word.txt'
+mapping_fname = './results/code_mapping.txt'
+state_folder = './results/incremental_svd'
+# Pivoted QR columns below this fraction of the largest are dropped.
+qr_tolerance = 1e-10
+
+def get_mapping_hash():
+    '''
+    Returns the hash of the code mapping of create_med2vec_input.py, which
+    records the pruned codes.
+    '''
+    sha = hashlib.sha1()
+    if os.path.exists(mapping_fname):
+        f = open(mapping_fname, 'rb')
+        sha.update(f.read())
+        f.close()
+    return sha.hexdigest()
+
+def read_records(offset, pruned_set):
+    '''
+    Returns the patient key and codes of each complete record after the byte
+    offset, and the offset after the last complete line. Codes pruned by
+    create_med2vec_input.py are removed first.
+    '''
+    record_list = []
+    f = open(data_fname, 'r')
+    f.seek(offset)
+    while True:
+        line = f.readline()
+        # A line without a newline may still be being written.
+        if not line.endswith('\n'):
+            break
+        offset += len(line)
+        record = parse_line(line)
+        if record is None:
+            continue
+        key, visit_date, disease_list, symptom_list, herb_list = record
+        symptom_list = [code for code in set(symptom_list) if code not in
+            pruned_set]
+        herb_list = [code for code in set(herb_list) if code not in pruned_set]
+        if len(symptom_list) > 0 and len(herb_list) > 0:
+            record_list += [(key, symptom_list + herb_list)]
+    f.close()
+    return record_list, offset
+
+def get_new_visits(record_list, patient_state):
+    '''
+    Returns the visits that are counted now. patient_state maps each patient
+    to their pending visit, or to None once they have a second visit.
+    '''
+    visit_list = []
+    for key, codes in record_list:
+        if key not in patient_state:
+            patient_state[key] = codes
+        elif patient_state[key] is None:
+            visit_list += [codes]
+        else:
+            visit_list += [patient_state[key], codes]
+            patient_state[key] = None
+    return visit_list
+
+def get_visit_matrix(visit_list, code_list, code_dct):
+    '''
+    Returns the binary visit x code matrix. Unseen codes are appended to
+    code_list.
+    '''
+    rows, cols = [], []
+    for visit_i, codes in enumerate(visit_list):
+        for code in codes:
+            if code not in code_dct:
+                code_dct[code] = len(code_list)
+                code_list += [code]
+            rows += [visit_i]
+            cols += [code_dct[code]]
+    # Duplicate entries, for a code that is both a symptom and a herb, are
+    # summed, so clip them back to one.
+    visit_matrix = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(
+        visit_list), len(code_list)))
+    visit_matrix.data[:] = 1
+    return visit_matrix
+
+def get_increment_factor(visit_matrix):
+    '''
+    Returns B such that B B^T = X^T X, with at most min(visits, codes)
+    columns.
+    '''
+    num_visits, num_codes = visit_matrix.shape
+    if num_visits <= num_codes:
+        return visit_matrix.T.toarray()
+    w, V = eigh(visit_matrix.T.dot(visit_matrix).toarray())
+    keep = w > qr_tolerance * max(w.max(), 1)
+    return V[:, keep] * np.sqrt(w[keep])
+
+def update_factors(U, s, B, rank):
+    '''
+    The Brand update of U diag(s) U^T + B B^T, truncated to rank. Returns the
+    new U and s, and the sum of the truncated eigenvalues.
+    '''
+    M = U.T.dot(B)
+    P = B - U.dot(M)
+    Q, R, pivots = qr(P, mode='economic', pivoting=True)
+    # The columns of B that are in the span of U, or of earlier columns.
+    diagonal = np.abs(np.diag(R))
+    n_keep = int((diagonal > qr_tolerance * max(diagonal.max() if len(
+        diagonal) > 0 else 0, 1)).sum())
+    Q, R = Q[:, :n_keep], R[:n_keep, np.argsort(pivots)]
+    K = np.vstack([np.hstack([np.diag(s) + M.dot(M.T), M.dot(R.T)]),
+        np.hstack([R.dot(M.T), R.dot(R.T)])])
+    w, V = eigh(K)
+    order = np.argsort(-w)
+    truncated = np.maximum(w[order[rank:]], 0).sum()
+    order = order[:rank]
+    return np.hstack([U, Q]).dot(V[:, order]), w[order], truncated
+
+def reorthogonalize(U, s):
+    '''
+    Replaces U with an orthonormal basis of its columns, and rotates the
+    factors so that U diag(s) U^T is unchanged.
+    '''
+    Q, R = qr(U, mode='economic')
+    w, V = eigh((R * s).dot(R.T))
+    order = np.argsort(-w)
+    return Q.dot(V[:, order]), w[order]
+
+def get_orthogonality_error(U):
+    return np.abs(U.T.dot(U) - np.eye(U.shape[1])).max()
+
+def load_state():
+    '''
+    Returns the factors, the code list, and the patient state, or None if
+    there is no state.
+    '''
+    if not os.path.exists('%s/factors.npz' % state_folder):
+        return None
+    factors = dict(np.load('%s/factors.npz' % state_folder))
+    f = open('%s/patient_state.pickle' % state_folder, 'rb')
+    offset, patient_state = cPickle.load(f)
+    f.close()
+    # The factors are written last, so a run that stopped in between leaves
+    # them behind the patient state.
+    assert offset == factors['offset'], 'inconsistent state, run --rebuild'
+    code_list = []
+    f = open('%s/code_list.txt' % state_folder, 'r')
+    for line in f:
+        code_list += [line.rstrip('\n')]
+    f.close()
+    return factors, code_list, patient_state
+
+def write_state(factors, code_list, patient_state):
+    if not os.path.exists(state_folder):
+        os.makedirs(state_folder)
+    out = open('%s/code_list.txt' % state_folder, 'w')
+    out.write(''.join('%s\n' % code for code in code_list))
+    out.close()
+    out = open('%s/patient_state.pickle' % state_folder, 'wb')
+    cPickle.dump((int(factors['offset']), patient_state), out, protocol=2)
+    out.close()
+    # np.savez appends .npz to names without it.
+    np.savez('%s/factors.tmp.npz' % state_folder, **factors)
+    os.rename('%s/factors.tmp.npz' % state_folder, '%s/factors.npz' %
+        state_folder)
+
+def write_embeddings(U, s, code_list, k_list):
+    '''
+    Writes U sqrt(S) for each k, with the rows of the codes of code_list.txt.
+    Codes that have not been counted yet are rows of zeros.
+    '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    base_code_list = read_code_list()
+    rows = np.array([code_dct.get(code, -1) for code in base_code_list])
+    for k in k_list:
+        out_dir = '%s/co_svd_k%d' % (state_folder, k)
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        embeddings = U[:, :k] * np.sqrt(np.maximum(s[:k], 0))
+        W_emb = np.zeros((len(base_code_list), embeddings.shape[1]))
+        W_emb[rows >= 0] = embeddings[rows[rows >= 0]]
+        np.savez_compressed('%s/embeddings.npz' % out_dir, W_emb=W_emb)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rank', type=int, default=200, help='The number of '
+        'factors kept (default value: 200)')
+    parser.add_argument('-k', type=int, nargs='+', default=[50, 100, 150],
+        help='The embedding sizes written (default value: 50 100 150)')
+    parser.add_argument('--reorth_interval', type=int, default=10, help=
+        '(default value: 10)')
+    parser.add_argument('--rebuild', action='store_true', help='Discard the '
+        'state and read the whole file')
+    args = parser.parse_args()
+    assert max(args.k) <= args.rank
+
+    mapping_hash = get_mapping_hash()
+    state = None if args.rebuild else load_state()
+    # The factors of an older vocabulary still have its pruned codes.
+    if state is not None and str(state[0].get('mapping_hash', '')) != (
+        mapping_hash):
+        print 'the code mapping changed, rebuilding'
+        state = None
+    if state is None:
+        code_list = read_code_list()
+        factors = {'U':np.zeros((len(code_list), 0)), 's':np.zeros(0),
+            'offset':0, 'n_updates':0, 'n_visits':0, 'truncated':0.0,
+            'mapping_hash':mapping_hash}
+        patient_state = {}
+    else:
+        factors, code_list, patient_state = state
+    U, s = factors['U'], factors['s']
+
+    record_list, offset = read_records(int(factors['offset']),
+        read_pruned_codes())
+    visit_list = get_new_visits(record_list, patient_state)
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    visit_matrix = get_visit_matrix(visit_list, code_list, code_dct)
+    print '%d new records, %d visits counted' % (len(record_list), len(
+        visit_list))
+
+    if len(visit_list) > 0:
+        # New codes have no co-occurrences so far.
+        U = np.vstack([U, np.zeros((len(code_list) - len(U), U.shape[1]))])
+        U, s, truncated = update_factors(U, s, get_increment_factor(
+            visit_matrix), args.rank)
+        factors['n_updates'] += 1
+        factors['truncated'] += truncated
+        if factors['n_updates'] % args.reorth_interval == 0:
+            print 'orthogonality error before re-orthogonalizing: %g' % (
+                get_orthogonality_error(U))
+            U, s = reorthogonalize(U, s)
+    factors.update({'U':U, 's':s, 'offset':offset, 'n_visits':factors[
+        'n_visits'] + len(visit_list)})
+    print '%d visits, truncated eigenvalue sum %g' % (factors['n_visits'],
+        factors['truncated'])
+    write_state(factors, code_list, patient_state)
+    write_embeddings(U, s, code_list, args.k)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import numpy as np
+import os
+from result_store import insert_scores
+from scipy.sparse import csr_matrix, diags
+import sys
+import time
+from visit_binary_matrix import (load_patient_indptr, load_sparse_visit_matrix,
+    read_code_list)
+
+### This script extends compute_conditional_probabilities.py from the same
+### visit to later visits of the same patient. For each lag k from 1 to
+### max_lag, it finds
+###     P(herb at visit t + k | symptom at visit t)
+###     P(symptom gone at visit t + k | symptom at visit t, herb new at t)
+### where an herb is new if it was not prescribed at the previous visit. Every
+### table is a product of the sparse visit x symptom and visit x herb matrices
+### with a shift matrix that maps each visit to the visit k later of the same
+### patient, so each lag costs time linear in the number of nonzeros.
+### Must run visit_binary_matrix.py first.
+
+out_folder = './results/lagged_transitions'
+
+def read_code_file(code_type):
+    '''
+    Given a code type, read the file to get the list of unique codes within
+    that type.
+    '''
+    data = {}
+    f = open('./data/%s_count_dct.txt' % code_type, 'r')
+    for line in f:
+        line = line.split()
+        data[line[0]] = int(line[1])
+    f.close()
+    return data
+
+def get_shift_matrix(patient_indptr, lag):
+    '''
+    Returns the visit x visit matrix with a one at (t, t + lag) whenever both
+    visits belong to the same patient. Multiplying it with a visit matrix
+    moves each visit's row lag visits back.
+    '''
+    num_visits = patient_indptr[-1]
+    patient_ids = np.repeat(np.arange(len(patient_indptr) - 1), np.diff(
+        patient_indptr))
+    rows = np.arange(num_visits - lag)
+    rows = rows[patient_ids[rows] == patient_ids[rows + lag]]
+    return csr_matrix((np.ones(len(rows)), (rows, rows + lag)), shape=(
+        num_visits, num_visits))
+
+def split_visit_matrix(visit_matrix, code_list):
+    '''
+    Splits the visit x code matrix into visit x symptom and visit x herb
+    matrices. Returns them with the symptom and herb names.
+    '''
+    herb_count_dct = read_code_file('herb')
+    is_herb = np.array([code in herb_count_dct for code in code_list])
+    visit_matrix = visit_matrix.astype(np.float64).tocsc()
+    symptom_columns, herb_columns = np.where(~is_herb)[0], np.where(is_herb)[0]
+    return (visit_matrix[:, symptom_columns].tocsr(), visit_matrix[:,
+        herb_columns].tocsr(), [code_list[i] for i in symptom_columns],
+        [code_list[i] for i in herb_columns])
+
+def get_new_herb_matrix(herb_matrix, patient_indptr):
+    '''
+    Keeps the herbs of each visit that were not prescribed at the patient's
+    previous visit. Every herb of a first visit is new.
+    '''
+    previous_herbs = get_shift_matrix(patient_indptr, 1).T.dot(herb_matrix)
+    return (herb_matrix - herb_matrix.multiply(previous_herbs)).tocsr()
+
+def compute_lagged_tables(symptom_matrix, herb_matrix, patient_indptr,
+    max_lag):
+    '''
+    Returns a list with one (herb given symptom counts, symptom counts,
+    resolved counts, present counts) tuple per lag. The first two are
+    symptom x herb, the last two herb x symptom.
+    '''
+    new_herb_matrix = get_new_herb_matrix(herb_matrix, patient_indptr)
+    table_list = []
+    for lag in range(1, max_lag + 1):
+        shift = get_shift_matrix(patient_indptr, lag)
+        # has_later[t] is one if the patient has a visit t + lag.
+        has_later = np.asarray(shift.sum(axis=1)).ravel()
+        later_symptoms = shift.dot(symptom_matrix)
+        later_herbs = shift.dot(herb_matrix)
+
+        herb_given_symptom = symptom_matrix.T.dot(later_herbs)
+        symptom_counts = symptom_matrix.T.dot(has_later)
+
+        present = diags(has_later).dot(symptom_matrix)
+        resolved = present - symptom_matrix.multiply(later_symptoms)
+        resolved_counts = new_herb_matrix.T.dot(resolved)
+        present_counts = new_herb_matrix.T.dot(present)
+        table_list += [(herb_given_symptom.tocoo(), symptom_counts,
+            resolved_counts.tocsr(), present_counts.tocsr())]
+    return table_list
+
+def write_herb_given_symptom(count_matrix, symptom_counts, symptom_list,
+    herb_list, lag):
+    '''
+    Writes P(herb at t + lag | symptom at t), skipping symptoms with fewer
+    than 10 visits that have a visit lag visits later.
+    '''
+    row_list = []
+    for s, h, count in zip(count_matrix.row, count_matrix.col,
+        count_matrix.data):
+        if symptom_counts[s] < 10:
+            continue
+        row_list += [(count / symptom_counts[s], herb_list[h], symptom_list[s],
+            count)]
+    row_list.sort(reverse=True)
+    out = open('%s/herb_given_symptom_lag%d.txt' % (out_folder, lag), 'w')
+    for prob, herb, symptom, count in row_list:
+        out.write('%s\t%s\t%f\t%d\n' % (herb, symptom, prob, count))
+    out.close()
+    insert_scores('herb_given_symptom_lag%d' % lag, [(herb, symptom, prob) for
+        prob, herb, symptom, count in row_list])
+
+def write_symptom_resolution(resolved_counts, present_counts, symptom_list,
+    herb_list, lag):
+    '''
+    Writes the fraction of symptoms gone lag visits after a new herb, skipping
+    herb-symptom pairs seen fewer than 10 times.
+    '''
+    present_counts = present_counts.tocoo()
+    resolved_counts = resolved_counts.todok()
+    row_list = []
+    for h, s, present in zip(present_counts.row, present_counts.col,
+        present_counts.data):
+        if present < 10:
+            continue
+        row_list += [(resolved_counts[h, s] / present, herb_list[h],
+            symptom_list[s], present)]
+    row_list.sort(reverse=True)
+    out = open('%s/symptom_resolution_lag%d.txt' % (out_folder, lag), 'w')
+    for rate, herb, symptom, present in row_list:
+        out.write('%s\t%s\t%f\t%d\n' % (herb, symptom, rate, present))
+    out.close()
+    insert_scores('symptom_resolution_lag%d' % lag, [(herb, symptom, rate) for
+        rate, herb, symptom, present in row_list])
+
+def main():
+    if len(sys.argv) not in [1, 2]:
+        print 'Usage: python %s max_lag<optional>' % sys.argv[0]
+        exit()
+    max_lag = 3
+    if len(sys.argv) == 2:
+        max_lag = int(sys.argv[1])
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    patient_indptr = load_patient_indptr()
+    symptom_matrix, herb_matrix, symptom_list, herb_list = split_visit_matrix(
+        load_sparse_visit_matrix(), read_code_list())
+    table_list = compute_lagged_tables(symptom_matrix, herb_matrix,
+        patient_indptr, max_lag)
+    for lag, (herb_given_symptom, symptom_counts, resolved_counts,
+        present_counts) in enumerate(table_list, 1):
+        write_herb_given_symptom(herb_given_symptom, symptom_counts,
+            symptom_list, herb_list, lag)
+        write_symptom_resolution(resolved_counts, present_counts, symptom_list,
+            herb_list, lag)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -3,16 +3,23 @@
 # For bug report, please contact author using the email address
 #################################################################
 
-import sys, random
+import sys, random, os, time
 import numpy as np
 import cPickle as pickle
-from collections import OrderedDict
+from collections import OrderedDict, deque
 import argparse
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import hashlib
+import json
 
 import theano
 import theano.tensor as T
 from theano import config
 
+from med2vec_telemetry import TrainingTelemetry
+
 def numpy_floatX(data):
     return np.asarray(data, dtype=config.floatX)
 
@@ -128,16 +135,23 @@ def build_model(tparams, options):
     jVector = T.vector('jVector', dtype='int32')
     preVec = T.maximum(tparams['W_emb'],0)
     norms = (T.exp(T.dot(preVec, preVec.T))).sum(axis=1)
-    emb_cost = -T.log((T.exp((preVec[iVector] * preVec[jVector]).sum(axis=1)) / norms[iVector]) + logEps)
+    # The code-level objective is the only difference between the conditional
+    # (skip-gram) model and the PMI model.
+    if options['objective'] == 'pmi':
+        emb_cost = -T.log((T.exp((preVec[iVector] * preVec[jVector]).sum(axis=1)) / (norms[iVector] * norms[jVector])) + logEps)
+    else:
+        emb_cost = -T.log((T.exp((preVec[iVector] * preVec[jVector]).sum(axis=1)) / norms[iVector]) + logEps)
 
     total_cost = visit_cost + T.mean(emb_cost) + options['L2_reg'] * (tparams['W_emb'] ** 2).sum()
 
-    if options['demoSize'] > 0 and options['numYcodes'] > 0: return x, d, y, mask, iVector, jVector, total_cost
-    elif options['demoSize'] == 0 and options['numYcodes'] > 0: return x, y, mask, iVector, jVector, total_cost
-    elif options['demoSize'] > 0 and options['numYcodes'] == 0: return x, d, mask, iVector, jVector, total_cost
-    else: return x, mask, iVector, jVector, total_cost
+    # The order of the inputs matches the list built by prepareBatch.
+    inputs = [x]
+    if options['demoSize'] > 0: inputs.append(d)
+    if options['numYcodes'] > 0: inputs.append(y)
+    inputs += [mask, iVector, jVector]
+    return inputs, total_cost
 
-def adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, d=None, y=None):
+def adadelta(tparams, grads, inputs, cost):
     zipped_grads = [theano.shared(p.get_value() * numpy_floatX(0.), name='%s_grad' % k) for k, p in tparams.iteritems()]
     running_up2 = [theano.shared(p.get_value() * numpy_floatX(0.), name='%s_rup2' % k) for k, p in tparams.iteritems()]
     running_grads2 = [theano.shared(p.get_value() * numpy_floatX(0.), name='%s_rgrad2' % k) for k, p in tparams.iteritems()]
@@ -145,14 +159,7 @@ def adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, d=None, y
     zgup = [(zg, g) for zg, g in zip(zipped_grads, grads)]
     rg2up = [(rg2, 0.95 * rg2 + 0.05 * (g ** 2)) for rg2, g in zip(running_grads2, grads)]
 
-    if options['demoSize'] > 0 and options['numYcodes'] > 0:
-        f_grad_shared = theano.function([x, d, y, mask, iVector, jVector], cost, updates=zgup + rg2up, name='adadelta_f_grad_shared')
-    elif options['demoSize'] == 0 and options['numYcodes'] > 0:
-        f_grad_shared = theano.function([x, y, mask, iVector, jVector], cost, updates=zgup + rg2up, name='adadelta_f_grad_shared')
-    elif options['demoSize'] > 0 and options['numYcodes'] == 0:
-        f_grad_shared = theano.function([x, d, mask, iVector, jVector], cost, updates=zgup + rg2up, name='adadelta_f_grad_shared')
-    else:
-        f_grad_shared = theano.function([x, mask, iVector, jVector], cost, updates=zgup + rg2up, name='adadelta_f_grad_shared')
+    f_grad_shared = theano.function(inputs, cost, updates=zgup + rg2up, name='adadelta_f_grad_shared')
 
     updir = [-T.sqrt(ru2 + 1e-6) / T.sqrt(rg2 + 1e-6) * zg for zg, ru2, rg2 in zip(zipped_grads, running_up2, running_grads2)]
     ru2up = [(ru2, 0.95 * ru2 + 0.05 * (ud ** 2)) for ru2, ud in zip(running_up2, updir)]
@@ -160,7 +167,47 @@ def adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, d=None, y
 
     f_update = theano.function([], [], updates=ru2up + param_up, on_unused_input='ignore', name='adadelta_f_update')
 
-    return f_grad_shared, f_update
+    return f_grad_shared, f_update, zipped_grads + running_up2 + running_grads2
+
+def get_cache_key(options):
+    # Only the options that change the compiled graph go into the key.
+    keyOptions = dict((k, options[k]) for k in ['numXcodes', 'numYcodes', 'embDimSize', 'hiddenDimSize', 'demoSize', 'logEps', 'windowSize', 'L2_reg', 'objective'])
+    keyOptions['floatX'] = config.floatX
+    keyOptions['device'] = config.device
+    keyOptions['theano'] = theano.__version__
+    return hashlib.sha1(json.dumps(keyOptions, sort_keys=True)).hexdigest()
+
+def build_functions(params, options):
+    # Returns the shared parameters and the compiled training functions for
+    # one objective. Compiled functions are pickled into options['cacheDir']
+    # keyed by the graph options, so later runs with the same options skip
+    # compilation. The cached shared variables are reset to the fresh params.
+    cacheFile = ''
+    if len(options['cacheDir']) > 0:
+        cacheFile = os.path.join(options['cacheDir'], 'med2vec_%s.pkl' % get_cache_key(options))
+    if len(cacheFile) > 0 and os.path.exists(cacheFile):
+        print 'loading compiled %s model from %s' % (options['objective'], cacheFile)
+        tparams, accumulators, f_grad_shared, f_update = pickle.load(open(cacheFile, 'rb'))
+        for k, v in params.iteritems():
+            tparams[k].set_value(v)
+        for accumulator in accumulators:
+            accumulator.set_value(accumulator.get_value() * numpy_floatX(0.))
+        return tparams, f_grad_shared, f_update
+
+    print 'building %s model' % options['objective']
+    tparams = init_tparams(params)
+    inputs, cost = build_model(tparams, options)
+    grads = T.grad(cost, wrt=tparams.values())
+    f_grad_shared, f_update, accumulators = adadelta(tparams, grads, inputs, cost)
+
+    if len(cacheFile) > 0:
+        if not os.path.exists(options['cacheDir']): os.makedirs(options['cacheDir'])
+        # Write to a temporary file first so that concurrent runs never read a
+        # partially written cache entry.
+        tempFile = '%s.%d.tmp' % (cacheFile, os.getpid())
+        pickle.dump((tparams, accumulators, f_grad_shared, f_update), open(tempFile, 'wb'), -1)
+        os.rename(tempFile, cacheFile)
+    return tparams, f_grad_shared, f_update
 
 def load_data(xFile, dFile, yFile):
     seqX = np.array(pickle.load(open(xFile, 'rb')))
@@ -205,6 +252,64 @@ def padMatrix(seqs, labels, options):
                 mask[idx] = 1.
         return x, mask, iVector, jVector
 
+def prepareBatch(seqs, demos, labels, index, options):
+    # Returns the inputs of f_grad_shared for the index-th mini-batch.
+    batchSize = options['batchSize']
+    batchX = seqs[batchSize*index:batchSize*(index+1)]
+    batchY = []
+    if options['numYcodes'] > 0:
+        batchY = labels[batchSize*index:batchSize*(index+1)]
+        x, y, mask, iVector, jVector = padMatrix(batchX, batchY, options)
+    else:
+        x, mask, iVector, jVector = padMatrix(batchX, batchY, options)
+    inputs = [x]
+    if options['demoSize'] > 0: inputs.append(demos[batchSize*index:batchSize*(index+1)])
+    if options['numYcodes'] > 0: inputs.append(y)
+    inputs += [mask, iVector, jVector]
+    return inputs
+
+# The training data is stored at module level so that prefetch worker
+# processes inherit it when they are forked instead of receiving a copy with
+# every task.
+batchData = None
+
+def prepareBatchAt(index):
+    seqs, demos, labels, options = batchData
+    return prepareBatch(seqs, demos, labels, index, options)
+
+def iterate_batches(pool, order, prefetchDepth):
+    # Yields the prepared inputs of each batch index in order. With a pool,
+    # up to prefetchDepth batches are prepared ahead of the one being trained
+    # on; results are always consumed in submission order, so the batch
+    # sequence only depends on order and not on the number of workers.
+    if pool is None or prefetchDepth == 0:
+        for index in order: yield prepareBatchAt(index)
+        return
+    order = iter(order)
+    pending = deque(pool.apply_async(prepareBatchAt, (index,)) for index in itertools.islice(order, prefetchDepth))
+    while len(pending) > 0:
+        inputs = pending.popleft().get()
+        index = next(order, None)
+        if index is not None: pending.append(pool.apply_async(prepareBatchAt, (index,)))
+        yield inputs
+
+def get_prefetch_pool(prefetchDepth, prefetchWorkers, prefetchMode):
+    if prefetchDepth == 0: return None
+    if prefetchMode == 'process': return multiprocessing.Pool(prefetchWorkers)
+    return ThreadPool(prefetchWorkers)
+
+def get_out_files(outFile, objective):
+    # When training both objectives, the PMI model gets the pmi_ prefix used
+    # by run_med2vec.py.
+    if objective != 'both': return [(objective, outFile)]
+    outDir, outName = os.path.split(outFile)
+    return [('conditional', outFile), ('pmi', os.path.join(outDir, 'pmi_' + outName))]
+
+def get_log_prefix(models, objective):
+    # Tags each log line with its objective only when training both.
+    if len(models) == 1: return ''
+    return '%s ' % objective
+
 def train_med2vec(seqFile='seqFile.txt', 
                 demoFile='demoFile.txt',
                 labelFile='labelFile.txt',
@@ -219,70 +324,76 @@ def train_med2vec(seqFile='seqFile.txt',
                 demoSize=2,
                 logEps=1e-8,
                 windowSize=1,
+                objective='conditional',
+                cacheDir='',
+                telemetryFile='',
+                prefetchDepth=0,
+                prefetchWorkers=1,
+                prefetchMode='thread',
+                seed=None,
                 verbose=False,
                 maxEpochs=1000):
 
     options = locals().copy()
-    print 'initializing parameters'
-    params = init_params(options)
-    #params = load_params(options)
-    tparams = init_tparams(params)
-
-    print 'building models'
-    f_grad_shared = None
-    f_update = None
-    if demoSize > 0 and numYcodes > 0:
-        x, d, y, mask, iVector, jVector, cost = build_model(tparams, options)
-        grads = T.grad(cost, wrt=tparams.values())
-        f_grad_shared, f_update = adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, d=d, y=y)
-    elif demoSize == 0 and numYcodes > 0:
-        x, y, mask, iVector, jVector, cost = build_model(tparams, options)
-        grads = T.grad(cost, wrt=tparams.values())
-        f_grad_shared, f_update = adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, y=y)
-    elif demoSize > 0 and numYcodes == 0:
-        x, d, mask, iVector, jVector, cost = build_model(tparams, options)
-        grads = T.grad(cost, wrt=tparams.values())
-        f_grad_shared, f_update = adadelta(tparams, grads, x, mask, iVector, jVector, cost, options, d=d)
-    else:
-        x, mask, iVector, jVector, cost = build_model(tparams, options)
-        grads = T.grad(cost, wrt=tparams.values())
-        f_grad_shared, f_update = adadelta(tparams, grads, x, mask, iVector, jVector, cost, options)
+    # A seed makes both the parameter initialization and the batch order
+    # reproducible.
+    if seed is not None: np.random.seed(seed)
+    shuffler = random.Random(seed)
+    models = []
+    for modelObjective, modelOutFile in get_out_files(outFile, objective):
+        modelOptions = options.copy()
+        modelOptions['objective'] = modelObjective
+        print 'initializing %s parameters' % modelObjective
+        params = init_params(modelOptions)
+        #params = load_params(options)
+        tparams, f_grad_shared, f_update = build_functions(params, modelOptions)
+        models.append((modelObjective, modelOutFile, tparams, f_grad_shared, f_update))
 
     print 'loading data'
+    global batchData
     seqs, demos, labels = load_data(seqFile, demoFile, labelFile)
+    batchData = (seqs, demos, labels, options)
     n_batches = int(np.ceil(float(len(seqs)) / float(batchSize)))
+    pool = get_prefetch_pool(prefetchDepth, prefetchWorkers, prefetchMode)
+
+    telemetry = None
+    if len(telemetryFile) > 0: telemetry = TrainingTelemetry(telemetryFile)
 
     print 'training start'
     for epoch in xrange(maxEpochs):
         iteration = 0
-        costVector = []
-        for index in random.sample(range(n_batches), n_batches):
-            batchX = seqs[batchSize*index:batchSize*(index+1)]
-            batchY = []
-            batchD = []
-            if demoSize > 0 and numYcodes > 0:
-                batchY = labels[batchSize*index:batchSize*(index+1)]
-                x, y, mask, iVector, jVector = padMatrix(batchX, batchY, options)
-                batchD = demos[batchSize*index:batchSize*(index+1)]
-                cost = f_grad_shared(x, batchD, y, mask, iVector, jVector)
-            elif demoSize == 0 and numYcodes > 0:
-                batchY = labels[batchSize*index:batchSize*(index+1)]
-                x, y, mask, iVector, jVector = padMatrix(batchX, batchY, options)
-                cost = f_grad_shared(x, y, mask, iVector, jVector)
-            elif demoSize > 0 and numYcodes == 0:
-                x, mask, iVector, jVector = padMatrix(batchX, batchY, options)
-                batchD = demos[batchSize*index:batchSize*(index+1)]
-                cost = f_grad_shared(x, batchD, mask, iVector, jVector)
-            else:
-                x, mask, iVector, jVector = padMatrix(batchX, batchY, options)
-                cost = f_grad_shared(x, mask, iVector, jVector)
-            costVector.append(cost)
-            f_update()
-            if (iteration % 10 == 0) and verbose: print 'epoch:%d, iteration:%d/%d, cost:%f' % (epoch, iteration, n_batches, cost)
+        costVectors = [[] for model in models]
+        order = shuffler.sample(range(n_batches), n_batches)
+        batches = iterate_batches(pool, order, prefetchDepth)
+        for index in order:
+            # Every model trains on the same padded batch. With prefetching,
+            # the preparation time is only the time spent waiting for it.
+            prepStart = time.time()
+            inputs = next(batches)
+            prepTime, gradTime, updateTime = time.time() - prepStart, 0.0, 0.0
+            for modelIndex, (modelObjective, modelOutFile, tparams, f_grad_shared, f_update) in enumerate(models):
+                gradStart = time.time()
+                cost = f_grad_shared(*inputs)
+                updateStart = time.time()
+                f_update()
+                gradTime += updateStart - gradStart
+                updateTime += time.time() - updateStart
+                costVectors[modelIndex].append(cost)
+                if (iteration % 10 == 0) and verbose: print '%sepoch:%d, iteration:%d/%d, cost:%f' % (get_log_prefix(models, modelObjective), epoch, iteration, n_batches, cost)
+            if telemetry is not None:
+                # inputs ends with mask, iVector, jVector.
+                telemetry.record_batch(epoch, iteration, prepTime, gradTime, updateTime, int(inputs[-3].sum()), len(inputs[-2]), np.mean([costVector[-1] for costVector in costVectors]))
             iteration += 1
-        print 'epoch:%d, mean_cost:%f' % (epoch, np.mean(costVector))
-        tempParams = unzip(tparams)
-        np.savez_compressed(outFile + '.' + str(epoch), **tempParams)
+        for modelIndex, (modelObjective, modelOutFile, tparams, f_grad_shared, f_update) in enumerate(models):
+            print '%sepoch:%d, mean_cost:%f' % (get_log_prefix(models, modelObjective), epoch, np.mean(costVectors[modelIndex]))
+            checkpointStart = time.time()
+            tempParams = unzip(tparams)
+            np.savez_compressed(modelOutFile + '.' + str(epoch), **tempParams)
+            if telemetry is not None: telemetry.record_checkpoint(epoch, time.time() - checkpointStart)
+    if telemetry is not None: telemetry.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 def parse_arguments(parser):
     parser.add_argument('seq_file', type=str, metavar='<visit_file>', help='The path to the Pickled file containing visit information of patients')
@@ -298,13 +409,22 @@ def parse_arguments(parser):
     parser.add_argument('--n_epoch', type=int, default=10, help='The number of training epochs (default value: 10)')
     parser.add_argument('--L2_reg', type=float, default=0.001, help='L2 regularization for the code representation matrix W_c (default value: 0.001)')
     parser.add_argument('--window_size', type=int, default=1, choices=[1,2,3,4,5], help='The size of the visit context window (range: 1,2,3,4,5), (default value: 1)')
+    parser.add_argument('--objective', type=str, default='conditional', choices=['conditional', 'pmi', 'both'], help='The code-level objective. pmi normalizes by both codes instead of only the center code. both trains the two models in one process on the same batches, saving the PMI model with a pmi_ prefix (default value: conditional)')
+    parser.add_argument('--cache_dir', type=str, default='./results/med2vec_cache', help='The directory of the compiled function cache. Pass an empty string to always recompile (default value: ./results/med2vec_cache)')
+    parser.add_argument('--telemetry_file', type=str, default='', help='The path to a .jsonl or .csv file that receives the batch preparation, gradient, update, and checkpoint time of every iteration, with throughput and peak RSS. A summary table is printed at the end of the run. If you do not need timings, do not use this option')
+    parser.add_argument('--prefetch_depth', type=int, default=0, help='The number of mini-batches prepared ahead of the one being trained on. 0 prepares every batch synchronously (default value: 0)')
+    parser.add_argument('--prefetch_workers', type=int, default=1, help='The number of workers that prepare mini-batches when prefetching (default value: 1)')
+    parser.add_argument('--prefetch_mode', type=str, default='thread', choices=['thread', 'process'], help='Whether prefetch workers are threads or forked processes (default value: thread)')
+    parser.add_argument('--seed', type=int, default=None, help='The random seed of the parameter initialization and the mini-batch order. The order does not depend on the prefetch options (default value: unseeded)')
     parser.add_argument('--log_eps', type=float, default=1e-8, help='A small value to prevent log(0) (default value: 1e-8)')
     parser.add_argument('--verbose', action='store_true', help='Print output after every 10 mini-batches')
     args = parser.parse_args()
     return args
 
 if __name__ == '__main__':
+    # Pickling compiled Theano functions recurses through the whole graph.
+    sys.setrecursionlimit(100000)
     parser = argparse.ArgumentParser()
     args = parse_arguments(parser)
 
-    train_med2vec(seqFile=args.seq_file, demoFile=args.demo_file, labelFile=args.label_file, outFile=args.out_file, numXcodes=args.n_input_codes, numYcodes=args.n_output_codes, embDimSize=args.cr_size, hiddenDimSize=args.vr_size, batchSize=args.batch_size, maxEpochs=args.n_epoch, L2_reg=args.L2_reg, demoSize=args.demo_size, windowSize=args.window_size, logEps=args.log_eps, verbose=args.verbose)
\ No newline at end of file
+    train_med2vec(seqFile=args.seq_file, demoFile=args.demo_file, labelFile=args.label_file, outFile=args.out_file, numXcodes=args.n_input_codes, numYcodes=args.n_output_codes, embDimSize=args.cr_size, hiddenDimSize=args.vr_size, batchSize=args.batch_size, maxEpochs=args.n_epoch, L2_reg=args.L2_reg, demoSize=args.demo_size, windowSize=args.window_size, logEps=args.log_eps, objective=args.objective, cacheDir=args.cache_dir, telemetryFile=args.telemetry_file, prefetchDepth=args.prefetch_depth, prefetchWorkers=args.prefetch_workers, prefetchMode=args.prefetch_mode, seed=args.seed, verbose=args.verbose)
\ No newline at end of file
@@ -0,0 +1,91 @@
+### Author: Edward Huang
+
+import csv
+import json
+import resource
+
+### Records per-iteration timings of med2vec training. Each mini-batch is
+### split into batch preparation (padMatrix), gradient (f_grad_shared), and
+### update (f_update) time, and each epoch adds a checkpoint row for
+### np.savez_compressed. Rows are streamed to a JSONL or CSV file, depending
+### on the extension of the output file, and a summary table is printed at
+### the end of the run.
+
+phase_list = ['prep', 'grad', 'update', 'checkpoint']
+field_list = ['kind', 'epoch', 'iteration', 'prep_seconds', 'grad_seconds',
+    'update_seconds', 'checkpoint_seconds', 'visits', 'pairs',
+    'visits_per_second', 'pairs_per_second', 'peak_rss_mb', 'cost']
+
+def get_peak_rss_mb():
+    '''
+    Returns the peak resident set size of this process in megabytes. Linux
+    reports ru_maxrss in kilobytes.
+    '''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class TrainingTelemetry(object):
+    '''
+    Streams one row per mini-batch and one row per checkpoint to out_fname,
+    and keeps the running totals for the summary table.
+    '''
+    def __init__(self, out_fname):
+        self.out = open(out_fname, 'w')
+        self.is_csv = out_fname.endswith('.csv')
+        if self.is_csv:
+            self.writer = csv.DictWriter(self.out, fieldnames=field_list)
+            self.writer.writeheader()
+        self.totals = dict((phase, 0.0) for phase in phase_list)
+        self.counts = dict((phase, 0) for phase in phase_list)
+        self.visits, self.pairs = 0, 0
+
+    def write_row(self, row):
+        row['peak_rss_mb'] = get_peak_rss_mb()
+        for field in field_list:
+            row.setdefault(field, 0)
+        if self.is_csv:
+            self.writer.writerow(row)
+        else:
+            self.out.write(json.dumps(row, sort_keys=True) + '\n')
+        self.out.flush()
+
+    def record_batch(self, epoch, iteration, prep, grad, update, visits, pairs,
+        cost):
+        '''
+        Records a single mini-batch. grad and update are summed over every
+        model trained on the batch.
+        '''
+        for phase, seconds in [('prep', prep), ('grad', grad),
+            ('update', update)]:
+            self.totals[phase] += seconds
+            self.counts[phase] += 1
+        self.visits += visits
+        self.pairs += pairs
+        seconds = prep + grad + update
+        self.write_row({'kind':'batch', 'epoch':epoch, 'iteration':iteration,
+            'prep_seconds':prep, 'grad_seconds':grad, 'update_seconds':update,
+            'visits':visits, 'pairs':pairs, 'visits_per_second':visits /
+            max(seconds, 1e-12), 'pairs_per_second':pairs / max(seconds,
+            1e-12), 'cost':float(cost)})
+
+    def record_checkpoint(self, epoch, seconds):
+        self.totals['checkpoint'] += seconds
+        self.counts['checkpoint'] += 1
+        self.write_row({'kind':'checkpoint', 'epoch':epoch, 'iteration':-1,
+            'checkpoint_seconds':seconds})
+
+    def close(self):
+        '''
+        Closes the output file and prints the end-of-run summary table.
+        '''
+        self.out.close()
+        total_seconds = sum(self.totals.values())
+        print '%-12s%12s%12s%12s%8s' % ('phase', 'total_s', 'calls',
+            'mean_ms', 'share')
+        for phase in phase_list:
+            mean_ms = 1000 * self.totals[phase] / max(self.counts[phase], 1)
+            share = 100 * self.totals[phase] / max(total_seconds, 1e-12)
+            print '%-12s%12.3f%12d%12.3f%7.1f%%' % (phase,
+                self.totals[phase], self.counts[phase], mean_ms, share)
+        print 'visits/sec: %f, pairs/sec: %f, peak RSS: %f MB' % (
+            self.visits / max(total_seconds, 1e-12), self.pairs / max(
+            total_seconds, 1e-12), get_peak_rss_mb())
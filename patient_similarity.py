@@ -0,0 +1,381 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+import json
+import numpy as np
+import os
+from recommend_herbs import normalize_rows
+from scipy.sparse import csr_matrix, diags
+from scipy.sparse.linalg import svds
+import time
+from visit_binary_matrix import (load_patient_indptr, load_sparse_visit_matrix,
+    read_code_list)
+from visit_representations import (load_patient_vectors, pool_visits,
+    read_patient_list, read_pooling, represent_visits)
+
+### This script finds the most similar past patients of new patients. Every
+### patient is a unit vector, and similarity is the cosine, either of
+###     med2vec: the pooled visit vectors of visit_representations.py, or
+###     tfidf: the TF-IDF vector of the patient's codes, where a code's term
+###         frequency is the fraction of the patient's visits that have it,
+###         projected onto the top dim singular vectors.
+### Two indexes are supported:
+###     exact: the queries are compared with blocks of block_size patients,
+###         keeping the running top k.
+###     ivfpq: the patients are clustered with k-means into n_lists lists. A
+###         patient is stored as its list and the product quantization of its
+###         residual, one byte for each of n_subspaces subspaces. A query
+###         scans the n_probe closest lists with per-subspace lookup tables
+###         and reranks the n_rerank best with the exact vectors.
+### New patients are read one per line, with visits separated by | and the
+### codes of a visit separated by colons.
+
+index_folder = './results/patient_similarity'
+# Patients compared with the queries at a time in exact search.
+block_size = 65536
+# Patients sampled to train the k-means of the ivfpq index.
+n_train = 65536
+
+def get_tfidf_matrix(visit_matrix, patient_indptr):
+    '''
+    Returns the patient x code TF-IDF matrix, and the IDF of each code.
+    '''
+    frequencies = get_frequencies(visit_matrix, patient_indptr)
+    document_counts = np.bincount(frequencies.indices, minlength=
+        frequencies.shape[1])
+    idf = np.log((1.0 + frequencies.shape[0]) / (1.0 + document_counts)) + 1
+    return frequencies.dot(diags(idf)).tocsr(), idf
+
+def get_frequencies(visit_matrix, patient_indptr):
+    '''
+    Returns the patient x code matrix of the fraction of each patient's visits
+    with each code.
+    '''
+    num_visits = patient_indptr[-1]
+    pooling = csr_matrix((np.ones(num_visits), (np.repeat(np.arange(len(
+        patient_indptr) - 1), np.diff(patient_indptr)), np.arange(num_visits))),
+        shape=(len(patient_indptr) - 1, num_visits))
+    counts = pooling.dot(visit_matrix.astype(np.float64))
+    return diags(1.0 / np.diff(patient_indptr)).dot(counts).tocsr()
+
+def get_projection(tfidf_matrix, dim):
+    '''
+    Returns the code x dim matrix of the top right singular vectors.
+    '''
+    dim = min(dim, min(tfidf_matrix.shape) - 1)
+    U, s, Vh = svds(tfidf_matrix, k=dim)
+    return Vh[np.argsort(-s)].T
+
+def kmeans(vectors, n_clusters, n_iter, rng):
+    '''
+    Lloyd's algorithm on the inner product of unit vectors. Returns the
+    centroids.
+    '''
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for iteration in range(n_iter):
+        assignments = assign_clusters(vectors, centroids)
+        sums = np.zeros(centroids.shape)
+        np.add.at(sums, assignments, vectors)
+        sizes = np.bincount(assignments, minlength=n_clusters)
+        # Empty clusters keep their centroid.
+        filled = sizes > 0
+        centroids[filled] = sums[filled] / sizes[filled, None]
+    return centroids
+
+def assign_clusters(vectors, centroids):
+    '''
+    Returns the nearest centroid of each vector by squared distance, in
+    blocks.
+    '''
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), block_size):
+        block = vectors[start:start + block_size]
+        assignments[start:start + block_size] = np.argmin(centroid_norms -
+            2 * block.dot(centroids.T), axis=1)
+    return assignments
+
+def merge_top(top_ids, top_scores, ids, scores, k):
+    '''
+    Merges candidate ids and scores into the running query x k top lists.
+    '''
+    ids = np.hstack([top_ids, ids])
+    scores = np.hstack([top_scores, scores])
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    rows = np.arange(len(best))[:, None]
+    return ids[rows, best], scores[rows, best]
+
+def sort_top(top_ids, top_scores):
+    rows = np.arange(len(top_ids))[:, None]
+    order = np.argsort(-top_scores, axis=1, kind='mergesort')
+    return top_ids[rows, order], top_scores[rows, order]
+
+class ExactIndex(object):
+    '''
+    Brute force cosine search over memory-mapped unit vectors.
+    '''
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def search(self, queries, k):
+        top_ids = np.zeros((len(queries), 0), dtype=np.int64)
+        top_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), block_size):
+            scores = queries.dot(np.asarray(self.vectors[start:start +
+                block_size]).T)
+            ids = np.tile(np.arange(start, start + scores.shape[1]), (len(
+                queries), 1))
+            top_ids, top_scores = merge_top(top_ids, top_scores, ids, scores,
+                k)
+        return sort_top(top_ids, top_scores)
+
+class IVFPQIndex(object):
+    '''
+    Inverted file index with product-quantized residuals, searched by inner
+    product.
+    '''
+    def __init__(self, vectors, arrays):
+        self.vectors = vectors
+        self.centroids = arrays['centroids']
+        self.codebooks = arrays['codebooks']
+        self.codes = arrays['codes']
+        self.ids = arrays['ids']
+        self.list_indptr = arrays['list_indptr']
+
+    @staticmethod
+    def train(vectors, n_lists, n_subspaces, n_iter, seed):
+        '''
+        Returns the arrays of an index over all of vectors.
+        '''
+        rng = np.random.RandomState(seed)
+        dim = vectors.shape[1]
+        assert dim % n_subspaces == 0, 'dim must divide by n_subspaces'
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(
+            n_train, len(vectors)), replace=False))], dtype=np.float64)
+        centroids = kmeans(sample, n_lists, n_iter, rng)
+        residuals = sample - centroids[assign_clusters(sample, centroids)]
+        sub_dim = dim // n_subspaces
+        codebooks = np.array([kmeans(residuals[:, m * sub_dim:(m + 1) *
+            sub_dim].copy(), 256, n_iter, rng) for m in range(n_subspaces)])
+
+        assignments = np.zeros(len(vectors), dtype=np.int64)
+        codes = np.zeros((len(vectors), n_subspaces), dtype=np.uint8)
+        for start in range(0, len(vectors), block_size):
+            block = np.asarray(vectors[start:start + block_size],
+                dtype=np.float64)
+            block_assignments = assign_clusters(block, centroids)
+            block_residuals = block - centroids[block_assignments]
+            assignments[start:start + len(block)] = block_assignments
+            for m in range(n_subspaces):
+                codes[start:start + len(block), m] = assign_clusters(
+                    block_residuals[:, m * sub_dim:(m + 1) * sub_dim],
+                    codebooks[m])
+        # Sort the patients by list, so each list is a contiguous range.
+        ids = np.argsort(assignments, kind='mergesort')
+        list_indptr = np.concatenate([[0], np.cumsum(np.bincount(assignments,
+            minlength=len(centroids)))])
+        return {'centroids':centroids.astype(np.float32), 'codebooks':
+            codebooks.astype(np.float32), 'codes':codes[ids], 'ids':ids,
+            'list_indptr':list_indptr}
+
+    def search(self, queries, k, n_probe, n_rerank):
+        n_subspaces, n_codewords, sub_dim = self.codebooks.shape
+        top_ids = np.zeros((len(queries), k), dtype=np.int64)
+        top_scores = np.zeros((len(queries), k), dtype=np.float32) - np.inf
+        list_scores = queries.dot(self.centroids.T)
+        n_probe = min(n_probe, len(self.centroids))
+        for query_i, query in enumerate(queries):
+            # Inner products of each query subvector with each codeword.
+            tables = np.einsum('md,mcd->mc', query.reshape(n_subspaces,
+                sub_dim), self.codebooks)
+            probe_lists = np.argpartition(-list_scores[query_i], n_probe - 1
+                )[:n_probe]
+            candidate_list = [np.arange(self.list_indptr[list_i],
+                self.list_indptr[list_i + 1]) for list_i in probe_lists]
+            positions = np.concatenate(candidate_list)
+            if len(positions) == 0:
+                continue
+            list_ids = np.repeat(probe_lists, [len(candidates) for candidates
+                in candidate_list])
+            scores = list_scores[query_i, list_ids] + tables[np.arange(
+                n_subspaces), self.codes[positions]].sum(axis=1)
+            n_keep = min(max(n_rerank, k), len(scores))
+            best = np.argpartition(-scores, n_keep - 1)[:n_keep]
+            candidate_ids = np.sort(self.ids[positions[best]])
+            exact_scores = np.asarray(self.vectors[candidate_ids]).dot(query)
+            n_top = min(k, len(candidate_ids))
+            top = np.argsort(-exact_scores, kind='mergesort')[:n_top]
+            top_ids[query_i, :n_top] = candidate_ids[top]
+            top_scores[query_i, :n_top] = exact_scores[top]
+        return top_ids, top_scores
+
+def parse_patients(fname, code_list):
+    '''
+    Reads the new patients. Returns their visit x code matrix and their
+    patient_indptr.
+    '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    rows, cols, patient_indptr = [], [], [0]
+    f = open(fname, 'r')
+    for line in f:
+        visit_list = line.strip().split('|')
+        for visit_i, visit in enumerate(visit_list):
+            for code in set(visit.split(':')):
+                if code in code_dct:
+                    rows += [patient_indptr[-1] + visit_i]
+                    cols += [code_dct[code]]
+        patient_indptr += [patient_indptr[-1] + len(visit_list)]
+    f.close()
+    return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(
+        patient_indptr[-1], len(code_list))), np.array(patient_indptr)
+
+def get_query_vectors(meta, index_dir, visit_matrix, patient_indptr):
+    '''
+    Returns the unit vectors of new patients, made the same way as the
+    indexed patients.
+    '''
+    if meta['source'] == 'tfidf':
+        projection = np.load('%s/projection.npz' % index_dir)
+        vectors = get_frequencies(visit_matrix, patient_indptr).dot(diags(
+            projection['idf'])).dot(projection['components'])
+    else:
+        model = np.load(meta['model_fname'])
+        model = dict((name, model[name]) for name in ['W_emb', 'b_emb',
+            'W_hidden', 'b_hidden'])
+        vectors = pool_visits(represent_visits(visit_matrix, model),
+            patient_indptr, meta['pooling'])
+    return normalize_rows(np.asarray(vectors, dtype=np.float64)).astype(
+        np.float32)
+
+def build_index(args):
+    '''
+    Writes the unit patient vectors, the metadata, and the ivfpq arrays.
+    '''
+    if args.source == 'tfidf':
+        name = 'tfidf'
+    else:
+        name = os.path.basename(args.source)[:-len('.npz')]
+    index_dir = '%s/%s' % (index_folder, name)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    meta = {'source':'tfidf', 'index':args.index}
+
+    if args.source == 'tfidf':
+        tfidf_matrix, idf = get_tfidf_matrix(load_sparse_visit_matrix(),
+            load_patient_indptr())
+        components = get_projection(tfidf_matrix, args.dim)
+        np.savez('%s/projection.npz' % index_dir, idf=idf, components=
+            components)
+        vectors = tfidf_matrix.dot(components)
+        patient_list = read_patient_list()
+    else:
+        # The patient vectors of visit_representations.py, which must have
+        # been pooled like the queries will be.
+        representation_dir = './results/representations/%s' % name
+        pooling = read_pooling(representation_dir)
+        assert pooling == args.pooling, ('%s has %s pooling, not %s; rerun '
+            'visit_representations.py with --pooling %s' % (
+            representation_dir, pooling, args.pooling, args.pooling))
+        meta.update({'source':'med2vec', 'model_fname':args.source,
+            'pooling':args.pooling})
+        vectors, patient_list = load_patient_vectors(representation_dir)
+    unit_vectors = np.lib.format.open_memmap('%s/vectors.npy' % index_dir,
+        mode='w+', dtype=np.float32, shape=vectors.shape)
+    for start in range(0, len(vectors), block_size):
+        unit_vectors[start:start + block_size] = normalize_rows(np.asarray(
+            vectors[start:start + block_size], dtype=np.float64))
+    unit_vectors.flush()
+    out = open('%s/patient_list.txt' % index_dir, 'w')
+    for patient_name, dob in patient_list:
+        out.write('%s\t%s\n' % (patient_name, dob))
+    out.close()
+
+    if args.index == 'ivfpq':
+        arrays = IVFPQIndex.train(unit_vectors, args.n_lists,
+            args.n_subspaces, args.n_iter, args.seed)
+        np.savez('%s/ivfpq.npz' % index_dir, **arrays)
+    out = open('%s/meta.json' % index_dir, 'w')
+    json.dump(meta, out)
+    out.close()
+
+def query_index(args):
+    '''
+    Writes the k most similar patients of each new patient.
+    '''
+    index_dir = '%s/%s' % (index_folder, args.index_name)
+    meta = json.load(open('%s/meta.json' % index_dir, 'r'))
+    vectors = np.load('%s/vectors.npy' % index_dir, mmap_mode='r')
+    patient_list = read_patient_list('%s/patient_list.txt' % index_dir)
+    visit_matrix, patient_indptr = parse_patients(args.patient_fname,
+        read_code_list())
+    queries = get_query_vectors(meta, index_dir, visit_matrix, patient_indptr)
+
+    start_time = time.time()
+    if meta['index'] == 'ivfpq':
+        index = IVFPQIndex(vectors, np.load('%s/ivfpq.npz' % index_dir))
+        top_ids, top_scores = index.search(queries, args.k, args.n_probe,
+            args.n_rerank)
+    else:
+        top_ids, top_scores = ExactIndex(vectors).search(queries, args.k)
+    print '%f ms per query' % (1000 * (time.time() - start_time) / max(len(
+        queries), 1))
+
+    out = open(args.out_fname, 'w')
+    for query_i in range(len(queries)):
+        out.write('%d\t%s\n' % (query_i, ','.join('%s:%s:%f' % (
+            patient_list[patient][0], patient_list[patient][1], score) for
+            patient, score in zip(top_ids[query_i], top_scores[query_i]) if
+            score > -np.inf)))
+    out.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='Index the patients')
+    build_parser.add_argument('source', help='tfidf, or a med2vec model '
+        'archive whose visit_representations.py outputs exist')
+    build_parser.add_argument('--index', choices=['exact', 'ivfpq'],
+        default='exact', help='(default value: exact)')
+    build_parser.add_argument('--pooling', choices=['mean', 'max'],
+        default='mean', help='The pooling of the med2vec patient vectors '
+        '(default value: mean)')
+    build_parser.add_argument('--dim', type=int, default=64, help='The TF-IDF '
+        'projection size (default value: 64)')
+    build_parser.add_argument('--n_lists', type=int, default=1024, help='(default '
+        'value: 1024)')
+    build_parser.add_argument('--n_subspaces', type=int, default=8, help=
+        '(default value: 8)')
+    build_parser.add_argument('--n_iter', type=int, default=20, help='k-means '
+        'iterations (default value: 20)')
+    build_parser.add_argument('--seed', type=int, default=0, help='(default '
+        'value: 0)')
+    query_parser = subparsers.add_parser('query', help='Find the most similar '
+        'patients')
+    query_parser.add_argument('index_name', help='tfidf or the model archive '
+        'name, e.g. baseline_model.499')
+    query_parser.add_argument('patient_fname', help='One patient per line, '
+        'visits separated by | and codes by colons')
+    query_parser.add_argument('-k', type=int, default=10, help='(default '
+        'value: 10)')
+    query_parser.add_argument('--n_probe', type=int, default=16, help=
+        '(default value: 16)')
+    query_parser.add_argument('--n_rerank', type=int, default=200, help=
+        '(default value: 200)')
+    query_parser.add_argument('--out_fname', default=
+        './results/similar_patients.txt', help='(default value: '
+        './results/similar_patients.txt)')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build_index(args)
+    else:
+        query_index(args)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+from bitset_exclusivity import (build_code_bitsets, get_candidate_codes,
+    popcount, read_code_list, score_sets, write_score_table)
+import hashlib
+import json
+import multiprocessing
+import numpy as np
+import os
+from result_store import insert_sets
+from scipy.sparse import csr_matrix
+import sys
+import time
+from visit_binary_matrix import load_sparse_visit_matrix
+
+### This script replaces WExT's compute_mutation_probabilities.py with a
+### reusable permutation null. Each permutation of the visit x code matrix
+### keeps the number of codes in every visit and the number of visits of every
+### code, and is made with vectorized edge swaps in a process pool. Swaps only
+### move codes between edges, so a permutation is stored as the code of every
+### edge, with the visits of the original matrix. Files of perms_per_file
+### permutations are cached in ./results/permutation_null/ keyed by the hash
+### of the input and the seed, so set sizes 2 and 3, both scores, and runs
+### with more permutations reuse them. The cache takes n_permutations x
+### num_edges x 2 bytes (4 for more than 32767 codes), about a sixteenth of
+### storing the code bitsets when visits have one code in a hundred. The
+### empirical p-value of a set is the fraction of permutations where its
+### statistic is at least the observed one.
+### Must run visit_binary_matrix.py first.
+
+null_dir = './results/permutation_null'
+# Swaps per edge. Each permutation makes swap_multiplier * num_edges swaps.
+swap_multiplier = 10
+# Proposed swaps per swap before giving up, for graphs with few valid swaps.
+max_attempt_multiplier = 100
+# Permutations per cache file, and per process pool task.
+perms_per_file = 16
+# The visit matrix and sets are stored at module level so forked workers
+# inherit them.
+null_data = None
+
+def get_input_hash(visit_matrix, seed):
+    '''
+    Hashes the visit matrix and the permutation parameters.
+    '''
+    sha = hashlib.sha1()
+    for array in [visit_matrix.indices, visit_matrix.indptr, np.array(
+        visit_matrix.shape), np.array([seed, swap_multiplier,
+        max_attempt_multiplier])]:
+        sha.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    return sha.hexdigest()
+
+def edge_exists(sorted_keys, keys):
+    '''
+    Returns whether each key is in the sorted array of edge keys.
+    '''
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(
+        sorted_keys) - 1)
+    return sorted_keys[positions] == keys
+
+def swap_edges(visits, codes, num_codes, n_swaps, rng):
+    '''
+    Swaps the codes of random pairs of edges, (v1, c1), (v2, c2) ->
+    (v1, c2), (v2, c1), until n_swaps swaps are accepted. Every round proposes
+    num_edges / 2 disjoint swaps at once, and rejects the ones that would
+    create an edge that exists or that another swap in the round creates.
+    Gives up after max_attempt_multiplier * n_swaps proposals, since a nearly
+    complete graph may have no valid swaps. Modifies codes in place, and
+    returns the number of accepted swaps.
+    '''
+    n_edges, accepted, attempts = len(codes), 0, 0
+    max_attempts = max_attempt_multiplier * n_swaps
+    while accepted < n_swaps and attempts < max_attempts:
+        attempts += max(1, n_edges // 2)
+        order = rng.permutation(n_edges)
+        first, second = order[:n_edges // 2], order[n_edges // 2:2 * (
+            n_edges // 2)]
+        sorted_keys = np.sort(visits * num_codes + codes)
+        new_first = visits[first] * num_codes + codes[second]
+        new_second = visits[second] * num_codes + codes[first]
+        valid = (visits[first] != visits[second]) & (codes[first] != codes[
+            second])
+        valid &= ~edge_exists(sorted_keys, new_first)
+        valid &= ~edge_exists(sorted_keys, new_second)
+
+        new_keys = np.concatenate([new_first[valid], new_second[valid]])
+        unique_keys, key_counts = np.unique(new_keys, return_counts=True)
+        duplicate = key_counts[np.searchsorted(unique_keys, new_keys)] > 1
+        n_valid = valid.sum()
+        valid[valid] = ~(duplicate[:n_valid] | duplicate[n_valid:])
+
+        # Stop at exactly n_swaps accepted swaps.
+        valid[valid] = np.cumsum(np.ones(valid.sum(), dtype=np.int64)) <= (
+            n_swaps - accepted)
+        first, second = first[valid], second[valid]
+        codes[first], codes[second] = codes[second], codes[first].copy()
+        accepted += len(first)
+    return accepted
+
+def get_edges(visit_matrix):
+    '''
+    Returns the visit and the code of every edge, in the order of the cache.
+    '''
+    coo = visit_matrix.tocoo()
+    return coo.row.astype(np.int64), coo.col.astype(np.int64)
+
+def get_permuted_codes(visit_matrix, seed):
+    '''
+    Returns the codes of the edges of get_edges after a degree-preserving
+    permutation.
+    '''
+    visits, codes = get_edges(visit_matrix)
+    n_swaps = swap_multiplier * len(codes)
+    accepted = swap_edges(visits, codes, visit_matrix.shape[1], n_swaps,
+        np.random.RandomState(seed))
+    if accepted < n_swaps:
+        print 'permutation with seed %d: only %d of %d swaps accepted' % (seed,
+            accepted, n_swaps)
+    return codes
+
+def write_permutation_file(arguments):
+    '''
+    Writes the permuted codes of the permutations of one cache file.
+    '''
+    fname, first_perm = arguments
+    visit_matrix, seed = null_data[:2]
+    dtype = np.int16 if visit_matrix.shape[1] < 2 ** 15 else np.int32
+    codes = np.zeros((perms_per_file, visit_matrix.nnz), dtype=dtype)
+    for i in range(perms_per_file):
+        codes[i] = get_permuted_codes(visit_matrix, seed + first_perm + i)
+    # Renamed when complete, so a file that exists is whole.
+    tmp_fname = '%s.%d.tmp.npy' % (fname[:-len('.npy')], os.getpid())
+    np.save(tmp_fname, codes)
+    os.rename(tmp_fname, fname)
+
+def get_permutation_files(visit_matrix, n_permutations, seed, n_processes):
+    '''
+    Returns the cache files of the first n_permutations permutations, and
+    generates the ones that do not exist yet.
+    '''
+    global null_data
+    cache_dir = '%s/%s' % (null_dir, get_input_hash(visit_matrix, seed))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    fname_list = ['%s/permutations_%d.npy' % (cache_dir, i) for i in range((
+        n_permutations + perms_per_file - 1) // perms_per_file)]
+    argument_list = [(fname, i * perms_per_file) for i, fname in enumerate(
+        fname_list) if not os.path.exists(fname)]
+    print 'reusing %d of %d permutation files in %s' % (len(fname_list) -
+        len(argument_list), len(fname_list), cache_dir)
+    null_data = (visit_matrix, seed)
+    if n_processes == 1:
+        map(write_permutation_file, argument_list)
+    elif len(argument_list) > 0:
+        pool = multiprocessing.Pool(n_processes)
+        pool.map(write_permutation_file, argument_list)
+        pool.close()
+        pool.join()
+
+    out = open('%s/meta.json' % cache_dir, 'w')
+    json.dump({'seed':seed, 'swap_multiplier':swap_multiplier,
+        'perms_per_file':perms_per_file, 'n_files':len([fname for fname in
+        os.listdir(cache_dir) if fname.startswith('permutations_') and
+        not fname.endswith('.tmp.npy')]), 'shape':list(visit_matrix.shape)},
+        out)
+    out.close()
+    return fname_list
+
+def get_set_statistics(bitsets, set_table, score):
+    '''
+    Computes the co-occurrence or exclusive count of each set of codes. The
+    first columns of set_table are code indices, with -1 for unused columns.
+    '''
+    set_size = 2 + int((set_table[:, 2] >= 0).any())
+    counts = popcount(bitsets[set_table[:, :set_size]])
+    intersection = bitsets[set_table[:, 0]] & bitsets[set_table[:, 1]]
+    if set_size == 2:
+        cooccurrence = popcount(intersection)
+        exclusive = counts.sum(axis=1) - 2 * cooccurrence
+    else:
+        third = bitsets[set_table[:, 2]]
+        cooccurrence = popcount(intersection & third)
+        pairs = popcount(intersection) + popcount(bitsets[set_table[:, 0]] &
+            third) + popcount(bitsets[set_table[:, 1]] & third)
+        exclusive = counts.sum(axis=1) - 2 * pairs + 3 * cooccurrence
+    if score == 'cooccurrence':
+        return cooccurrence
+    return exclusive
+
+def count_null_exceedances(arguments):
+    '''
+    Counts, for each set, the permutations of a cache file whose statistic is
+    at least the observed one. Only the bitsets of the codes in the sets are
+    built.
+    '''
+    fname, n_perms = arguments
+    visit_matrix, set_table, score, observed = null_data
+    visits = get_edges(visit_matrix)[0]
+    set_codes = np.unique(set_table[set_table >= 0])
+    local_table = np.where(set_table >= 0, np.searchsorted(set_codes,
+        set_table), -1)
+    codes = np.load(fname, mmap_mode='r')
+    exceedances = np.zeros(len(set_table), dtype=np.int64)
+    for i in range(n_perms):
+        permuted_matrix = csr_matrix((np.ones(len(visits), dtype=np.int8), (
+            visits, codes[i])), shape=visit_matrix.shape)
+        exceedances += get_set_statistics(build_code_bitsets(permuted_matrix[
+            :, set_codes]), local_table, score) >= observed
+    return exceedances
+
+def get_empirical_pvalues(visit_matrix, fname_list, n_permutations,
+    set_table, score, n_processes):
+    '''
+    Returns (1 + exceedances) / (1 + n_permutations) for each set.
+    '''
+    global null_data
+    observed = set_table[:, {'cooccurrence':3, 'exclusive':5}[score]]
+    null_data = (visit_matrix, set_table[:, :3], score, observed)
+    argument_list = [(fname, min(perms_per_file, n_permutations - i *
+        perms_per_file)) for i, fname in enumerate(fname_list)]
+    if n_processes == 1:
+        exceedance_list = map(count_null_exceedances, argument_list)
+    else:
+        pool = multiprocessing.Pool(n_processes)
+        exceedance_list = pool.map(count_null_exceedances, argument_list)
+        pool.close()
+        pool.join()
+    return (1.0 + np.sum(exceedance_list, axis=0)) / (1.0 + n_permutations)
+
+def write_pvalues(score_table, pvalues, code_list, set_size, score):
+    '''
+    Writes the scored sets with their empirical p-values, lowest p-value
+    first.
+    '''
+    out = open('./results/wext/%d_set_permutation_%s-chinese.tsv' % (set_size,
+        score), 'w')
+    out.write('#Genes\tCooccurrence\tCoverage\tExclusive\tPValue\n')
+    set_list = []
+    for i in np.argsort(pvalues, kind='mergesort'):
+        codes = [code_list[code] for code in score_table[i, :set_size]]
+        cooccurrence, coverage, exclusive = score_table[i, 3:]
+        out.write('%s\t%d\t%d\t%d\t%g\n' % (','.join(codes), cooccurrence,
+            coverage, exclusive, pvalues[i]))
+        # Stored as -log10(p), so that higher is more significant.
+        set_list += [(codes, -np.log10(pvalues[i]))]
+    out.close()
+    insert_sets('%d_set_permutation_%s' % (set_size, score), set_list)
+
+def main():
+    if len(sys.argv) not in [4, 5]:
+        print ('Usage: python %s 2/3 cooccurrence/exclusive n_permutations '
+            'num_processes<optional>' % sys.argv[0])
+        exit()
+    set_size, score, n_permutations = int(sys.argv[1]), sys.argv[2], int(
+        sys.argv[3])
+    assert set_size in [2, 3] and score in ['cooccurrence', 'exclusive']
+    n_processes = multiprocessing.cpu_count()
+    if len(sys.argv) == 5:
+        n_processes = int(sys.argv[4])
+    if not os.path.exists('./results/wext'):
+        os.makedirs('./results/wext')
+
+    code_list = read_code_list()
+    visit_matrix = load_sparse_visit_matrix()
+    bitsets = build_code_bitsets(visit_matrix)
+    herb_list, symptom_list = get_candidate_codes(code_list, 10)
+    score_table = score_sets(bitsets, herb_list, symptom_list, set_size, score,
+        1000, None, n_processes)
+
+    fname_list = get_permutation_files(visit_matrix, n_permutations, 0,
+        n_processes)
+    pvalues = get_empirical_pvalues(visit_matrix, fname_list, n_permutations,
+        score_table, score, n_processes)
+    write_pvalues(score_table, pvalues, code_list, set_size, score)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
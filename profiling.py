@@ -0,0 +1,163 @@
+### Author: Edward Huang
+
+import atexit
+from collections import OrderedDict
+import contextlib
+import cProfile
+import datetime
+import json
+from med2vec_telemetry import get_peak_rss_mb
+import os
+import pstats
+import runpy
+import sys
+import time
+
+### Shared profiling for the pipeline scripts. Scripts mark their steps with
+###     with profiling.stage('parse'):
+### which does nothing unless profiling is on. Profiling is on when the
+### TCM_PROFILE environment variable is set, or when a script is run through
+### this module,
+###     python profiling.py script.py args...
+### Each stage records its wall and CPU seconds and how much the resident
+### memory grew while it ran. Python 2 has no tracemalloc, so the allocation
+### hot spots are the stages ranked by memory growth, along with the
+### functions with the most time from cProfile. At exit, a JSON report is
+### written to ./results/profiles/<script>_<time>.json.
+
+profile_variable = 'TCM_PROFILE'
+profile_folder = './results/profiles'
+# Number of functions listed in the report.
+n_top_functions = 20
+
+def get_rss_mb():
+    '''
+    Returns the current resident set size in megabytes, or the peak if the
+    current size cannot be read.
+    '''
+    try:
+        f = open('/proc/self/statm', 'r')
+        resident_pages = int(f.read().split()[1])
+        f.close()
+    except (IOError, IndexError, ValueError):
+        return get_peak_rss_mb()
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+
+def get_cpu_seconds():
+    '''
+    Returns the user and system CPU seconds of this process and its finished
+    children, so stages that run a process pool are counted.
+    '''
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+class RunProfile(object):
+    '''
+    Collects the stage timings and the cProfile statistics of one run.
+    '''
+    def __init__(self, script, argv):
+        self.script, self.argv = script, argv
+        self.started = datetime.datetime.now()
+        self.start_wall, self.start_cpu = time.time(), get_cpu_seconds()
+        self.stage_dct = OrderedDict()
+        self.pid = os.getpid()
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+
+    def record_stage(self, name, wall, cpu, rss_start, rss_end):
+        if name not in self.stage_dct:
+            self.stage_dct[name] = {'name':name, 'calls':0, 'wall_seconds':0.0,
+                'cpu_seconds':0.0, 'rss_growth_mb':0.0}
+        row = self.stage_dct[name]
+        row['calls'] += 1
+        row['wall_seconds'] += wall
+        row['cpu_seconds'] += cpu
+        row['rss_growth_mb'] += rss_end - rss_start
+
+    def get_top_functions(self):
+        '''
+        Returns the functions with the most time spent in their own body.
+        '''
+        self.profiler.disable()
+        function_list = []
+        for (fname, line, function), (primitive_calls, calls, own_seconds,
+            total_seconds, callers) in pstats.Stats(
+            self.profiler).stats.items():
+            function_list += [{'function':'%s:%d(%s)' % (fname, line,
+                function), 'calls':calls, 'own_seconds':own_seconds,
+                'total_seconds':total_seconds}]
+        function_list.sort(key=lambda row: row['own_seconds'], reverse=True)
+        return function_list[:n_top_functions]
+
+    def write_report(self):
+        '''
+        Writes the JSON report of the run. Forked workers inherit the profile,
+        so only the process that started it writes.
+        '''
+        if os.getpid() != self.pid:
+            return
+        stage_list = self.stage_dct.values()
+        report = {'script':self.script, 'argv':self.argv,
+            'started':self.started.strftime('%Y-%m-%d %H:%M:%S'),
+            'wall_seconds':time.time() - self.start_wall,
+            'cpu_seconds':get_cpu_seconds() - self.start_cpu,
+            'peak_rss_mb':get_peak_rss_mb(), 'stages':stage_list,
+            'allocation_hot_spots':[row['name'] for row in sorted(stage_list,
+                key=lambda row: row['rss_growth_mb'], reverse=True)],
+            'top_functions':self.get_top_functions()}
+        if not os.path.exists(profile_folder):
+            os.makedirs(profile_folder)
+        out_fname = '%s/%s_%s.json' % (profile_folder, os.path.splitext(
+            os.path.basename(self.script))[0], self.started.strftime(
+            '%Y%m%d_%H%M%S_%f'))
+        out = open(out_fname, 'w')
+        json.dump(report, out, indent=2)
+        out.close()
+        print 'wrote profile to %s' % out_fname
+
+# The profile of the current run, or None if profiling is off.
+run_profile = None
+
+def start_profiling(script, argv):
+    global run_profile
+    if run_profile is None:
+        run_profile = RunProfile(script, argv)
+        atexit.register(run_profile.write_report)
+    return run_profile
+
+@contextlib.contextmanager
+def stage(name):
+    '''
+    Records the time and memory growth of the enclosed block under name.
+    Stages may nest, and repeated stages are summed.
+    '''
+    if run_profile is None:
+        yield
+        return
+    start_wall, start_cpu, rss_start = time.time(), get_cpu_seconds(), (
+        get_rss_mb())
+    try:
+        yield
+    finally:
+        run_profile.record_stage(name, time.time() - start_wall,
+            get_cpu_seconds() - start_cpu, rss_start, get_rss_mb())
+
+if __name__ != '__main__' and os.environ.get(profile_variable, '') not in [
+    '', '0']:
+    start_profiling(sys.argv[0], sys.argv[1:])
+
+def main():
+    if len(sys.argv) < 2:
+        print 'Usage: python %s script.py script_args...' % sys.argv[0]
+        exit()
+    # Scripts run by this one, and the processes they start, also profile.
+    os.environ[profile_variable] = '1'
+    sys.argv = sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+    # This file runs as __main__, so the script's own import of profiling is
+    # a separate module. Importing it here starts its profile.
+    import profiling
+    runpy.run_path(sys.argv[0], run_name='__main__')
+
+if __name__ == '__main__':
+    main()
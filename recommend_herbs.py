@@ -0,0 +1,256 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+from lagged_transitions import read_code_file
+import numpy as np
+from scipy.sparse import csr_matrix
+import time
+from visit_binary_matrix import load_sparse_visit_matrix, read_code_list
+
+### This script recommends herbs for sets of symptoms. Queries are the rows of
+### a sparse query x code matrix, and are scored in batches:
+###     conditional: the sum of P(herb | symptom) over the query's symptoms,
+###         from compute_conditional_probabilities.py.
+###     pmi: the sum of the positive PMI of the herb with each symptom, over
+###         the visits of the visit binary matrix.
+###     embedding: the cosine of the herb's vector with the sum of the
+###         symptom vectors, for the W_emb of a med2vec model or an SVD
+###         baseline.
+###     hidden: the cosine of the med2vec visit representation of the
+###         symptoms, ReLU(ReLU(x W_emb + b_emb) W_hidden + b_hidden), with
+###         the representation of a visit with only the herb.
+### The first three are a precomputed symptom x herb matrix, so a batch of
+### queries is one sparse matrix product. The top k herbs of every query are
+### found with np.argpartition.
+
+# Queries scored at once. Bounds the dense query x herb score matrix.
+batch_size = 4096
+
+def get_code_indices(code_list):
+    '''
+    Returns the positions of the symptoms and of the herbs in code_list.
+    '''
+    herb_count_dct = read_code_file('herb')
+    is_herb = np.array([code in herb_count_dct for code in code_list])
+    return np.where(~is_herb)[0], np.where(is_herb)[0]
+
+def read_conditional_matrix(fname, code_list, symptom_index, herb_index):
+    '''
+    Reads a file of (herb, symptom, probability) lines into a symptom x herb
+    matrix.
+    '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    symptom_rows = np.zeros(len(code_list), dtype=np.int64) - 1
+    symptom_rows[symptom_index] = np.arange(len(symptom_index))
+    herb_cols = np.zeros(len(code_list), dtype=np.int64) - 1
+    herb_cols[herb_index] = np.arange(len(herb_index))
+    score_matrix = np.zeros((len(symptom_index), len(herb_index)),
+        dtype=np.float32)
+    f = open(fname, 'r')
+    for line in f:
+        herb, symptom, prob = line.split('\t')
+        # Codes of single-visit patients are not in the code list.
+        if herb not in code_dct or symptom not in code_dct:
+            continue
+        row, col = symptom_rows[code_dct[symptom]], herb_cols[code_dct[herb]]
+        # A code listed as both a herb and a symptom is indexed as a herb, so
+        # it has no symptom row.
+        if row < 0 or col < 0:
+            continue
+        score_matrix[row, col] = float(prob)
+    f.close()
+    return score_matrix
+
+def get_count_matrices(visit_matrix, symptom_index, herb_index):
+    '''
+    Returns the symptom x herb co-occurrence counts, the symptom counts, the
+    herb counts, and the number of visits of a visit x code matrix.
+    '''
+    visit_matrix = visit_matrix.astype(np.float64).tocsc()
+    symptom_matrix = visit_matrix[:, symptom_index]
+    herb_matrix = visit_matrix[:, herb_index]
+    return (symptom_matrix.T.dot(herb_matrix).toarray(), np.asarray(
+        symptom_matrix.sum(axis=0)).ravel(), np.asarray(herb_matrix.sum(
+        axis=0)).ravel(), visit_matrix.shape[0])
+
+def get_conditional_matrix(count_matrices, min_count=10):
+    '''
+    P(herb | symptom) in the same visit. Symptoms in fewer than min_count
+    visits score zero, as in compute_conditional_probabilities.py.
+    '''
+    co_counts, symptom_counts, herb_counts, num_visits = count_matrices
+    score_matrix = co_counts / np.maximum(symptom_counts, 1)[:, None]
+    score_matrix[symptom_counts < min_count] = 0
+    return score_matrix.astype(np.float32)
+
+def get_pmi_matrix(count_matrices):
+    '''
+    max(0, log2(P(symptom, herb) / (P(symptom) P(herb)))). Unlike the PMI of
+    cooccurrence_svd_baseline.py, the counts are divided by the number of
+    visits, so that unseen pairs, at zero, rank below positive associations
+    when a query's scores are summed.
+    '''
+    co_counts, symptom_counts, herb_counts, num_visits = count_matrices
+    with np.errstate(divide='ignore'):
+        pmi = np.log2(co_counts * num_visits / np.maximum(np.outer(
+            symptom_counts, herb_counts), 1))
+    return np.maximum(pmi, 0).astype(np.float32)
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1)
+    norms[norms == 0] = 1
+    return matrix / norms[:, None]
+
+def get_embedding_matrix(embeddings, symptom_index, herb_index):
+    '''
+    Cosine of each symptom's vector with each herb's. Summed over a query's
+    symptoms, the score ranks herbs by cosine with the sum of the normalized
+    symptom vectors.
+    '''
+    embeddings = normalize_rows(embeddings.astype(np.float64))
+    return embeddings[symptom_index].dot(embeddings[herb_index].T).astype(
+        np.float32)
+
+class HiddenScorer(object):
+    '''
+    Scores herbs by the cosine of med2vec visit representations. The model
+    archive must have W_emb, b_emb, W_hidden, and b_hidden.
+    '''
+    def __init__(self, model, herb_index):
+        self.W_emb, self.b_emb = model['W_emb'], model['b_emb']
+        # Demographic rows of W_hidden are not used.
+        self.W_hidden = model['W_hidden'][:len(self.b_emb)]
+        self.b_hidden = model['b_hidden']
+        herb_visits = csr_matrix((np.ones(len(herb_index)), (np.arange(len(
+            herb_index)), herb_index)), shape=(len(herb_index), len(
+            self.W_emb)))
+        self.herb_vectors = normalize_rows(self.represent(herb_visits))
+
+    def represent(self, visit_matrix):
+        emb = np.maximum(visit_matrix.dot(self.W_emb) + self.b_emb, 0)
+        return np.maximum(emb.dot(self.W_hidden) + self.b_hidden, 0)
+
+    def score(self, query_matrix, symptom_index):
+        # Only the symptoms of a query are used.
+        is_symptom = np.zeros((1, query_matrix.shape[1]))
+        is_symptom[0, symptom_index] = 1
+        query_vectors = self.represent(csr_matrix(query_matrix.multiply(
+            is_symptom)))
+        return normalize_rows(query_vectors).dot(self.herb_vectors.T)
+
+class HerbRecommender(object):
+    '''
+    Ranks herbs for batches of symptom queries with either a symptom x herb
+    score matrix or a HiddenScorer.
+    '''
+    def __init__(self, scorer, symptom_index, herb_index):
+        self.scorer = scorer
+        self.symptom_index, self.herb_index = symptom_index, herb_index
+
+    def score(self, query_matrix):
+        '''
+        Returns the query x herb scores of a query x code matrix.
+        '''
+        if isinstance(self.scorer, HiddenScorer):
+            return self.scorer.score(query_matrix, self.symptom_index)
+        query_matrix = query_matrix.tocsc()[:, self.symptom_index].tocsr()
+        return np.asarray(query_matrix.astype(np.float32).dot(self.scorer))
+
+    def recommend(self, query_matrix, k):
+        '''
+        Returns the query x k code indices of the top k herbs of each query,
+        best first, and their scores.
+        '''
+        query_matrix = csr_matrix(query_matrix)
+        k = min(k, len(self.herb_index))
+        top_herbs = np.zeros((query_matrix.shape[0], k), dtype=np.int64)
+        top_scores = np.zeros((query_matrix.shape[0], k), dtype=np.float32)
+        for start in range(0, query_matrix.shape[0], batch_size):
+            scores = self.score(query_matrix[start:start + batch_size])
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            rows = np.arange(len(top))[:, None]
+            order = np.argsort(-scores[rows, top], axis=1, kind='mergesort')
+            top = top[rows, order]
+            top_herbs[start:start + len(top)] = self.herb_index[top]
+            top_scores[start:start + len(top)] = scores[rows, top]
+        return top_herbs, top_scores
+
+def get_recommender(scoring, code_list, model_fname=''):
+    '''
+    Builds the recommender of a scoring method. model_fname is the
+    conditional probability file for conditional, and the model archive for
+    embedding and hidden.
+    '''
+    symptom_index, herb_index = get_code_indices(code_list)
+    if scoring == 'conditional':
+        if model_fname == '':
+            model_fname = './results/herb_given_symptom.txt'
+        scorer = read_conditional_matrix(model_fname, code_list,
+            symptom_index, herb_index)
+    elif scoring == 'pmi':
+        scorer = get_pmi_matrix(get_count_matrices(load_sparse_visit_matrix(),
+            symptom_index, herb_index))
+    elif scoring == 'embedding':
+        scorer = get_embedding_matrix(np.load(model_fname)['W_emb'],
+            symptom_index, herb_index)
+    else:
+        scorer = HiddenScorer(np.load(model_fname), herb_index)
+    return HerbRecommender(scorer, symptom_index, herb_index)
+
+def read_queries(fname, code_list):
+    '''
+    Reads one query per line, with its symptoms separated by colons. Unknown
+    symptoms are skipped. Returns the query x code matrix.
+    '''
+    code_dct = dict((code, i) for i, code in enumerate(code_list))
+    rows, cols, query_list = [], [], []
+    f = open(fname, 'r')
+    for line in f:
+        query = [code for code in line.strip().split(':') if code != '']
+        for code in set(query):
+            if code in code_dct:
+                rows += [len(query_list)]
+                cols += [code_dct[code]]
+        query_list += [':'.join(query)]
+    f.close()
+    return csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(
+        query_list), len(code_list))), query_list
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scoring', choices=['conditional', 'pmi', 'embedding',
+        'hidden'])
+    parser.add_argument('query_fname', help='One query per line, with '
+        'symptoms separated by colons')
+    parser.add_argument('--model_fname', default='', help='The model archive '
+        'for embedding and hidden, or the conditional probability file '
+        '(default value: ./results/herb_given_symptom.txt)')
+    parser.add_argument('-k', type=int, default=10, help='The number of herbs '
+        'per query (default value: 10)')
+    parser.add_argument('--out_fname', default='./results/recommendations.txt',
+        help='(default value: ./results/recommendations.txt)')
+    args = parser.parse_args()
+    assert args.scoring in ['conditional', 'pmi'] or args.model_fname != ''
+
+    code_list = read_code_list()
+    recommender = get_recommender(args.scoring, code_list, args.model_fname)
+    query_matrix, query_list = read_queries(args.query_fname, code_list)
+    start_time = time.time()
+    top_herbs, top_scores = recommender.recommend(query_matrix, args.k)
+    seconds = time.time() - start_time
+    print '%d queries, %f queries per second' % (len(query_list), len(
+        query_list) / max(seconds, 1e-12))
+
+    out = open(args.out_fname, 'w')
+    for query, herbs, scores in zip(query_list, top_herbs, top_scores):
+        out.write('%s\t%s\n' % (query, ','.join('%s:%f' % (code_list[herb],
+            score) for herb, score in zip(herbs, scores))))
+    out.close()
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import argparse
+import sqlite3
+import time
+
+### This script keeps the scores of every model in one SQLite database, so
+### that what all models say about a code is one indexed query instead of a
+### grep over the result files. The scoring stages call insert_scores with
+### their (code_a, code_b, score) rows as they write their own files, which
+### replaces the earlier rows of the same model. The rows are inserted under a
+### staging name and renamed in one transaction, so a query run while a stage
+### writes sees either the old rows or all of the new ones. A set of more than two codes
+### is stored once per code, with the code as code_a and the others, joined
+### by colons, as code_b. Codes are utf-8 str in the scripts and unicode in
+### sqlite3, so they are decoded on the way in and encoded on the way out.
+### Usage:
+###     python result_store.py code --model model<optional> -n 20
+### prints the top n scores of the code in each model.
+
+db_fname = './results/results.db'
+# Rows inserted per transaction.
+batch_size = 50000
+
+def connect():
+    # Other stages may be writing, so wait for their transactions.
+    connection = sqlite3.connect(db_fname, timeout=600)
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS scores (model TEXT, code_a TEXT,
+            code_b TEXT, score REAL);
+        CREATE INDEX IF NOT EXISTS scores_model_code_a ON scores (model,
+            code_a);
+        CREATE INDEX IF NOT EXISTS scores_model_code_b ON scores (model,
+            code_b);
+        CREATE INDEX IF NOT EXISTS scores_score ON scores (score);
+        CREATE TABLE IF NOT EXISTS models (model TEXT PRIMARY KEY,
+            n_rows INTEGER, updated REAL);
+    ''')
+    return connection
+
+def decode(code):
+    if isinstance(code, str):
+        return code.decode('utf-8')
+    return code
+
+def encode(code):
+    if isinstance(code, unicode):
+        return code.encode('utf-8')
+    return code
+
+def insert_scores(model, row_list):
+    '''
+    Replaces the scores of model with row_list, a list of (code_a, code_b,
+    score), in batched transactions.
+    '''
+    model = decode(model)
+    # Model names have no tabs, so this cannot be another model.
+    staging_model = u'%s\tstaging' % model
+    connection = connect()
+    # Rows left by a run that stopped before the rename.
+    with connection:
+        connection.execute('DELETE FROM scores WHERE model = ?', (
+            staging_model,))
+    for start in range(0, len(row_list), batch_size):
+        with connection:
+            connection.executemany('INSERT INTO scores VALUES (?, ?, ?, ?)',
+                ((staging_model, decode(code_a), decode(code_b), float(score))
+                for code_a, code_b, score in row_list[start:start +
+                batch_size]))
+    with connection:
+        connection.execute('DELETE FROM scores WHERE model = ?', (model,))
+        connection.execute('UPDATE scores SET model = ? WHERE model = ?', (
+            model, staging_model))
+        connection.execute('INSERT OR REPLACE INTO models VALUES (?, ?, ?)',
+            (model, len(row_list), time.time()))
+    connection.close()
+
+def insert_sets(model, set_list):
+    '''
+    Stores a list of (codes, score) with every code of a set as code_a. A
+    pair is stored once, as from insert_scores.
+    '''
+    row_list = []
+    for codes, score in set_list:
+        if len(codes) == 2:
+            row_list += [(codes[0], codes[1], score)]
+            continue
+        for i, code in enumerate(codes):
+            row_list += [(code, ':'.join(codes[:i] + codes[i + 1:]), score)]
+    insert_scores(model, row_list)
+
+def get_models(connection):
+    return [row[0] for row in connection.execute(
+        'SELECT model FROM models ORDER BY model')]
+
+def query_code(code, model_list, n_top):
+    '''
+    Returns the top n_top (model, code_a, code_b, score) rows with the code
+    on either side, for each model.
+    '''
+    connection = connect()
+    code = decode(code)
+    if len(model_list) == 0:
+        model_list = get_models(connection)
+    row_list = []
+    for model in model_list:
+        # Each side is its own indexed lookup.
+        row_list += connection.execute('''
+            SELECT model, code_a, code_b, score FROM (
+                SELECT * FROM scores WHERE model = ? AND code_a = ?
+                UNION ALL
+                SELECT * FROM scores WHERE model = ? AND code_b = ?)
+            ORDER BY score DESC LIMIT ?''', (decode(model), code,
+            decode(model), code, n_top)).fetchall()
+    connection.close()
+    return [tuple(encode(value) for value in row) for row in row_list]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('code')
+    parser.add_argument('--model', nargs='*', default=[], help='(default '
+        'value: every model)')
+    parser.add_argument('-n', type=int, default=20, help='The number of rows '
+        'per model (default value: 20)')
+    args = parser.parse_args()
+
+    for model, code_a, code_b, score in query_code(args.code, args.model,
+        args.n):
+        print '%s\t%s\t%s\t%f' % (model, code_a, code_b, score)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -19,25 +19,66 @@ def get_num_codes():
     f.close()
     return num_codes
 
+def get_num_labels():
+    '''
+    Reads the label_list file written by create_med2vec_labels.py and returns
+    the number of grouped output codes.
+    '''
+    num_labels = 0
+    f = open('./results/label_list.txt', 'r')
+    for line in f:
+        num_labels += 1
+    f.close()
+    return num_labels
+
+def build_command(model_type, objective, num_codes, output_file,
+    hyperparameters={}):
+    '''
+    Returns the argument list that launches a single med2vec run. objective is
+    'conditional', 'pmi', or 'both'. hyperparameters maps med2vec.py option
+    names (without the leading dashes) to their values, e.g. window_size,
+    cr_size, vr_size, batch_size, L2_reg, n_epoch.
+    '''
+    assert model_type in ['baseline', 'separated']
+    assert objective in ['conditional', 'pmi', 'both']
+    visit_file = './results/med2vec_input_%s_visits.pickle' % model_type
+    command = ['python', 'med2vec.py', visit_file, str(num_codes), output_file,
+        '--objective', objective]
+    for option in sorted(hyperparameters):
+        command += ['--%s' % option, str(hyperparameters[option])]
+    return command
+
 def main():
-    if len(sys.argv) not in [2, 3]:
-        print ('Usage:python %s model_type pmi<optional>' % sys.argv[0])
+    if len(sys.argv) not in [2, 3, 4]:
+        print ('Usage:python %s model_type pmi/both<optional> grouped<optional>'
+            % sys.argv[0])
         exit()
     model_type = sys.argv[1]
     assert model_type in ['baseline', 'separated']
-    pmi = ''
-    if len(sys.argv) == 3:
+    pmi, objective = '', 'conditional'
+    hyperparameters = {'n_epoch':500}
+    for argument in sys.argv[2:]:
+        assert argument in ['pmi', 'both', 'grouped']
+        if argument == 'grouped':
+            # Predict the groups from create_med2vec_labels.py instead of the
+            # raw codes.
+            hyperparameters['label_file'] = ('./results/med2vec_input_%s_'
+                'labels.pickle' % model_type)
+            hyperparameters['n_output_codes'] = get_num_labels()
+        else:
+            objective = argument
+    # With both objectives, med2vec.py adds the pmi_ prefix itself.
+    if objective == 'pmi':
         pmi = 'pmi_'
 
-    visit_file = './results/med2vec_input_%s_visits.pickle' % model_type
     num_codes = get_num_codes()
     output_file = './results/med2vec_output/%s%s_model' % (pmi, model_type)
 
-    command = 'python %smed2vec.py %s --n_epoch 500 %d %s' % (pmi, visit_file,
-        num_codes, output_file)
-    subprocess.call(command, shell=True)
+    command = build_command(model_type, objective, num_codes, output_file,
+        hyperparameters)
+    subprocess.call(command)
 
 if __name__ == '__main__':
     start_time = time.time()
     main()
-    print("--- %s seconds ---" % (time.time() - start_time))
\ No newline at end of file
+    print("--- %s seconds ---" % (time.time() - start_time))
@@ -0,0 +1,378 @@
+### Author: Edward Huang
+
+import argparse
+import ast
+import hashlib
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import profiling
+import subprocess
+import time
+
+### This script runs the whole pipeline in dependency order. Each stage
+### declares its command, the files it reads, and the files it writes. A
+### stage depends on the stages that write its inputs. A stage is skipped if
+### its outputs exist and the hash of its command, script, the repo modules
+### the script imports, and input files is the same as on its last successful
+### run. Stages whose dependencies are done
+### run in parallel, so the baselines, conditional probabilities, and binary
+### matrix run side by side.
+
+state_fname = './results/pipeline_state.json'
+# run_med2vec.py trains for 500 epochs, so the last model is epoch 499.
+last_epoch = 499
+
+visit_files = ['./results/med2vec_input_baseline_visits.pickle',
+    './results/med2vec_input_separated_visits.pickle']
+code_files = ['./results/code_list.txt', './data/herb_count_dct.txt',
+    './data/symptom_count_dct.txt', './results/code_mapping.txt']
+binary_matrix_file = './data/visit_binary_matrix.npz'
+patient_list_file = './results/patient_list.txt'
+
+def get_med2vec_outputs(model_type):
+    return ['./results/med2vec_output/%s%s_model.%d.npz' % (pmi, model_type,
+        last_epoch) for pmi in ['', 'pmi_']]
+
+def get_similarity_outputs(folder, prefix=''):
+    return ['%s/%s%s_pair_similarities.txt' % (folder, prefix, pair_type) for
+        pair_type in ['hh', 'hs', 'ss']]
+
+def get_local_imports(script, module_list=None):
+    '''
+    Returns the repo modules that a script imports, directly or through other
+    repo modules, in the order they are found.
+    '''
+    if module_list is None:
+        module_list = []
+    f = open(script, 'r')
+    tree = ast.parse(f.read(), script)
+    f.close()
+    name_list = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            name_list += [alias.name.split('.')[0] for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            name_list += [node.module.split('.')[0]]
+    for name in name_list:
+        fname = '%s.py' % name
+        if os.path.exists(fname) and fname != script and fname not in (
+            module_list):
+            module_list += [fname]
+            get_local_imports(fname, module_list)
+    return module_list
+
+def get_stage_list():
+    '''
+    Returns the stages of the pipeline. Each stage is a dictionary with its
+    name, command, inputs, and outputs.
+    '''
+    stage_list = [
+        {'name':'create_med2vec_input',
+        'command':['python', 'create_med2vec_input.py'],
+        'inputs':['./data/HIS_tuple_word.txt'],
+        'outputs':visit_files + code_files + [patient_list_file]},
+        {'name':'compute_conditional_probabilities',
+        'command':['python', 'compute_conditional_probabilities.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':['./results/herb_given_symptom.txt',
+            './results/herb_given_new_symptom.txt']},
+        {'name':'cooccurrence_svd_baseline',
+        'command':['python', 'cooccurrence_svd_baseline.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':get_similarity_outputs('./results/cooccurrence_baseline') +
+            get_similarity_outputs('./results/pmi_baseline') + [
+            './results/%s_svd_k%d_baseline/embeddings.npz' % (matrix_type, k)
+            for matrix_type in ['co', 'pmi'] for k in [50, 100, 150]]},
+        {'name':'approximate_cooccurrence',
+        'command':['python', 'approximate_cooccurrence.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':['./results/approximate_cooccurrence/%s.txt' % fname for
+            fname in ['pair_cooccurrence', 'pair_pmi', 'triple_cooccurrence']]},
+        {'name':'incremental_svd',
+        'command':['python', 'incremental_svd.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files[:1] + code_files[
+            -1:],
+        'outputs':['./results/incremental_svd/%s' % fname for fname in [
+            'factors.npz', 'patient_state.pickle', 'code_list.txt']] + [
+            './results/incremental_svd/co_svd_k%d/embeddings.npz' % k for k in
+            [50, 100, 150]]},
+        {'name':'visit_binary_matrix',
+        'command':['python', 'visit_binary_matrix.py'],
+        'inputs':visit_files[:1] + code_files[:1],
+        'outputs':[binary_matrix_file, './data/visit_binary_matrix_packed.npy']},
+        {'name':'bitset_exclusivity',
+        'command':['python', 'bitset_exclusivity.py', '3', 'exclusive'],
+        'inputs':[binary_matrix_file] + code_files,
+        'outputs':['./results/wext/3_set_bitset_exclusive-chinese.tsv']},
+        {'name':'lagged_transitions',
+        'command':['python', 'lagged_transitions.py', '3'],
+        'inputs':[binary_matrix_file] + code_files,
+        'outputs':['./results/lagged_transitions/%s_lag%d.txt' % (table, lag)
+            for table in ['herb_given_symptom', 'symptom_resolution'] for lag in
+            [1, 2, 3]]},
+        {'name':'bootstrap_confidence_intervals',
+        'command':['python', 'bootstrap_confidence_intervals.py', '1000',
+            'poisson'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':['./results/bootstrap/%s_ci.txt' % table for table in [
+            'herb_given_symptom', 'herb_given_new_symptom', 'pmi']]},
+        {'name':'disease_stratified_statistics',
+        'command':['python', 'disease_stratified_statistics.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':['./results/disease_stratified/statistics.npz',
+            './results/disease_stratified/disease_index.txt']},
+        {'name':'sliding_window_cooccurrence',
+        'command':['python', 'sliding_window_cooccurrence.py'],
+        'inputs':['./data/HIS_tuple_word.txt'] + code_files,
+        'outputs':['./results/sliding_windows/windows.npz',
+            './results/sliding_windows/top_pmi.txt']},
+        {'name':'evaluate_herb_prediction',
+        'command':['python', 'evaluate_herb_prediction.py'],
+        'inputs':[binary_matrix_file] + code_files,
+        'outputs':['./results/evaluation/metrics.txt',
+            './results/evaluation/fold_metrics.txt']}]
+    # Both objectives of a model type are trained in one process.
+    for model_type, visit_file in zip(['baseline', 'separated'], visit_files):
+        stage_list += [{'name':'med2vec_%s' % model_type,
+            'command':['python', 'run_med2vec.py', model_type, 'both'],
+            'inputs':[visit_file] + code_files[:1],
+            'outputs':get_med2vec_outputs(model_type)}]
+    for pmi in ['', 'pmi_']:
+        command = ['python', 'get_most_similar_med2vec_pairs.py', str(
+            last_epoch), str(last_epoch)]
+        if pmi != '':
+            command += ['pmi']
+        stage_list += [{'name':'%smed2vec_similar_pairs' % pmi,
+            'command':command,
+            'inputs':['./results/med2vec_output/%s%s_model.%d.npz' % (pmi,
+                model_type, last_epoch) for model_type in ['baseline',
+                'separated']] + code_files,
+            'outputs':sum([get_similarity_outputs(
+                './results/med2vec_baseline', '%s%s_' % (pmi, model_type)) for
+                model_type in ['baseline', 'separated']], [])}]
+    for model_fname in get_med2vec_outputs('baseline') + get_med2vec_outputs(
+        'separated'):
+        name = os.path.basename(model_fname)[:-len('.npz')]
+        out_dir = './results/embeddings/%s' % name
+        stage_list += [{'name':'export_%s' % name,
+            'command':['python', 'export_embeddings.py', model_fname],
+            'inputs':[model_fname] + code_files,
+            'outputs':['%s/%s' % (out_dir, fname) for fname in [
+                'embeddings.npy', 'vectors.txt', 'vectors.bin',
+                'code_index.txt']]}]
+        visit_type = 'separated' if 'separated' in name else 'baseline'
+        out_dir = './results/representations/%s' % name
+        stage_list += [{'name':'represent_%s' % name,
+            'command':['python', 'visit_representations.py', model_fname,
+                '--visits', visit_type],
+            'inputs':[model_fname, binary_matrix_file, patient_list_file] +
+                visit_files + code_files[:1],
+            'outputs':['%s/%s' % (out_dir, fname) for fname in [
+                'visit_vectors.npy', 'patient_vectors.npy',
+                'patient_indptr.npy', 'patient_index.txt', 'meta.json']]}]
+    out_dir = './results/patient_similarity/tfidf'
+    stage_list += [{'name':'patient_similarity_tfidf',
+        'command':['python', 'patient_similarity.py', 'build', 'tfidf'],
+        'inputs':[binary_matrix_file, patient_list_file] + visit_files[:1] +
+            code_files[:1],
+        'outputs':['%s/%s' % (out_dir, fname) for fname in ['vectors.npy',
+            'patient_list.txt', 'projection.npz', 'meta.json']]}]
+    stage_list += [{'name':'graph_embedding',
+        'command':['python', 'graph_embedding.py'],
+        'inputs':[binary_matrix_file] + code_files,
+        'outputs':['./results/graph_embedding/deepwalk_d128/embeddings.npz'] +
+            get_similarity_outputs('./results/med2vec_baseline',
+            'deepwalk_d128_')}]
+    # The stage's own script and the repo modules it imports are inputs, so
+    # editing them reruns the stage.
+    for stage in stage_list:
+        script = stage['command'][1]
+        stage['inputs'] = [script] + get_local_imports(script) + stage[
+            'inputs']
+    return stage_list
+
+def get_dependencies(stage_list):
+    '''
+    Returns a dictionary mapping each stage name to the set of stages that
+    write one of its inputs.
+    '''
+    writer_dct = {}
+    for stage in stage_list:
+        for output in stage['outputs']:
+            writer_dct[output] = stage['name']
+    dependency_dct = {}
+    for stage in stage_list:
+        dependency_dct[stage['name']] = set(writer_dct[fname] for fname in
+            stage['inputs'] if fname in writer_dct) - set([stage['name']])
+    return dependency_dct
+
+def hash_file(fname, sha):
+    f = open(fname, 'rb')
+    while True:
+        block = f.read(1 << 20)
+        if not block:
+            break
+        sha.update(block)
+    f.close()
+
+def get_stage_hash(stage):
+    '''
+    Hashes the command and the contents of every input file. Returns None if
+    an input is missing.
+    '''
+    sha = hashlib.sha1(json.dumps(stage['command']))
+    for fname in stage['inputs']:
+        if not os.path.exists(fname):
+            return None
+        sha.update(fname)
+        hash_file(fname, sha)
+    return sha.hexdigest()
+
+def read_state():
+    if not os.path.exists(state_fname):
+        return {}
+    f = open(state_fname, 'r')
+    state = json.load(f)
+    f.close()
+    return state
+
+def write_state(state):
+    out = open(state_fname, 'w')
+    json.dump(state, out, indent=2, sort_keys=True)
+    out.close()
+
+def run_stage(stage):
+    '''
+    Runs one stage and logs its output to ./results/pipeline_logs. Returns
+    the stage name, the input hash, the return code, and the run time.
+    '''
+    stage_hash = get_stage_hash(stage)
+    command = stage['command']
+    # Profiling does not change a stage's outputs, so it is not in the hash.
+    if os.environ.get(profiling.profile_variable, '') not in ['', '0']:
+        command = ['python', 'profiling.py'] + command[1:]
+    log = open('./results/pipeline_logs/%s.txt' % stage['name'], 'w')
+    start_time = time.time()
+    return_code = subprocess.call(command, stdout=log,
+        stderr=subprocess.STDOUT)
+    log.close()
+    return stage['name'], stage_hash, return_code, time.time() - start_time
+
+def is_up_to_date(stage, state):
+    if stage['name'] not in state:
+        return False
+    if False in [os.path.exists(fname) for fname in stage['outputs']]:
+        return False
+    return get_stage_hash(stage) == state[stage['name']]
+
+def run_pipeline(stage_list, n_workers, force):
+    '''
+    Schedules the stages over n_workers. A stage starts once every stage it
+    depends on has finished or been skipped. Stages that depend on a failed
+    stage do not run.
+    '''
+    dependency_dct = get_dependencies(stage_list)
+    stage_dct = dict((stage['name'], stage) for stage in stage_list)
+    state = read_state()
+    done, failed, running = set(), set(), set()
+    pool = ThreadPool(n_workers)
+    pending_results = []
+    while len(done) + len(failed) < len(stage_list):
+        for name in sorted(stage_dct):
+            if name in done or name in failed or name in running:
+                continue
+            if len(dependency_dct[name] & failed) > 0:
+                print 'not running %s, a dependency failed' % name
+                failed.add(name)
+                continue
+            if not dependency_dct[name].issubset(done):
+                continue
+            # Only check the hash once the inputs have been rebuilt.
+            if not force and is_up_to_date(stage_dct[name], state):
+                print 'skipping %s, inputs unchanged' % name
+                done.add(name)
+                continue
+            print 'starting %s' % name
+            running.add(name)
+            pending_results += [pool.apply_async(run_stage, (stage_dct[name],))]
+        if len(running) == 0:
+            continue
+        # Wait for any running stage to finish.
+        while True:
+            finished = [result for result in pending_results if result.ready()]
+            if len(finished) > 0:
+                break
+            time.sleep(0.1)
+        for result in finished:
+            pending_results.remove(result)
+            name, stage_hash, return_code, seconds = result.get()
+            running.remove(name)
+            if return_code == 0:
+                print 'finished %s in %fs' % (name, seconds)
+                done.add(name)
+                state[name] = stage_hash
+                write_state(state)
+            else:
+                print '%s failed with return code %d, see %s' % (name,
+                    return_code, './results/pipeline_logs/%s.txt' % name)
+                failed.add(name)
+    pool.close()
+    pool.join()
+    return failed
+
+def select_stages(stage_list, target_list):
+    '''
+    Returns the target stages and every stage they depend on.
+    '''
+    dependency_dct = get_dependencies(stage_list)
+    selected, frontier = set(), list(target_list)
+    while len(frontier) > 0:
+        name = frontier.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        frontier += list(dependency_dct[name])
+    return [stage for stage in stage_list if stage['name'] in selected]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stages', nargs='*', help='The stages to run, along '
+        'with the stages they depend on. Runs every stage by default')
+    parser.add_argument('-j', '--workers', type=int, default=2, help='The '
+        'number of stages that run at the same time (default value: 2)')
+    parser.add_argument('--force', action='store_true', help='Run the stages '
+        'even if their inputs are unchanged')
+    parser.add_argument('--list', action='store_true', help='Print the stages '
+        'and their dependencies, and exit')
+    parser.add_argument('--profile', action='store_true', help='Write a '
+        'profiling report for each stage to %s' % profiling.profile_folder)
+    args = parser.parse_args()
+    if args.profile:
+        os.environ[profiling.profile_variable] = '1'
+
+    stage_list = get_stage_list()
+    if args.list:
+        dependency_dct = get_dependencies(stage_list)
+        for stage in stage_list:
+            print '%s <- %s' % (stage['name'], ', '.join(sorted(
+                dependency_dct[stage['name']])))
+        exit()
+    if len(args.stages) > 0:
+        stage_names = set(stage['name'] for stage in stage_list)
+        for name in args.stages:
+            assert name in stage_names, 'unknown stage %s' % name
+        stage_list = select_stages(stage_list, args.stages)
+
+    for directory in ['./results', './results/pipeline_logs']:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    failed = run_pipeline(stage_list, args.workers, args.force)
+    if len(failed) > 0:
+        print 'failed stages: %s' % ', '.join(sorted(failed))
+        exit(1)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+from create_med2vec_input import (get_patient_dct, prune_patient_dct,
+    read_pruned_codes)
+import datetime
+from disease_stratified_statistics import get_pair_incidence, get_visit_matrices
+import numpy as np
+import os
+from scipy.sparse import csr_matrix, vstack
+import sys
+import time
+from visit_binary_matrix import read_code_list
+
+### This script tracks how the co-occurrence counts and PMI scores of the
+### codes drift over time. It slides a window of window_months months over
+### the visit dates with a stride of stride_months months. Visits are sorted
+### by date, so the visits that enter and leave the window are contiguous rows
+### of the visit x pair incidence matrix. Each window's counts are the last
+### window's counts plus the entering rows minus the leaving rows, so each
+### visit is added and subtracted once over the whole run.
+### Must run create_med2vec_input.py first.
+
+out_folder = './results/sliding_windows'
+
+def add_months(date, n_months):
+    '''
+    Returns the first day of the month n_months after date's month.
+    '''
+    month = date.year * 12 + date.month - 1 + n_months
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+def get_window_starts(date_list, window_months, stride_months):
+    '''
+    Returns the start dates of the windows, from the month of the first visit
+    until the window that contains the last visit.
+    '''
+    start, last_date = add_months(min(date_list), 0), max(date_list)
+    window_starts = [start]
+    while add_months(window_starts[-1], window_months) <= last_date:
+        window_starts += [add_months(window_starts[-1], stride_months)]
+    return window_starts
+
+def sum_rows(matrix, start, end):
+    return np.asarray(matrix[start:end].sum(axis=0)).ravel()
+
+def compute_window_counts(co_matrix, visit_matrix, visit_dates, window_starts,
+    window_months):
+    '''
+    Returns the window x pair co-occurrence counts, the window x code counts,
+    and the number of visits of each window. The rows of the matrices are
+    sorted by visit_dates.
+    '''
+    co_counts = np.zeros(co_matrix.shape[1])
+    code_counts = np.zeros(visit_matrix.shape[1])
+    # Rows from left to right are in the current window.
+    left, right = 0, 0
+    co_rows, code_rows, visit_counts = [], [], []
+    for window_start in window_starts:
+        new_left = np.searchsorted(visit_dates, window_start)
+        new_right = np.searchsorted(visit_dates, add_months(window_start,
+            window_months))
+        # Windows do not move backwards, but the stride can be longer than the
+        # window, in which case every visit of the last window leaves.
+        new_left, new_right = max(new_left, left), max(new_right, right)
+        entering_start = max(right, new_left)
+        co_counts += sum_rows(co_matrix, entering_start, new_right)
+        code_counts += sum_rows(visit_matrix, entering_start, new_right)
+        leaving_end = min(new_left, right)
+        co_counts -= sum_rows(co_matrix, left, leaving_end)
+        code_counts -= sum_rows(visit_matrix, left, leaving_end)
+        left, right = new_left, new_right
+        co_rows += [csr_matrix(co_counts)]
+        code_rows += [csr_matrix(code_counts)]
+        visit_counts += [right - left]
+    return co_rows, code_rows, np.array(visit_counts)
+
+def write_windows(window_starts, co_rows, code_rows, visit_counts, pair_list,
+    code_list, n_top, min_count):
+    '''
+    Writes the counts of every window to windows.npz, and the n_top pairs of
+    each window by PMI, among pairs seen at least min_count times, to
+    top_pmi.txt.
+    '''
+    pair_names = np.array(code_list)[pair_list]
+    co_matrix = vstack(co_rows).tocsr()
+    code_matrix = vstack(code_rows).tocsr()
+    window_names = np.array([window_start.strftime('%Y-%m-%d') for
+        window_start in window_starts])
+    np.savez('%s/windows.npz' % out_folder, window_starts=window_names,
+        visit_counts=visit_counts, pair_names=pair_names, code_list=np.array(
+        code_list), co_data=co_matrix.data, co_indices=co_matrix.indices,
+        co_indptr=co_matrix.indptr, code_data=code_matrix.data,
+        code_indices=code_matrix.indices, code_indptr=code_matrix.indptr)
+
+    out = open('%s/top_pmi.txt' % out_folder, 'w')
+    out.write('#Window\tVisits\tCode_a\tCode_b\tCooccurrence\tPMI\n')
+    for window_i, window_name in enumerate(window_names):
+        row = co_matrix[window_i].tocoo()
+        keep = row.data >= min_count
+        pairs, counts = row.col[keep], row.data[keep]
+        code_counts = code_matrix[window_i].toarray().ravel()
+        pmi = np.log2(counts / (code_counts[pair_list[pairs, 0]] *
+            code_counts[pair_list[pairs, 1]]))
+        for i in np.argsort(-pmi, kind='mergesort')[:n_top]:
+            out.write('%s\t%d\t%s\t%s\t%d\t%f\n' % (window_name, visit_counts[
+                window_i], pair_names[pairs[i], 0], pair_names[pairs[i], 1],
+                counts[i], pmi[i]))
+    out.close()
+
+def main():
+    if len(sys.argv) not in [1, 3, 5]:
+        print ('Usage: python %s window_months<optional> stride_months'
+            '<optional> n_top<optional> min_count<optional>' % sys.argv[0])
+        exit()
+    window_months, stride_months, n_top, min_count = 3, 1, 100, 5
+    if len(sys.argv) >= 3:
+        window_months, stride_months = int(sys.argv[1]), int(sys.argv[2])
+    if len(sys.argv) == 5:
+        n_top, min_count = int(sys.argv[3]), int(sys.argv[4])
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+
+    code_list = read_code_list()
+    visit_matrix, disease_matrix, disease_list, patient_indptr, date_list = (
+        get_visit_matrices(prune_patient_dct(get_patient_dct(),
+        read_pruned_codes()), code_list))
+    order = np.argsort(np.array(date_list), kind='mergesort')
+    visit_matrix = visit_matrix[order].astype(np.float64)
+    visit_dates = np.array(date_list)[order]
+    co_matrix, pair_list = get_pair_incidence(visit_matrix, visit_matrix,
+        upper=True)
+    window_starts = get_window_starts(date_list, window_months, stride_months)
+    co_rows, code_rows, visit_counts = compute_window_counts(co_matrix,
+        visit_matrix, visit_dates, window_starts, window_months)
+    write_windows(window_starts, co_rows, code_rows, visit_counts, pair_list,
+        code_list, n_top, min_count)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,222 @@
+### Author: Edward Huang
+
+import itertools
+import json
+import math
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import resource
+from run_med2vec import build_command, get_num_codes
+import subprocess
+import sys
+import time
+
+### This script runs a hyperparameter sweep of med2vec on the local machine.
+### Reads a JSON search spec, schedules each run as its own process over a
+### fixed number of worker slots, and writes a manifest of the timings, final
+### costs, and checkpoint paths of every run.
+### Example spec:
+### {"search": "random", "n_runs": 20, "seed": 0, "n_workers": 4,
+###  "threads_per_run": 2, "memory_limit_mb": 8000, "n_epoch": 50,
+###  "model_type": ["baseline", "separated"], "objective": ["conditional",
+###  "pmi"], "window_size": [1, 2, 3], "cr_size": [100, 200],
+###  "vr_size": [100, 200], "batch_size": [500, 1000],
+###  "L2_reg": {"low": 0.0001, "high": 0.01, "log": true}}
+
+sweep_dir = './results/med2vec_sweep'
+hyperparameter_names = ['window_size', 'cr_size', 'vr_size', 'batch_size',
+    'L2_reg']
+blas_thread_variables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS']
+
+def read_spec(spec_fname):
+    '''
+    Reads the sweep spec and fills in the default scheduling options.
+    '''
+    f = open(spec_fname, 'r')
+    spec = json.load(f)
+    f.close()
+    defaults = {'search':'grid', 'n_runs':10, 'seed':0, 'n_workers':1,
+        'threads_per_run':1, 'memory_limit_mb':0, 'n_epoch':500,
+        'model_type':['baseline'], 'objective':['conditional']}
+    for key in defaults:
+        if key not in spec:
+            spec[key] = defaults[key]
+    assert spec['search'] in ['grid', 'random']
+    return spec
+
+def get_search_space(spec):
+    '''
+    Returns the dimensions of the search as an ordered list of (name, values)
+    pairs. values is either a list of choices or a dictionary with low, high,
+    and an optional log flag for continuous sampling.
+    '''
+    search_space = [('model_type', spec['model_type']), ('objective',
+        spec['objective'])]
+    for name in hyperparameter_names:
+        if name in spec:
+            search_space += [(name, spec[name])]
+    return search_space
+
+def sample_value(values, rng):
+    '''
+    Draws a single value for a random search dimension.
+    '''
+    if isinstance(values, list):
+        return rng.choice(values)
+    low, high = values['low'], values['high']
+    if values.get('log', False):
+        return 10 ** rng.uniform(math.log10(low), math.log10(high))
+    return rng.uniform(low, high)
+
+def get_run_configs(spec):
+    '''
+    Expands the spec into the list of run configurations. Grid search takes
+    the cross product of every list; random search samples n_runs points
+    using a generator seeded by the spec.
+    '''
+    search_space = get_search_space(spec)
+    names = [name for name, values in search_space]
+    config_list = []
+    if spec['search'] == 'grid':
+        for values in search_space:
+            assert isinstance(values[1], list), 'grid search needs lists'
+        for point in itertools.product(*[values for name, values in
+            search_space]):
+            config_list += [dict(zip(names, point))]
+    else:
+        rng = random.Random(spec['seed'])
+        for run_i in range(spec['n_runs']):
+            config_list += [dict((name, sample_value(values, rng)) for name,
+                values in search_space)]
+    for run_i, config in enumerate(config_list):
+        config['run_id'] = 'run_%03d' % run_i
+    return config_list
+
+def get_run_environment(threads_per_run):
+    '''
+    Pins the BLAS libraries of a run to a fixed number of threads so that
+    concurrent runs do not oversubscribe the cores.
+    '''
+    env = os.environ.copy()
+    for variable in blas_thread_variables:
+        env[variable] = str(threads_per_run)
+    return env
+
+def get_memory_limiter(memory_limit_mb):
+    '''
+    Returns a function that caps the address space of the child process, or
+    None if there is no memory limit.
+    '''
+    if memory_limit_mb <= 0:
+        return None
+    limit = memory_limit_mb * 1024 * 1024
+    def limit_memory():
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    return limit_memory
+
+def read_epoch_costs(log_fname):
+    '''
+    Parses the mean cost of every epoch out of a med2vec log.
+    '''
+    epoch_costs = []
+    f = open(log_fname, 'r')
+    for line in f:
+        if line.startswith('epoch:') and 'mean_cost:' in line:
+            epoch_costs += [float(line.strip().split('mean_cost:')[1])]
+    f.close()
+    return epoch_costs
+
+def get_checkpoint_paths(output_file, n_epoch):
+    '''
+    Returns the per-epoch model files that a run left on disk.
+    '''
+    checkpoint_list = []
+    for epoch in range(n_epoch):
+        checkpoint = '%s.%d.npz' % (output_file, epoch)
+        if os.path.exists(checkpoint):
+            checkpoint_list += [checkpoint]
+    return checkpoint_list
+
+def run_config(arguments):
+    '''
+    Launches one med2vec run and waits for it. Returns the manifest entry.
+    '''
+    config, spec, num_codes = arguments
+    run_dir = '%s/%s' % (sweep_dir, config['run_id'])
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+    pmi = ''
+    if config['objective'] == 'pmi':
+        pmi = 'pmi_'
+    output_file = '%s/%s%s_model' % (run_dir, pmi, config['model_type'])
+    hyperparameters = {'n_epoch':spec['n_epoch']}
+    for name in hyperparameter_names:
+        if name in config:
+            hyperparameters[name] = config[name]
+    command = build_command(config['model_type'], config['objective'],
+        num_codes, output_file, hyperparameters)
+
+    log_fname = '%s/log.txt' % run_dir
+    log = open(log_fname, 'w')
+    start_time = time.time()
+    return_code = subprocess.call(command, stdout=log,
+        stderr=subprocess.STDOUT, env=get_run_environment(
+            spec['threads_per_run']), preexec_fn=get_memory_limiter(
+            spec['memory_limit_mb']))
+    end_time = time.time()
+    log.close()
+
+    epoch_costs = read_epoch_costs(log_fname)
+    final_cost = None
+    if len(epoch_costs) > 0:
+        final_cost = epoch_costs[-1]
+    return {'run_id':config['run_id'], 'config':config, 'command':command,
+        'return_code':return_code, 'start_time':start_time,
+        'end_time':end_time, 'seconds':end_time - start_time,
+        'epoch_costs':epoch_costs, 'final_cost':final_cost,
+        'checkpoints':get_checkpoint_paths(output_file, spec['n_epoch']),
+        'log':log_fname}
+
+def write_manifest(spec, manifest):
+    '''
+    Writes the manifest out, sorted by final cost. Runs that failed go last.
+    '''
+    manifest = sorted(manifest, key=lambda run: (run['final_cost'] is None,
+        run['final_cost']))
+    out = open('%s/manifest.json' % sweep_dir, 'w')
+    json.dump({'spec':spec, 'runs':manifest}, out, indent=2, sort_keys=True)
+    out.close()
+
+def main():
+    if len(sys.argv) != 2:
+        print 'Usage: python %s sweep_spec.json' % sys.argv[0]
+        exit()
+    spec = read_spec(sys.argv[1])
+    if not os.path.exists(sweep_dir):
+        os.makedirs(sweep_dir)
+    num_codes = get_num_codes()
+    config_list = get_run_configs(spec)
+    print 'scheduling %d runs over %d workers' % (len(config_list),
+        spec['n_workers'])
+
+    # Each worker thread only supervises a child process, so the number of
+    # workers is the number of med2vec runs that train at the same time.
+    pool = ThreadPool(spec['n_workers'])
+    manifest = []
+    for run in pool.imap_unordered(run_config, [(config, spec, num_codes) for
+        config in config_list]):
+        manifest += [run]
+        print '%s finished in %fs, return code %d, final cost %s' % (
+            run['run_id'], run['seconds'], run['return_code'],
+            run['final_cost'])
+        # Rewrite the manifest after each run so partial sweeps are kept.
+        write_manifest(spec, manifest)
+    pool.close()
+    pool.join()
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+### Author: Edward Huang
+
+import disease_stratified_statistics as dss
+import numpy as np
+import os
+from scipy.sparse import csr_matrix
+import shutil
+import tempfile
+import unittest
+
+class WriteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved = (dss.store_fname, dss.index_fname,
+            dss.min_disease_visits)
+        dss.store_fname = os.path.join(self.folder, 'statistics.npz')
+        dss.index_fname = os.path.join(self.folder, 'disease_index.txt')
+        dss.min_disease_visits = 1
+
+    def tearDown(self):
+        dss.store_fname, dss.index_fname, dss.min_disease_visits = self.saved
+        shutil.rmtree(self.folder)
+
+    def test_zero_pmi_is_kept(self):
+        # Codes a and b co-occur once and occur once each, so their PMI is
+        # log2(1) = 0. Codes c and d co-occur twice.
+        code_names = np.array(['a', 'b', 'c', 'd'])
+        visit_matrix = csr_matrix(np.array([[1, 1, 0, 0], [0, 0, 1, 1], [0, 0,
+            1, 1]], dtype=np.float64))
+        disease_matrix = csr_matrix(np.ones((3, 1)))
+        code_counts = dss.group_by_disease(disease_matrix, visit_matrix)
+        co_matrix, co_list = dss.get_pair_incidence(visit_matrix,
+            visit_matrix, upper=True)
+        co_counts = dss.group_by_disease(disease_matrix, co_matrix)
+        table_dct = {'pmi':(co_counts, dss.get_pair_statistics(co_counts,
+            co_list, code_counts, code_counts), code_names[co_list])}
+        dss.write_store(table_dct, ['disease'], np.array([3]))
+
+        store = np.load(dss.store_fname)
+        self.assertEqual(len(store['pmi_scores']), len(store['pmi_counts']))
+        self.assertEqual(dss.load_disease_table('disease', 'pmi', min_count=0),
+            [('a', 'b', 0.0, 1), ('c', 'd', -1.0, 2)])
+
+if __name__ == '__main__':
+    unittest.main()
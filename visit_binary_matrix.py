@@ -1,11 +1,23 @@
 ### Author: Edward Huang
 
+from array import array
 import cPickle
+import numpy as np
+import profiling
+from scipy.sparse import csr_matrix
+import sys
 
 # This script creates the visit binary matrix. Must run create_med2vec_input.py
-# first.
+# first. Writes the matrix as a sparse CSR file and as a bit-packed matrix with
+# one row of bytes per visit. The text format is only written on request.
 # Run time: 5 seconds.
 
+sparse_fname = './data/visit_binary_matrix.npz'
+packed_fname = './data/visit_binary_matrix_packed.npy'
+text_fname = './data/visit_binary_matrix.txt'
+# Number of visits that are unpacked into a dense block at a time.
+chunk_size = 4096
+
 def read_code_list():
     '''
     Reads the list of symptoms and herbs.
@@ -31,16 +43,107 @@ def convert_to_binary_matrix(patient_matrix, code_list):
         binary_matrix += [binary_matrix_row]
     return binary_matrix
 
+def get_sparse_arrays(patient_matrix):
+    '''
+    Returns the CSR indices and indptr of the visits of a med2vec visit list,
+    and patient_indptr, where the visits of patient i are the rows from
+    patient_indptr[i] to patient_indptr[i + 1].
+    '''
+    indptr, indices, patient_indptr = array('l', [0]), array('i'), array('l',
+        [0])
+    for patient_matrix_row in patient_matrix:
+        if patient_matrix_row == [-1]:
+            patient_indptr.append(len(indptr) - 1)
+            continue
+        indices.extend(sorted(set(patient_matrix_row)))
+        indptr.append(len(indices))
+    patient_indptr.append(len(indptr) - 1)
+    return (np.frombuffer(indices, dtype=np.int32), np.frombuffer(indptr,
+        dtype=np.int64), np.frombuffer(patient_indptr, dtype=np.int64))
+
+def write_sparse_matrix(patient_matrix, num_codes):
+    '''
+    Writes the visits as a CSR matrix without the dense rows, along with the
+    visit offsets of each patient. Returns the number of visits.
+    '''
+    indices, indptr, patient_indptr = get_sparse_arrays(patient_matrix)
+    np.savez(sparse_fname, indices=indices, indptr=indptr, patient_indptr=
+        patient_indptr, shape=np.array([len(indptr) - 1, num_codes]))
+    return len(indptr) - 1
+
+def write_packed_matrix(patient_matrix, num_codes, num_visits):
+    '''
+    Writes the visits as an np.packbits matrix, one row of ceil(num_codes / 8)
+    bytes per visit, through a memory map so that only one chunk of dense
+    rows is held at a time.
+    '''
+    packed = np.lib.format.open_memmap(packed_fname, mode='w+', dtype=np.uint8,
+        shape=(num_visits, (num_codes + 7) // 8))
+    chunk = np.zeros((chunk_size, num_codes), dtype=bool)
+    chunk_start, chunk_row = 0, 0
+    for patient_matrix_row in patient_matrix:
+        if patient_matrix_row == [-1]:
+            continue
+        chunk[chunk_row, patient_matrix_row] = True
+        chunk_row += 1
+        if chunk_row == chunk_size:
+            packed[chunk_start:chunk_start + chunk_row] = np.packbits(chunk,
+                axis=1)
+            chunk[:] = False
+            chunk_start, chunk_row = chunk_start + chunk_row, 0
+    packed[chunk_start:chunk_start + chunk_row] = np.packbits(chunk[:chunk_row],
+        axis=1)
+    packed.flush()
+    del packed
+
+def load_sparse_visit_matrix():
+    '''
+    Returns the visit binary matrix as a scipy CSR matrix with one row per
+    visit and one column per code in code_list.
+    '''
+    data = np.load(sparse_fname)
+    indices = data['indices']
+    return csr_matrix((np.ones(len(indices), dtype=np.int8), indices,
+        data['indptr']), shape=tuple(data['shape']))
+
+def load_patient_indptr():
+    '''
+    Returns the visit offsets of each patient in the visit binary matrix.
+    '''
+    return np.load(sparse_fname)['patient_indptr']
+
+def load_packed_visit_matrix(num_codes, unpack=True):
+    '''
+    Returns the visit binary matrix as a numpy bool array. With unpack=False,
+    returns the memory-mapped bit-packed bytes instead, which can be read
+    row by row without loading the whole file.
+    '''
+    packed = np.load(packed_fname, mmap_mode='r')
+    if not unpack:
+        return packed
+    return np.unpackbits(packed, axis=1)[:, :num_codes].astype(bool)
+
 def main():
-    code_list = read_code_list()
-    f = open('./results/med2vec_input_baseline_visits.pickle', 'r')
-    patient_matrix = cPickle.load(f)
-    f.close()
-    binary_matrix = convert_to_binary_matrix(patient_matrix, code_list)
-    out = open('./data/visit_binary_matrix.txt', 'w')
-    for line in binary_matrix:
-        out.write(','.join(map(str, line)) + '\n')
-    out.close()
+    if len(sys.argv) not in [1, 2]:
+        print 'Usage: python %s text<optional>' % sys.argv[0]
+        exit()
+    with profiling.stage('parse'):
+        code_list = read_code_list()
+        f = open('./results/med2vec_input_baseline_visits.pickle', 'r')
+        patient_matrix = cPickle.load(f)
+        f.close()
+    with profiling.stage('matrix_build'):
+        num_visits = write_sparse_matrix(patient_matrix, len(code_list))
+        write_packed_matrix(patient_matrix, len(code_list), num_visits)
+
+    # The dense text format is gigabytes for real data, so it is only written
+    # for tools that still need it.
+    if len(sys.argv) == 2 and sys.argv[1] == 'text':
+        binary_matrix = convert_to_binary_matrix(patient_matrix, code_list)
+        out = open(text_fname, 'w')
+        for line in binary_matrix:
+            out.write(','.join(map(str, line)) + '\n')
+        out.close()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,174 @@
+### Author: Edward Huang
+
+import argparse
+import cPickle
+import json
+import numpy as np
+import os
+from scipy.sparse import csr_matrix
+import time
+from visit_binary_matrix import (get_sparse_arrays, load_patient_indptr,
+    load_sparse_visit_matrix, read_code_list)
+
+### This script runs the visits through a trained med2vec model,
+###     emb = ReLU(x W_emb + b_emb)
+###     visit = ReLU(emb W_hidden + b_hidden)
+### and writes every visit's vector and every patient's pooled vector. The
+### visits are read as a sparse matrix, so x W_emb sums the W_emb rows of
+### each visit's codes. Chunks of whole patients are computed at a time and
+### written to memory-mapped .npy files, so memory is bounded by chunk_size
+### visits. Outputs, in ./results/representations/<model name>/,
+###     visit_vectors.npy: one row per visit, in the order of the med2vec input.
+###     patient_vectors.npy: the mean or max of each patient's visit vectors.
+###     patient_indptr.npy: the visits of patient i are the rows from
+###         patient_indptr[i] to patient_indptr[i + 1] of visit_vectors.npy.
+###     patient_index.txt: the row, name, date of birth, and visit count of
+###         each patient.
+###     meta.json: the model, the visits, and the pooling of the vectors.
+### Must run create_med2vec_input.py and visit_binary_matrix.py first.
+
+def load_visits(visit_type):
+    '''
+    Returns the visit x code matrix and patient_indptr of the baseline visits,
+    or of the separated visits, where the symptoms and herbs of a visit are
+    two visits.
+    '''
+    if visit_type == 'baseline':
+        return load_sparse_visit_matrix(), load_patient_indptr()
+    f = open('./results/med2vec_input_separated_visits.pickle', 'r')
+    indices, indptr, patient_indptr = get_sparse_arrays(cPickle.load(f))
+    f.close()
+    return csr_matrix((np.ones(len(indices), dtype=np.int8), indices, indptr),
+        shape=(len(indptr) - 1, len(read_code_list()))), patient_indptr
+
+def read_patient_list(fname='./results/patient_list.txt'):
+    patient_list = []
+    f = open(fname, 'r')
+    for line in f:
+        patient_list += [line.rstrip('\n').split('\t')]
+    f.close()
+    return patient_list
+
+def get_patient_chunks(patient_indptr, chunk_size):
+    '''
+    Groups consecutive patients into chunks of at most chunk_size visits. A
+    patient with more visits is a chunk of its own. Returns the first patient
+    of each chunk, followed by the number of patients.
+    '''
+    chunk_starts, chunk_visits = [0], 0
+    for patient in range(len(patient_indptr) - 1):
+        n_visits = patient_indptr[patient + 1] - patient_indptr[patient]
+        if chunk_visits > 0 and chunk_visits + n_visits > chunk_size:
+            chunk_starts += [patient]
+            chunk_visits = 0
+        chunk_visits += n_visits
+    return chunk_starts + [len(patient_indptr) - 1]
+
+def represent_visits(visit_matrix, model):
+    '''
+    Returns the float32 visit vectors of a chunk of the visit matrix.
+    '''
+    emb_size = len(model['b_emb'])
+    emb = np.maximum(visit_matrix.dot(model['W_emb']) + model['b_emb'], 0)
+    # Demographic rows of W_hidden are not used.
+    return np.maximum(emb.dot(model['W_hidden'][:emb_size]) + model[
+        'b_hidden'], 0).astype(np.float32)
+
+def pool_visits(visit_vectors, local_indptr, pooling):
+    '''
+    Returns the mean or max of each patient's rows of visit_vectors.
+    '''
+    if pooling == 'max':
+        return np.maximum.reduceat(visit_vectors, local_indptr[:-1], axis=0)
+    return np.add.reduceat(visit_vectors, local_indptr[:-1], axis=0) / np.diff(
+        local_indptr)[:, None].astype(np.float32)
+
+def write_representations(visit_matrix, patient_indptr, model, out_dir,
+    pooling, chunk_size):
+    num_visits, num_patients = visit_matrix.shape[0], len(patient_indptr) - 1
+    hidden_size = len(model['b_hidden'])
+    visit_vectors = np.lib.format.open_memmap('%s/visit_vectors.npy' %
+        out_dir, mode='w+', dtype=np.float32, shape=(num_visits, hidden_size))
+    patient_vectors = np.lib.format.open_memmap('%s/patient_vectors.npy' %
+        out_dir, mode='w+', dtype=np.float32, shape=(num_patients,
+        hidden_size))
+    chunk_starts = get_patient_chunks(patient_indptr, chunk_size)
+    for start, end in zip(chunk_starts[:-1], chunk_starts[1:]):
+        visit_start, visit_end = patient_indptr[start], patient_indptr[end]
+        chunk_vectors = represent_visits(visit_matrix[visit_start:visit_end],
+            model)
+        visit_vectors[visit_start:visit_end] = chunk_vectors
+        patient_vectors[start:end] = pool_visits(chunk_vectors, patient_indptr[
+            start:end + 1] - visit_start, pooling)
+    visit_vectors.flush()
+    patient_vectors.flush()
+    del visit_vectors, patient_vectors
+    np.save('%s/patient_indptr.npy' % out_dir, patient_indptr)
+
+def write_patient_index(patient_list, patient_indptr, out_dir):
+    out = open('%s/patient_index.txt' % out_dir, 'w')
+    for row, (name, dob) in enumerate(patient_list):
+        out.write('%d\t%s\t%s\t%d\n' % (row, name, dob, patient_indptr[row + 1]
+            - patient_indptr[row]))
+    out.close()
+
+def load_patient_vectors(out_dir):
+    '''
+    Returns the memory-mapped patient vectors and the patient index rows.
+    '''
+    patient_list = []
+    f = open('%s/patient_index.txt' % out_dir, 'r')
+    for line in f:
+        row, name, dob, n_visits = line.rstrip('\n').split('\t')
+        patient_list += [(name, dob)]
+    f.close()
+    return np.load('%s/patient_vectors.npy' % out_dir, mmap_mode='r'
+        ), patient_list
+
+def write_meta(out_dir, model_fname, visit_type, pooling):
+    out = open('%s/meta.json' % out_dir, 'w')
+    json.dump({'model_fname':model_fname, 'visits':visit_type, 'pooling':
+        pooling}, out)
+    out.close()
+
+def read_pooling(out_dir):
+    '''
+    Returns the pooling of the patient vectors, or None for outputs written
+    before it was recorded.
+    '''
+    if not os.path.exists('%s/meta.json' % out_dir):
+        return None
+    return json.load(open('%s/meta.json' % out_dir, 'r'))['pooling']
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model_fname', help='A med2vec model archive, e.g. '
+        './results/med2vec_output/baseline_model.499.npz')
+    parser.add_argument('--visits', choices=['baseline', 'separated'],
+        default='baseline', help='The visits the model was trained on '
+        '(default value: baseline)')
+    parser.add_argument('--pooling', choices=['mean', 'max'], default='mean',
+        help='(default value: mean)')
+    parser.add_argument('--chunk_size', type=int, default=65536, help='The '
+        'number of visits computed at a time (default value: 65536)')
+    args = parser.parse_args()
+
+    out_dir = './results/representations/%s' % os.path.basename(
+        args.model_fname)[:-len('.npz')]
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    model = np.load(args.model_fname)
+    model = dict((name, model[name]) for name in ['W_emb', 'b_emb',
+        'W_hidden', 'b_hidden'])
+    visit_matrix, patient_indptr = load_visits(args.visits)
+    patient_list = read_patient_list()
+    assert len(patient_list) == len(patient_indptr) - 1
+    write_representations(visit_matrix, patient_indptr, model, out_dir,
+        args.pooling, args.chunk_size)
+    write_patient_index(patient_list, patient_indptr, out_dir)
+    write_meta(out_dir, args.model_fname, args.visits, args.pooling)
+
+if __name__ == '__main__':
+    start_time = time.time()
+    main()
+    print "---%f seconds---" % (time.time() - start_time)
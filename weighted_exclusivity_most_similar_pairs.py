@@ -5,8 +5,10 @@
 
 from collections import OrderedDict
 import datetime
-from create_med2vec_input import get_patient_dct
+from create_med2vec_input import (get_patient_dct, prune_patient_dct,
+    read_pruned_codes)
 import os
+from result_store import insert_sets
 import subprocess
 import sys
 import time
@@ -98,6 +100,7 @@ def translate_int_to_chinese(code_list, ex_set_out_fname, set_size):
     herb_count_dct = read_code_file('herb')
     f = open(ex_set_out_fname + '-sampled-sets.tsv', 'r')
     out = open(ex_set_out_fname + '-sampled-sets-chinese.tsv', 'w')
+    set_list = []
     for i, line in enumerate(f):
         if i == 0:
             out.write(line)
@@ -114,8 +117,10 @@ def translate_int_to_chinese(code_list, ex_set_out_fname, set_size):
         if False not in cand_are_herbs or True not in cand_are_herbs:
             continue
         out.write('%s\t%s\n' % (','.join(candidate_codes), '\t'.join(line[1:])))
+        set_list += [(candidate_codes, float(line[1]))]
     out.close()
     f.close()
+    insert_sets('wext_%s' % os.path.basename(ex_set_out_fname), set_list)
 
 def main():
     if len(sys.argv) != 2:
@@ -124,7 +129,7 @@ def main():
     set_size = int(sys.argv[1])
     generate_directories()
     code_list = read_code_list()
-    patient_dct = get_patient_dct()
+    patient_dct = prune_patient_dct(get_patient_dct(), read_pruned_codes())
 
     # Create mutation file.
     mut_fname = './data/wext_mutation_file.txt'